@@ -1,9 +1,19 @@
+import { randomUUID } from 'crypto';
 import { Request, Response } from 'express';
 import { PredictionAnalysis, User, GlucoseReading, UserHealthProfile, Notification, ForecastLog, MedicationLog, Meal } from '../models';
 import type { IMedicationLog } from '../models/MedicationLog';
 import type { IMeal } from '../models/Meal';
 
 const ML_API_URL = process.env.ML_API_URL || 'http://localhost:8000';
+// Optional latency budget for the 30-min forecast; the ML service answers with
+// its statistical forecast when the model cannot finish within it
+const ML_FORECAST_BUDGET_MS = process.env.ML_FORECAST_BUDGET_MS;
+
+// Forward the caller's request id (or start one) so ML service logs can be joined to this request
+const mlHeaders = (req: Request): Record<string, string> => ({
+    'Content-Type': 'application/json',
+    'X-Request-ID': (req.headers['x-request-id'] as string | undefined) || randomUUID(),
+});
 
 interface MLResult {
     predicted_risk: number;
@@ -23,6 +33,7 @@ interface Glucose30MLResult {
     riskAlert: string | null;
     factors: string[];
     modelUsed: string;
+    fallbackReason?: string | null;
     suggestions?: string[] | null;
     missingDataActions?: { label: string; href: string; reason: string; icon?: string }[] | null;
 }
@@ -71,7 +82,7 @@ export const getPrediction = async (req: Request, res: Response): Promise<void>
         try {
             const response = await fetch(`${ML_API_URL}/predict`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: mlHeaders(req),
                 body: JSON.stringify(features),
             });
 
@@ -405,6 +416,7 @@ export const getGlucose30 = async (req: Request, res: Response): Promise<void> =
             readingType: r.readingType || 'random',
             hour: new Date(r.recordedAt).getHours(),
             dayOfWeek: new Date(r.recordedAt).getDay(),
+            timestamp: new Date(r.recordedAt).getTime(),
             medicationTaken: r.medicationTaken || false,
             mealContext: r.mealContext || null,
             activityContext: r.activityContext || null,
@@ -462,7 +474,10 @@ export const getGlucose30 = async (req: Request, res: Response): Promise<void> =
         try {
             const response = await fetch(`${ML_API_URL}/predict-glucose-30`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: {
+                    ...mlHeaders(req),
+                    ...(ML_FORECAST_BUDGET_MS ? { 'X-Latency-Budget-Ms': ML_FORECAST_BUDGET_MS } : {}),
+                },
                 body: JSON.stringify(payload),
             });
 
@@ -0,0 +1,270 @@
+"""
+Bluely Forecast Accuracy Tracking
+==================================
+Running accuracy of the 30-minute forecasts against the readings that
+actually arrive: once a forecast's target time has a reading, the backend
+posts the (predicted, actual) pair (ForecastLog's predictedGlucose and
+actualGlucose) and this module folds it into per-user, per-model and
+global aggregates.
+
+Every group keeps four sums — pairs, Σ|error|, Σerror and hits (|error| ≤
+HIT_TOLERANCE mg/dL) — twice: all-time, and forward-decayed with a
+half-life of ACCURACY_HALF_LIFE_HOURS for "recent" accuracy. Forward decay
+weights a pair by exp((t − landmark) / τ) when it is added and divides by
+exp((now − landmark) / τ) when read, so adding is a commutative np.add.at
+into a (groups, 4) matrix whatever order pairs arrive in, and reading is a
+division; the landmark moves forward (rescaling the sums) before the
+weights can overflow. Memory is four floats per group and statistic,
+whatever the number of forecasts.
+
+    mae = Σ|predicted − actual| / n
+    bias = Σ(predicted − actual) / n       positive: forecasts run high
+    hitRate = hits / n
+
+Configuration (env):
+    ACCURACY_HALF_LIFE_HOURS=168     half-life of the "recent" aggregates
+
+Usage:
+    from accuracy import AccuracyTracker
+    tracker = AccuracyTracker.from_env()
+    tracker.record(user_ids, predicted, actual, timestamps_ms, models)
+    tracker.summary()               # global + per model
+    tracker.user_summary("uid")
+
+    python accuracy.py --pairs 1000000 --users 50000    # synthetic benchmark
+
+Output:
+    Ingest throughput and the largest difference from a batch recomputation
+"""
+
+import argparse
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+HIT_TOLERANCE = 20.0            # mg/dL either side of the realized reading
+DEFAULT_HALF_LIFE_HOURS = 168.0
+INITIAL_CAPACITY = 1024
+MAX_EXPONENT = 50.0             # rebase before forward-decay weights pass e^50
+
+# Columns of the aggregate matrices
+N, ABS_ERROR, ERROR, HITS = range(4)
+ALL = "all"
+
+
+class GroupAggregates:
+    """All-time and forward-decayed sums of the four statistics per group key."""
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self._rows: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.totals = np.zeros((capacity, 4))
+        self.decayed = np.zeros((capacity, 4))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        """Row of every key, adding new groups (and growing the matrices) as needed."""
+        unique, inverse = np.unique(np.asarray(keys, dtype=object), return_inverse=True)
+        rows = np.empty(len(unique), dtype=np.int64)
+        for i, key in enumerate(unique):
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = len(self.keys)
+                self.keys.append(key)
+            rows[i] = row
+        if len(self.keys) > len(self.totals):
+            capacity = max(2 * len(self.totals), len(self.keys))
+            for name in ("totals", "decayed"):
+                grown = np.zeros((capacity, 4))
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, grown)
+        return rows[inverse.ravel()]
+
+    def add(self, rows: np.ndarray, stats: np.ndarray, weights: np.ndarray) -> None:
+        np.add.at(self.totals, rows, stats)
+        np.add.at(self.decayed, rows, stats * weights[:, None])
+
+    def row(self, key: str) -> Optional[int]:
+        return self._rows.get(key)
+
+
+def _metrics(sums: np.ndarray, count_key: str) -> Dict[str, Any]:
+    n = sums[N]
+    if n <= 0:
+        return {count_key: 0, "mae": None, "bias": None, "hitRate": None}
+    return {
+        count_key: int(n) if count_key == "count" else round(float(n), 2),
+        "mae": round(float(sums[ABS_ERROR] / n), 2),
+        "bias": round(float(sums[ERROR] / n), 2),
+        "hitRate": round(float(sums[HITS] / n), 4),
+    }
+
+
+class AccuracyTracker:
+    """Incremental forecast accuracy per user, per model and overall."""
+
+    def __init__(self, half_life_hours: float = DEFAULT_HALF_LIFE_HOURS, tolerance: float = HIT_TOLERANCE):
+        self.half_life_hours = half_life_hours
+        self.tolerance = tolerance
+        self._tau_ms = half_life_hours * 3_600_000 / math.log(2)
+        self._landmark_ms: Optional[float] = None
+        self._lock = threading.Lock()
+        self.users = GroupAggregates()
+        self.groups = GroupAggregates(capacity=8)     # ALL + one per model
+
+    @classmethod
+    def from_env(cls) -> "AccuracyTracker":
+        return cls(half_life_hours=float(os.environ.get("ACCURACY_HALF_LIFE_HOURS", DEFAULT_HALF_LIFE_HOURS)))
+
+    def _weights(self, timestamps_ms: np.ndarray) -> np.ndarray:
+        """Forward-decay weights, moving the landmark first if the newest would overflow."""
+        newest = float(timestamps_ms.max())
+        if self._landmark_ms is None:
+            self._landmark_ms = newest
+        elif (newest - self._landmark_ms) / self._tau_ms > MAX_EXPONENT:
+            scale = math.exp(-(newest - self._landmark_ms) / self._tau_ms)
+            self.users.decayed *= scale
+            self.groups.decayed *= scale
+            self._landmark_ms = newest
+        return np.exp((timestamps_ms - self._landmark_ms) / self._tau_ms)
+
+    def record(
+        self,
+        user_ids: Sequence[str],
+        predicted: Sequence[float],
+        actual: Sequence[float],
+        timestamps_ms: Optional[Sequence[float]] = None,
+        models: Optional[Sequence[str]] = None,
+    ) -> int:
+        """
+        Add (forecast, realized reading) pairs, one user id each. Timestamps
+        (epoch ms of the realized reading; default now) place pairs in the
+        decayed aggregates; `models` is each forecast's modelUsed. Pairs with
+        a non-finite value or timestamp are dropped, since one NaN would
+        poison the shared sums and the decay landmark. Returns the number of
+        pairs recorded.
+        """
+        predicted = np.asarray(predicted, dtype=np.float64)
+        error = predicted - np.asarray(actual, dtype=np.float64)
+        now_ms = time.time() * 1000
+        if timestamps_ms is None:
+            timestamps = np.full(len(error), now_ms)
+        else:
+            # A reading cannot be realized in the future; clamp skewed clocks
+            timestamps = np.minimum(np.asarray(timestamps_ms, dtype=np.float64), now_ms)
+        finite = np.isfinite(error) & np.isfinite(timestamps)
+        if not finite.all():
+            error, timestamps = error[finite], timestamps[finite]
+            user_ids = [u for u, keep in zip(user_ids, finite) if keep]
+            if models is not None:
+                models = [m for m, keep in zip(models, finite) if keep]
+        if not len(error):
+            return 0
+
+        stats = np.empty((len(error), 4))
+        stats[:, N] = 1.0
+        stats[:, ABS_ERROR] = np.abs(error)
+        stats[:, ERROR] = error
+        stats[:, HITS] = stats[:, ABS_ERROR] <= self.tolerance
+
+        with self._lock:
+            weights = self._weights(timestamps)
+            self.users.add(self.users.rows(user_ids), stats, weights)
+            group_rows = self.groups.rows([ALL])
+            self.groups.add(np.repeat(group_rows, len(error)), stats, weights)
+            if models is not None:
+                self.groups.add(self.groups.rows(models), stats, weights)
+        return len(error)
+
+    def _summarize(self, aggregates: GroupAggregates, row: int, now_ms: float) -> Dict[str, Any]:
+        decay = math.exp(-(now_ms - self._landmark_ms) / self._tau_ms)
+        return {
+            **_metrics(aggregates.totals[row], "count"),
+            "recent": _metrics(aggregates.decayed[row] * decay, "weight"),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Global and per-model accuracy, all-time and recent."""
+        now_ms = time.time() * 1000
+        with self._lock:
+            if self._landmark_ms is None:
+                overall = {**_metrics(np.zeros(4), "count"), "recent": _metrics(np.zeros(4), "weight")}
+                models = {}
+            else:
+                overall = self._summarize(self.groups, self.groups.row(ALL), now_ms)
+                models = {key: self._summarize(self.groups, row, now_ms)
+                          for row, key in enumerate(self.groups.keys) if key != ALL}
+            return {
+                "halfLifeHours": self.half_life_hours,
+                "tolerance": self.tolerance,
+                "trackedUsers": len(self.users),
+                "overall": overall,
+                "models": models,
+            }
+
+    def user_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """One user's accuracy, or None when no pair was recorded for them."""
+        now_ms = time.time() * 1000
+        with self._lock:
+            row = self.users.row(user_id)
+            return None if row is None else self._summarize(self.users, row, now_ms)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark incremental forecast-accuracy tracking.")
+    parser.add_argument("--pairs", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--batch", type=int, default=10_000, help="pairs per record() call")
+    parser.add_argument("--days", type=float, default=90, help="time span the pairs cover")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("Bluely Forecast Accuracy Tracking")
+    print("=" * 60)
+
+    print(f"\n[1/3] Generating {args.pairs:,} pairs for {args.users:,} users ...")
+    rng = np.random.default_rng(0)
+    user_ids = np.array([f"user-{i}" for i in range(args.users)], dtype=object)[rng.integers(0, args.users, args.pairs)]
+    actual = rng.uniform(50, 300, args.pairs)
+    predicted = actual + rng.normal(2, 15, args.pairs)
+    timestamps = np.sort(time.time() * 1000 - rng.uniform(0, args.days * 86_400_000, args.pairs))
+    models = np.where(rng.random(args.pairs) < 0.9, "ohiot1dm", "statistical").astype(object)
+
+    print(f"\n[2/3] Recording in batches of {args.batch:,} ...")
+    tracker = AccuracyTracker.from_env()
+    t0 = time.perf_counter()
+    for lo in range(0, args.pairs, args.batch):
+        hi = lo + args.batch
+        tracker.record(user_ids[lo:hi], predicted[lo:hi], actual[lo:hi], timestamps[lo:hi], models[lo:hi])
+    elapsed = time.perf_counter() - t0
+    print(f"  {elapsed:.2f} s ({args.pairs / elapsed:,.0f} pairs/s)")
+
+    print("\n[3/3] Checking against a batch recomputation ...")
+    error = predicted - actual
+    weights = 0.5 ** ((time.time() * 1000 - timestamps) / (tracker.half_life_hours * 3_600_000))
+    expected = {
+        "mae": np.abs(error).mean(), "bias": error.mean(), "hitRate": (np.abs(error) <= HIT_TOLERANCE).mean(),
+        "recent mae": (weights * np.abs(error)).sum() / weights.sum(),
+    }
+    summary = tracker.summary()
+    overall = summary["overall"]
+    got = {"mae": overall["mae"], "bias": overall["bias"], "hitRate": overall["hitRate"],
+           "recent mae": overall["recent"]["mae"]}
+    for key in expected:
+        print(f"  {key:<11} tracked {got[key]:>8}   recomputed {expected[key]:.4f}")
+    first = user_ids[0]
+    mine = user_ids == first
+    print(f"  {first}: {tracker.user_summary(first)['count']} pairs tracked, {int(mine.sum())} recomputed, "
+          f"MAE {tracker.user_summary(first)['mae']} vs {np.abs(error[mine]).mean():.2f}")
+    worst = max(abs(got[k] - expected[k]) / max(abs(expected[k]), 1) for k in expected)
+    print("\n✓ Aggregates match the recomputation" if worst < 1e-2 else "\n✗ Aggregates differ from the recomputation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Bluely App Export Ingestion
+============================
+Streams JSONL exports of the app's Mongo collections (one document per line,
+as written by `mongoexport`) into the per-section frames that
+build_temporal_features consumes — the same dict shape load_patient_xml
+returns for an OhioT1DM patient.
+
+    GlucoseReading  recordedAt, value, unit       → glucose   (mmol/L converted to mg/dL)
+    Meal            timestamp, carbsEstimate      → meal
+    MedicationLog   takenAt, medicationType, dosage → bolus   (rapid-acting insulin only)
+    Activity        timestamp, activityLevel, durationMinutes → exercise
+
+Exports are not ordered by user, so ingestion is two passes with bounded
+memory:
+
+  1. every file is read line by line and each document is reduced to a
+     compact row appended to one of `partitions` spill files, chosen by a
+     hash of its firebaseUid;
+  2. spill partitions are loaded one at a time, grouped by user and sorted
+     by time, and each user's frames are yielded.
+
+Peak memory is one partition (≈ total rows / partitions) plus one user's
+frames, however large the exports are. Dates may be ISO strings, Extended
+JSON `{"$date": ...}` (ISO string or epoch milliseconds) or epoch
+milliseconds; times are kept as naive UTC. Lines that are malformed or
+miss a user, time or value are counted and skipped.
+
+Usage:
+    from app_export import jsonl_sources
+    for user, split, label, digests, data in jsonl_sources("readings.jsonl", meals_path="meals.jsonl"):
+        X, y = build_temporal_features(glucose_df=data["glucose"], ...)
+
+    python dataset.py build datasets/app --source jsonl --readings readings.jsonl \\
+        --meals meals.jsonl --medications medication_logs.jsonl --activities activities.jsonl
+    python app_export.py readings.jsonl --meals meals.jsonl    # ingestion summary
+
+Output:
+    Per user: {"glucose", "meal", "bolus", "exercise", "sleep",
+    "heart_rate", "steps"} DataFrames sorted by timestamp
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pipeline import file_digest
+
+try:
+    import orjson
+    _loads: Callable[[Any], Any] = orjson.loads
+except ImportError:  # pragma: no cover - optional speed-up
+    _loads = json.loads
+
+MGDL_PER_MMOL = 18.0
+RAPID_INSULIN = "insulin_rapid"
+DEFAULT_PARTITIONS = 64
+
+# Spill columns per section (after user and timestamp)
+SECTIONS: Dict[str, List[str]] = {
+    "glucose": ["value"],
+    "meal": ["carbs"],
+    "bolus": ["dose"],
+    "exercise": ["intensity", "duration"],
+}
+ACTIVITY_INTENSITY = {"low": 1.0, "medium": 2.0, "high": 3.0}
+
+
+# ── Document parsing ────────────────────────────────────────────────────────
+
+def parse_time(value: Any) -> Optional[int]:
+    """Epoch nanoseconds (UTC) of an exported date, or None if unusable."""
+    if isinstance(value, dict):
+        value = value.get("$date", value.get("$numberLong"))
+        if isinstance(value, dict):
+            value = value.get("$numberLong")
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float)) or (isinstance(value, str) and value.lstrip("-").isdigit()):
+            return int(float(value) * 1_000_000)
+        ts = pd.Timestamp(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if ts is pd.NaT:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.value
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, dict):
+        value = value.get("$numberDouble", value.get("$numberInt", value.get("$numberLong")))
+    try:
+        out = float(value)
+    except (TypeError, ValueError):
+        return None
+    return out if np.isfinite(out) else None
+
+
+def reading_row(doc: Dict[str, Any]) -> Optional[Tuple[float, ...]]:
+    value = _number(doc.get("value"))
+    if value is None:
+        return None
+    if doc.get("unit") == "mmol/L":
+        value *= MGDL_PER_MMOL
+    return (value,)
+
+
+def meal_row(doc: Dict[str, Any]) -> Optional[Tuple[float, ...]]:
+    carbs = _number(doc.get("carbsEstimate"))
+    return (carbs if carbs is not None else 0.0,)
+
+
+def medication_row(doc: Dict[str, Any]) -> Optional[Tuple[float, ...]]:
+    if doc.get("medicationType") != RAPID_INSULIN:
+        return None
+    dose = _number(doc.get("dosage"))
+    return (dose,) if dose is not None else None
+
+
+def activity_row(doc: Dict[str, Any]) -> Optional[Tuple[float, ...]]:
+    duration = _number(doc.get("durationMinutes"))
+    return ACTIVITY_INTENSITY.get(doc.get("activityLevel"), 0.0), duration if duration is not None else 0.0
+
+
+# collection → (section, time field, row builder)
+COLLECTIONS: Dict[str, Tuple[str, str, Callable[[Dict[str, Any]], Optional[Tuple[float, ...]]]]] = {
+    "GlucoseReading": ("glucose", "recordedAt", reading_row),
+    "Meal": ("meal", "timestamp", meal_row),
+    "MedicationLog": ("bolus", "takenAt", medication_row),
+    "Activity": ("exercise", "timestamp", activity_row),
+}
+
+
+def iter_jsonl(path: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """Documents of a JSONL (optionally .gz) file, line by line; None for a malformed line."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                doc = _loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield doc if isinstance(doc, dict) else None
+
+
+# ── Partitioned spill ───────────────────────────────────────────────────────
+
+class Partitioner:
+    """Hash-partitioned, append-only spill of compact rows on local disk."""
+
+    def __init__(self, partitions: int = DEFAULT_PARTITIONS, workdir: Optional[str] = None):
+        self.partitions = partitions
+        self.root = tempfile.mkdtemp(prefix="bluely-ingest-", dir=workdir)
+        self._files: Dict[Tuple[str, int], Any] = {}
+
+    def _file(self, section: str, part: int):
+        key = (section, part)
+        if key not in self._files:
+            self._files[key] = open(self.path(section, part), "a", encoding="utf-8", newline="")
+        return self._files[key]
+
+    def path(self, section: str, part: int) -> str:
+        return os.path.join(self.root, f"{section}-{part:04d}.tsv")
+
+    def partition_of(self, user: str) -> int:
+        return zlib.crc32(user.encode("utf-8")) % self.partitions
+
+    def add(self, section: str, user: str, ts: int, row: Tuple[float, ...]) -> None:
+        fields = "\t".join(repr(v) for v in row)
+        self._file(section, self.partition_of(user)).write(f"{user}\t{ts}\t{fields}\n")
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def load(self, section: str, part: int) -> pd.DataFrame:
+        columns = ["user", "timestamp"] + SECTIONS[section]
+        path = self.path(section, part)
+        if not os.path.exists(path):
+            return pd.DataFrame({c: [] for c in columns})
+        df = pd.read_csv(path, sep="\t", header=None, names=columns, dtype={"user": str},
+                         quoting=3, keep_default_na=False)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ns")
+        return df
+
+    def cleanup(self) -> None:
+        self.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _empty(*columns: str) -> pd.DataFrame:
+    return pd.DataFrame({c: [] for c in ("timestamp",) + columns})
+
+
+def iter_user_data(
+    files: Dict[str, str],
+    partitions: int = DEFAULT_PARTITIONS,
+    workdir: Optional[str] = None,
+    stats: Optional[Dict[str, Dict[str, int]]] = None,
+) -> Iterator[Tuple[str, Dict[str, pd.DataFrame]]]:
+    """
+    Yield (firebaseUid, frames) for every user with glucose readings.
+    `files` maps a collection name (see COLLECTIONS) to its JSONL export.
+    Per-collection line counts are accumulated into `stats` if given.
+    """
+    stats = stats if stats is not None else {}
+    spill = Partitioner(partitions, workdir)
+    try:
+        # ── Pass 1: stream documents into per-user partitions
+        for collection, path in files.items():
+            section, time_field, to_row = COLLECTIONS[collection]
+            counts = stats.setdefault(collection, {"lines": 0, "kept": 0, "skipped": 0})
+            for doc in iter_jsonl(path):
+                counts["lines"] += 1
+                if doc is None:
+                    counts["skipped"] += 1
+                    continue
+                user = doc.get("firebaseUid")
+                ts = parse_time(doc.get(time_field))
+                row = to_row(doc) if user and ts is not None else None
+                if row is None:
+                    counts["skipped"] += 1
+                    continue
+                spill.add(section, str(user), ts, row)
+                counts["kept"] += 1
+        spill.close()
+
+        # ── Pass 2: one partition at a time, grouped by user
+        for part in range(partitions):
+            frames = {section: spill.load(section, part) for section in SECTIONS}
+            if frames["glucose"].empty:
+                continue
+            grouped = {
+                section: dict(tuple(df.sort_values(["user", "timestamp"], kind="stable").groupby("user", sort=False)))
+                for section, df in frames.items()
+            }
+            del frames
+            for user in sorted(grouped["glucose"]):
+                data = {}
+                for section, columns in SECTIONS.items():
+                    df = grouped[section].get(user)
+                    data[section] = (_empty(*columns) if df is None
+                                     else df[["timestamp"] + columns].reset_index(drop=True))
+                data["sleep"] = _empty("quality")
+                data["heart_rate"] = _empty("value")
+                data["steps"] = _empty("value")
+                yield user, data
+    finally:
+        spill.cleanup()
+
+
+def jsonl_sources(
+    readings_path: str,
+    meals_path: Optional[str] = None,
+    medications_path: Optional[str] = None,
+    activities_path: Optional[str] = None,
+    split: str = "training",
+    partitions: int = DEFAULT_PARTITIONS,
+    stats: Optional[Dict[str, Dict[str, int]]] = None,
+):
+    """dataset.py / update_ohio.py source: (user, split, label, digests, frames) per user."""
+    files = {"GlucoseReading": readings_path}
+    for collection, path in (("Meal", meals_path), ("MedicationLog", medications_path), ("Activity", activities_path)):
+        if path:
+            files[collection] = path
+    digests = [file_digest(p) for p in files.values()]
+    label = os.path.basename(readings_path)
+    for user, data in iter_user_data(files, partitions, stats=stats):
+        yield user, split, label, digests, data
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Summarise JSONL app exports as per-user training frames.")
+    parser.add_argument("readings", help="GlucoseReading export (JSONL, optionally .gz)")
+    parser.add_argument("--meals", default=None, help="Meal export")
+    parser.add_argument("--medications", default=None, help="MedicationLog export")
+    parser.add_argument("--activities", default=None, help="Activity export")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS)
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("Bluely App Export Ingestion")
+    print("=" * 60)
+    stats: Dict[str, Dict[str, int]] = {}
+    t0 = time.perf_counter()
+    users = 0
+    totals = {section: 0 for section in SECTIONS}
+    for user, _, _, _, data in jsonl_sources(args.readings, args.meals, args.medications, args.activities,
+                                             partitions=args.partitions, stats=stats):
+        users += 1
+        for section in SECTIONS:
+            totals[section] += len(data[section])
+    elapsed = time.perf_counter() - t0
+
+    for collection, counts in stats.items():
+        print(f"  {collection:<15s} {counts['lines']:>10,} lines  {counts['kept']:>10,} kept  "
+              f"{counts['skipped']:>8,} skipped")
+    print(f"\n✓ {users:,} user(s): " + ", ".join(f"{totals[s]:,} {s}" for s in SECTIONS)
+          + f" in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
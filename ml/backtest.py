@@ -0,0 +1,442 @@
+"""
+Bluely 30-Minute Forecast Backtest
+====================================
+Replays reading histories through the same pipeline that serves
+POST /predict-glucose-30 — Ohio feature vector, GBR (or the statistical /
+Kalman fallback), meal / medication / time-of-day / activity adjustments,
+sparse-data anchoring and safety bounds — and scores the final predicted
+value against the reading actually observed 30 minutes later.
+
+train_ohio.py reports the error of the raw GBR only; this measures what
+users get. Every reading is treated as a "now": the server payload is
+reconstructed the way the backend builds it (the 20 most recent readings,
+meals logged in the last 4 h, medications logged in the last 6 h), and the
+whole replay runs as NumPy batches through forecast.py.
+
+Sources:
+    ohio  OhioT1DM XML files (meals from <meal>, boluses as rapid insulin,
+          <exercise> events as activity context)
+    csv   Exported reading history: timestamp,value[,user]
+          optional --meals     timestamp,carbs[,user]
+          optional --medications timestamp,medication_type,dosage[,user]
+
+Usage:
+    python backtest.py
+    python backtest.py --split training --on-medication
+    python backtest.py --source csv --readings export.csv --meals meals.csv
+    python backtest.py --statistical --output backtest_report.json
+    python backtest.py --kalman
+    python backtest.py --kinetics
+
+Output:
+    MAE / RMSE, ±20 / ±40 mg/dL hit rates, Clarke error-grid zones A–E and
+    samples per second (optionally written as JSON with --output)
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import forecast
+import kinetics
+from kalman import KalmanForecaster
+from model_bundle import OHIO_BUNDLE_PATH, load_bundle
+from parse_ohio import DATA_DIR, PATIENT_IDS, load_patient_xml
+
+HISTORY_WINDOW = 20         # readings sent by the backend
+HORIZON_MIN = 30
+TOLERANCE_MIN = 5           # max distance of the target reading from t+30min
+MEAL_LOOKBACK_H = 4         # backend: meals logged in the last 4 hours
+MED_LOOKBACK_H = 6          # backend: medications logged in the last 6 hours
+MEAL_LIMIT = 10
+MED_LIMIT = 10
+ACTIVE_LEVELS = ("high", "frequent", "very_active", "active")
+
+CLARKE_ZONES = ("A", "B", "C", "D", "E")
+_NS_PER_HOUR = 3600 * 10**9
+
+
+# ── Loading ─────────────────────────────────────────────────────────────────
+
+def _empty_events(*columns: str) -> pd.DataFrame:
+    return pd.DataFrame({c: [] for c in ("timestamp",) + columns})
+
+
+def load_ohio_series(split: str = "testing", patients: Optional[List[int]] = None) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """One series per OhioT1DM patient: glucose, meals, boluses as rapid insulin, exercise."""
+    series = {}
+    for pid in patients or PATIENT_IDS:
+        path = os.path.join(DATA_DIR, f"{pid}-ws-{split}.xml")
+        if not os.path.exists(path):
+            print(f"  ⚠ Skipping patient {pid}: {path} not found")
+            continue
+        data = load_patient_xml(path)
+        bolus = data["bolus"]
+        series[str(pid)] = {
+            "glucose": data["glucose"][["timestamp", "value"]],
+            "meal": data["meal"][["timestamp", "carbs"]],
+            "medication": pd.DataFrame({
+                "timestamp": bolus["timestamp"],
+                "medication_type": "insulin_rapid",
+                "dosage": bolus["dose"],
+            }),
+            "exercise": data["exercise"][["timestamp"]],
+        }
+    return series
+
+
+def _split_by_user(df: Optional[pd.DataFrame], user: str, columns: List[str]) -> pd.DataFrame:
+    if df is None:
+        return _empty_events(*columns)
+    if "user" in df.columns:
+        df = df[df["user"].astype(str) == user]
+    return df[["timestamp"] + columns]
+
+
+def load_csv_series(
+    readings_path: str, meals_path: Optional[str] = None, medications_path: Optional[str] = None
+) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """Series from exported CSVs, one per `user` value (or a single series without that column)."""
+    readings = pd.read_csv(readings_path, parse_dates=["timestamp"])
+    meals = pd.read_csv(meals_path, parse_dates=["timestamp"]) if meals_path else None
+    meds = pd.read_csv(medications_path, parse_dates=["timestamp"]) if medications_path else None
+
+    users = readings["user"].astype(str).unique() if "user" in readings.columns else ["all"]
+    series = {}
+    for user in users:
+        series[user] = {
+            "glucose": _split_by_user(readings, user, ["value"]),
+            "meal": _split_by_user(meals, user, ["carbs"]),
+            "medication": _split_by_user(meds, user, ["medication_type", "dosage"]),
+            "exercise": _empty_events(),
+        }
+    return series
+
+
+# ── Payload reconstruction ──────────────────────────────────────────────────
+
+def _ns(col: pd.Series) -> np.ndarray:
+    return pd.to_datetime(col).values.astype("datetime64[ns]").astype(np.int64)
+
+
+def _round_hours(hours: np.ndarray) -> np.ndarray:
+    """Hours rounded to 0.1 like the backend (Math.round(h * 10) / 10)."""
+    return np.floor(hours * 10 + 0.5) / 10
+
+
+def _recent_events(event_ns: np.ndarray, at_ns: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the `limit` most recent events at or before each time, newest first (-1 = none)."""
+    last = np.searchsorted(event_ns, at_ns, side="right") - 1
+    idx = last[:, None] - np.arange(limit)[None, :]
+    return np.where(idx >= 0, idx, -1)
+
+
+def _hours_since(event_ns: np.ndarray, idx: np.ndarray, at_ns: np.ndarray) -> np.ndarray:
+    safe = np.where(idx >= 0, idx, 0)
+    hours = (at_ns[:, None] - event_ns[safe]) / _NS_PER_HOUR if len(event_ns) else np.zeros(idx.shape)
+    return np.where(idx >= 0, hours, np.nan)
+
+
+def build_payloads(
+    series: Dict[str, pd.DataFrame],
+    window: int = HISTORY_WINDOW,
+    on_medication: bool = False,
+    activity_level: Optional[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Batch-of-payload arrays for every reading of one series that has a
+    target reading 30 (± TOLERANCE_MIN) minutes later.
+    """
+    glucose = series["glucose"].dropna().sort_values("timestamp")
+    ts = _ns(glucose["timestamp"])
+    vals = glucose["value"].to_numpy(dtype=np.float64)
+    n = len(vals)
+    if n < 2:
+        return {}
+
+    # Target: reading closest to t + 30 min
+    target_ns = ts + HORIZON_MIN * 60 * 10**9
+    j = np.clip(np.searchsorted(ts, target_ns), 1, n - 1)
+    j = np.where(np.abs(ts[j - 1] - target_ns) < np.abs(ts[j] - target_ns), j - 1, j)
+    ok = (np.abs(ts[j] - target_ns) <= TOLERANCE_MIN * 60 * 10**9) & (j > np.arange(n))
+    rows = np.flatnonzero(ok)
+    if len(rows) == 0:
+        return {}
+    at = ts[rows]
+
+    # History: the `window` most recent readings up to and including "now"
+    padded = np.concatenate([np.full(window - 1, np.nan), vals])
+    values = sliding_window_view(padded, window)[rows]
+    counts = np.minimum(rows + 1, window)
+    oldest = ts[np.maximum(rows - window + 1, 0)]
+    # Reading times in minutes relative to "now" (the Kalman forecaster uses real spacing)
+    padded_ts = np.concatenate([np.full(window - 1, np.nan), ts.astype(np.float64)])
+    minutes = (sliding_window_view(padded_ts, window)[rows] - at[:, None]) / (60 * 10**9)
+
+    stamps = pd.to_datetime(at)
+    hour = stamps.hour.to_numpy()
+    dow = (stamps.dayofweek.to_numpy() + 1) % 7     # JS getDay(): Sunday = 0
+
+    # Meals logged in the last 4 h, newest first (step rules use the newest
+    # within 3 h, the curves every one)
+    meals = series["meal"].sort_values("timestamp")
+    meal_ns = _ns(meals["timestamp"])
+    meal_idx = _recent_events(meal_ns, at, MEAL_LIMIT)
+    meal_hours = _hours_since(meal_ns, meal_idx, at)
+    meal_valid = meal_hours <= MEAL_LOOKBACK_H
+    if len(meals):
+        carbs = np.where(meal_valid, meals["carbs"].to_numpy(dtype=np.float64)[np.maximum(meal_idx, 0)], 0.0)
+    else:
+        carbs = np.zeros(meal_idx.shape)
+
+    # Medications logged in the last 6 h, newest first
+    meds = series["medication"].sort_values("timestamp")
+    med_ns = _ns(meds["timestamp"])
+    med_idx = _recent_events(med_ns, at, MED_LIMIT)
+    med_hours = _hours_since(med_ns, med_idx, at)
+    med_valid = med_hours <= MED_LOOKBACK_H
+    if len(meds):
+        codes = meds["medication_type"].map(forecast.MED_TYPE_CODES).fillna(forecast.MED_NONE).to_numpy(dtype=np.int64)
+        safe = np.maximum(med_idx, 0)
+        med_type = np.where(med_valid, codes[safe], forecast.MED_NONE)
+        dosage = meds["dosage"].to_numpy(dtype=np.float64)[safe]
+    else:
+        med_type = np.full(med_idx.shape, forecast.MED_NONE)
+        dosage = np.zeros(med_idx.shape)
+
+    # Activity: profile level, or an exercise event within the history window
+    ex_ns = np.sort(_ns(series["exercise"]["timestamp"]))
+    recent_exercise = np.searchsorted(ex_ns, at, side="right") > np.searchsorted(ex_ns, oldest, side="left")
+    has_activity = recent_exercise | (activity_level in ACTIVE_LEVELS)
+
+    return {
+        "values": values,
+        "minutes": minutes,
+        "counts": counts,
+        "current": vals[rows],
+        "target": vals[j[rows]],
+        "hour": hour,
+        "dow": dow,
+        "has_logged_meal": meal_valid.any(axis=1),
+        "meal_hours": np.where(meal_valid, _round_hours(meal_hours), np.nan),
+        "carbs": carbs,
+        "has_med_log": med_valid.any(axis=1),
+        "med_type": med_type,
+        "med_hours": np.where(med_valid, _round_hours(med_hours), np.nan),
+        "dosage": dosage,
+        "on_medication": np.full(len(rows), on_medication),
+        "has_activity": has_activity,
+    }
+
+
+# ── Replay ──────────────────────────────────────────────────────────────────
+
+def replay(
+    batch: Dict[str, np.ndarray], model=None, scaler=None, fallback: str = "statistical",
+    curves: Optional[bool] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Run a payload batch through the /predict-glucose-30 pipeline.
+    Without a model the `fallback` forecaster is used ("statistical" or
+    "kalman"), as in the server; `curves` picks the meal / medication
+    adjustments like KINETICS_ENABLED (default: that setting).
+    """
+    values, counts, current = batch["values"], batch["counts"], batch["current"]
+    n = len(current)
+
+    model_used = model is not None and scaler is not None
+    if model_used:
+        features = forecast.ohio_features(values, counts, current, batch["hour"], batch["dow"])
+        base = model.predict(scaler.transform(features))
+    elif fallback == "kalman":
+        kf = KalmanForecaster.from_env()
+        base, _ = kf.forecast(kf.filter(values, batch["minutes"]), HORIZON_MIN)
+    else:
+        base = forecast.statistical_30min(values, counts, current)
+
+    factor_count = np.zeros(n, dtype=np.int64)
+
+    # Meal factor (logged meals only — exported histories carry no reading context)
+    meal_adj, _, meal_phase = kinetics.meal_adjustment(batch["meal_hours"], batch["carbs"], curves)
+    factor_count += (meal_phase != forecast.MEAL_NONE).any(axis=1)
+
+    # Medication factor: the newest dose with an effect, or every dose along
+    # its activity curve
+    effect, _, _ = kinetics.medication_adjustment(batch["med_type"], batch["med_hours"], batch["dosage"], curves)
+    med_applied = effect > 0
+    med_adj = -effect
+    profile_med = ~med_applied & batch["on_medication"]
+    med_adj = np.where(profile_med, -4.0, med_adj)
+    factor_count += med_applied | profile_med
+
+    ctx = forecast.apply_context(base, current, counts, batch["hour"], meal_adj, med_adj, batch["has_activity"])
+    factor_count += ctx["time_of_day"] != forecast.TOD_NONE
+    factor_count += batch["has_activity"]
+
+    mean, std = forecast.reading_stats(values, counts)
+    cv = np.where(mean > 0, std / np.where(mean > 0, mean, 1), 0.0)
+    missing_penalty = np.where(~batch["has_med_log"] & (current > 150), 0.05, 0.0)
+    confidence = np.round(forecast.forecast_confidence(
+        counts, cv, np.full(n, model_used), factor_count, missing_penalty,
+    ), 2)
+
+    return {
+        "predicted": ctx["predicted"],
+        "base": np.asarray(base, dtype=np.float64),
+        "confidence": confidence,
+        "direction": forecast.direction_of(ctx["predicted"], current),
+    }
+
+
+# ── Scoring ─────────────────────────────────────────────────────────────────
+
+def clarke_zones(reference: np.ndarray, predicted: np.ndarray) -> np.ndarray:
+    """Clarke error-grid zone index (0 = A … 4 = E) for each reference/prediction pair."""
+    ref = np.asarray(reference, dtype=np.float64)
+    pred = np.asarray(predicted, dtype=np.float64)
+    zone_a = ((ref <= 70) & (pred <= 70)) | ((pred <= 1.2 * ref) & (pred >= 0.8 * ref))
+    zone_e = ((ref >= 180) & (pred <= 70)) | ((ref <= 70) & (pred >= 180))
+    zone_c = (((ref >= 70) & (ref <= 290)) & (pred >= ref + 110)) | \
+             (((ref >= 130) & (ref <= 180)) & (pred <= (7 / 5) * ref - 182))
+    zone_d = ((ref >= 240) & (pred >= 70) & (pred <= 180)) | \
+             ((ref <= 175 / 3) & (pred <= 180) & (pred >= 70)) | \
+             (((ref >= 175 / 3) & (ref <= 70)) & (pred >= (6 / 5) * ref))
+    return np.select([zone_a, zone_e, zone_c, zone_d], [0, 4, 2, 3], default=1)
+
+
+def score(target: np.ndarray, predicted: np.ndarray) -> Dict[str, float]:
+    errors = np.abs(predicted - target)
+    zones = np.bincount(clarke_zones(target, predicted), minlength=5)
+    return {
+        "samples": int(len(target)),
+        "mae": float(errors.mean()),
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "within_20": float(np.mean(errors <= 20) * 100),
+        "within_40": float(np.mean(errors <= 40) * 100),
+        "clarke": {z: float(c / len(target) * 100) for z, c in zip(CLARKE_ZONES, zones)},
+    }
+
+
+def run_backtest(
+    series: Dict[str, Dict[str, pd.DataFrame]],
+    model=None,
+    scaler=None,
+    window: int = HISTORY_WINDOW,
+    on_medication: bool = False,
+    activity_level: Optional[str] = None,
+    fallback: str = "statistical",
+    curves: Optional[bool] = None,
+) -> Dict[str, object]:
+    """Build payloads for every series, replay them as one batch and score the result."""
+    t0 = time.perf_counter()
+    batches = {}
+    for name, s in series.items():
+        b = build_payloads(s, window, on_medication, activity_level)
+        if b:
+            batches[name] = b
+    if not batches:
+        raise SystemExit("ERROR: No reading has a target 30 minutes later")
+    names = list(batches)
+    batch = {k: np.concatenate([batches[s][k] for s in names]) for k in batches[names[0]]}
+    t1 = time.perf_counter()
+    out = replay(batch, model, scaler, fallback, curves)
+    t2 = time.perf_counter()
+
+    owner = np.repeat(names, [len(batches[s]["current"]) for s in names])
+    report = {
+        "model_used": "ohiot1dm" if model is not None else fallback,
+        "window": window,
+        "kinetics": kinetics.ENABLED if curves is None else curves,
+        "pipeline": score(batch["target"], out["predicted"]),
+        # The raw model/fallback output before context rules, for comparison
+        "base": score(batch["target"], out["base"]),
+        "mean_confidence": float(out["confidence"].mean()),
+        "per_series": {
+            s: score(batch["target"][owner == s], out["predicted"][owner == s]) for s in names
+        },
+        "timing": {
+            "build_seconds": t1 - t0,
+            "replay_seconds": t2 - t1,
+            "samples_per_second": len(owner) / max(t2 - t1, 1e-9),
+        },
+    }
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Backtest the /predict-glucose-30 pipeline.")
+    parser.add_argument("--source", choices=("ohio", "csv"), default="ohio")
+    parser.add_argument("--split", default="testing", help="OhioT1DM split to replay")
+    parser.add_argument("--patients", type=int, nargs="*", help="OhioT1DM patient ids (default: all)")
+    parser.add_argument("--readings", help="CSV of timestamp,value[,user] (--source csv)")
+    parser.add_argument("--meals", help="CSV of timestamp,carbs[,user]")
+    parser.add_argument("--medications", help="CSV of timestamp,medication_type,dosage[,user]")
+    parser.add_argument("--window", type=int, default=HISTORY_WINDOW, help="readings per request")
+    parser.add_argument("--on-medication", action="store_true", help="profile flag onMedication")
+    parser.add_argument("--activity-level", default=None, help="profile activityLevel")
+    parser.add_argument("--statistical", action="store_true", help="replay the statistical fallback")
+    parser.add_argument("--kalman", action="store_true", help="replay the Kalman forecaster (kalman.py)")
+    parser.add_argument("--kinetics", action="store_true",
+                        help="insulin / carb activity curves (kinetics.py) instead of the step rules")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("Bluely 30-Minute Forecast Backtest")
+    print("=" * 60)
+
+    print("\n[1/3] Loading reading histories ...")
+    if args.source == "csv":
+        if not args.readings:
+            parser.error("--readings is required with --source csv")
+        series = load_csv_series(args.readings, args.meals, args.medications)
+    else:
+        series = load_ohio_series(args.split, args.patients)
+    if not series:
+        raise SystemExit("ERROR: No series found")
+    print(f"  {len(series)} series, {sum(len(s['glucose']) for s in series.values())} readings")
+
+    model = scaler = None
+    if not (args.statistical or args.kalman):
+        bundle = load_bundle(OHIO_BUNDLE_PATH)
+        model, scaler = bundle["gbr"], bundle["scaler"]
+        print(f"  Model bundle {bundle.version}")
+
+    print("\n[2/3] Replaying ...")
+    report = run_backtest(
+        series, model, scaler, args.window, args.on_medication, args.activity_level,
+        "kalman" if args.kalman else "statistical", True if args.kinetics else None,
+    )
+    timing = report["timing"]
+    print(f"  {report['pipeline']['samples']} samples in {timing['replay_seconds']:.2f}s "
+          f"({timing['samples_per_second']:,.0f} samples/s, payloads built in {timing['build_seconds']:.2f}s)")
+
+    print("\n[3/3] Results")
+    for label, key in (("Served prediction", "pipeline"), ("Raw base prediction", "base")):
+        m = report[key]
+        zones = "  ".join(f"{z} {m['clarke'][z]:.1f}%" for z in CLARKE_ZONES)
+        print(f"\n  {label} ({report['model_used']}):")
+        print(f"    MAE {m['mae']:.2f} mg/dL   RMSE {m['rmse']:.2f} mg/dL")
+        print(f"    Within ±20 mg/dL: {m['within_20']:.1f}%   Within ±40 mg/dL: {m['within_40']:.1f}%")
+        print(f"    Clarke zones: {zones}")
+    print(f"\n  Mean confidence: {report['mean_confidence']:.2f}")
+
+    print("\n  Per series:")
+    for name, m in report["per_series"].items():
+        print(f"    {name}: MAE={m['mae']:.2f} mg/dL, A+B={m['clarke']['A'] + m['clarke']['B']:.1f}% "
+              f"({m['samples']} samples)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Report saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Bluely Batch Risk Scoring
+==========================
+Scores a CSV of patient records with the Pima risk model, e.g. for clinic
+onboarding. The file is streamed in chunks, each chunk is scaled and run
+through the Random Forest as one array, and the results are appended to
+the output file, so memory stays flat however large the input is.
+
+With --workers > 1, chunks are scored in a process pool (each worker
+memory-maps the model bundle once). At most 2 × workers chunks are in
+flight and results are written in input order.
+
+Input columns may use either the dataset names (Glucose, BMI, Age, ...) or
+the API names (glucose, bmi, age, ...). Glucose and age are required; any
+other missing column takes the same default as POST /predict.
+
+Usage:
+    python batch_score.py patients.csv
+    python batch_score.py patients.csv --output scored.csv --chunksize 100000 --workers 4
+    python batch_score.py patients.csv --mode tiered --margin 0.3
+
+Output:
+    The input columns plus predicted_risk, risk_level, confidence and
+    recommendation
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from predict import (
+    INFERENCE_MODES, PIMA_FEATURE_NAMES, RISK_RECOMMENDATIONS, load_bundle_cached, score_batch,
+)
+
+# API field name and POST /predict default for each model feature
+API_FIELDS = {
+    'Pregnancies': ('pregnancies', 0),
+    'Glucose': ('glucose', None),
+    'BloodPressure': ('blood_pressure', 72),
+    'SkinThickness': ('skin_thickness', 29),
+    'Insulin': ('insulin', 80),
+    'BMI': ('bmi', 32),
+    'DiabetesPedigreeFunction': ('diabetes_pedigree', 0.5),
+    'Age': ('age', None),
+}
+
+
+def feature_matrix(chunk: pd.DataFrame) -> np.ndarray:
+    """(n, 8) features in model order from dataset- or API-named columns."""
+    columns = []
+    for name in PIMA_FEATURE_NAMES:
+        api_name, default = API_FIELDS[name]
+        if name in chunk.columns:
+            col = chunk[name]
+        elif api_name in chunk.columns:
+            col = chunk[api_name]
+        elif default is not None:
+            col = pd.Series(default, index=chunk.index)
+        else:
+            raise ValueError(f"Missing required column '{name}' (or '{api_name}')")
+        col = pd.to_numeric(col, errors='coerce')
+        if default is not None:
+            col = col.fillna(default)
+        columns.append(col.to_numpy(dtype=np.float64))
+    return np.column_stack(columns)
+
+
+def score_chunk(chunk: pd.DataFrame, mode: Optional[str] = None, margin: Optional[float] = None) -> pd.DataFrame:
+    """Append the risk columns to one chunk. Rows missing glucose or age are left unscored."""
+    X = feature_matrix(chunk)
+    valid = ~np.isnan(X).any(axis=1)
+
+    out = chunk.copy()
+    out['predicted_risk'] = pd.array([pd.NA] * len(chunk), dtype='Int64')
+    out['risk_level'] = None
+    out['confidence'] = np.nan
+    out['recommendation'] = None
+    if valid.any():
+        result = score_batch(X[valid], mode=mode, margin=margin)
+        idx = out.index[valid]
+        out.loc[idx, 'predicted_risk'] = result['predicted_risk']
+        out.loc[idx, 'risk_level'] = result['risk_level']
+        out.loc[idx, 'confidence'] = np.round(result['confidence'], 3)
+        out.loc[idx, 'recommendation'] = pd.Series(result['risk_level']).map(RISK_RECOMMENDATIONS).to_numpy()
+    return out
+
+
+def _init_worker():
+    load_bundle_cached()
+
+
+def score_file(
+    input_path: str,
+    output_path: str,
+    chunksize: int = 50_000,
+    workers: int = 1,
+    mode: Optional[str] = None,
+    margin: Optional[float] = None,
+) -> dict:
+    """Stream `input_path` through the model into `output_path`. Returns row counts."""
+    reader = pd.read_csv(input_path, chunksize=chunksize)
+    stats = {'rows': 0, 'scored': 0, 'chunks': 0}
+    header = True
+
+    def write(scored: pd.DataFrame):
+        nonlocal header
+        scored.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        stats['rows'] += len(scored)
+        stats['scored'] += int(scored['risk_level'].notna().sum())
+        stats['chunks'] += 1
+        print(f"  chunk {stats['chunks']}: {stats['rows']:,} rows", end='\r')
+
+    if workers <= 1:
+        load_bundle_cached()
+        for chunk in reader:
+            write(score_chunk(chunk, mode, margin))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pending = deque()
+            for chunk in reader:
+                pending.append(pool.submit(score_chunk, chunk, mode, margin))
+                if len(pending) >= 2 * workers:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+
+    if header:
+        # Empty input: still produce a file with the output columns
+        pd.read_csv(input_path, nrows=0).assign(
+            predicted_risk=None, risk_level=None, confidence=None, recommendation=None,
+        ).to_csv(output_path, index=False)
+    print()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Score a CSV of patient records with the Pima risk model.")
+    parser.add_argument('input', help='CSV of patient records')
+    parser.add_argument('--output', default=None, help='output CSV (default: <input>_scored.csv)')
+    parser.add_argument('--chunksize', type=int, default=50_000, help='rows per chunk')
+    parser.add_argument('--workers', type=int, default=1, help='processes scoring chunks in parallel')
+    parser.add_argument('--mode', choices=INFERENCE_MODES, default=None,
+                        help='rf or tiered (default: RISK_INFERENCE_MODE)')
+    parser.add_argument('--margin', type=float, default=None, help='tiered mode band (default: RISK_TIER_MARGIN)')
+    args = parser.parse_args(argv)
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}_scored.csv"
+
+    print("=" * 60)
+    print("Bluely Batch Risk Scoring")
+    print("=" * 60)
+    print(f"  Model bundle {load_bundle_cached().version}")
+    print(f"  {args.input} → {output} (chunks of {args.chunksize:,}, {args.workers} worker(s))")
+
+    t0 = time.perf_counter()
+    stats = score_file(args.input, output, args.chunksize, args.workers, args.mode, args.margin)
+    elapsed = time.perf_counter() - t0
+
+    print(f"✓ {stats['scored']:,} of {stats['rows']:,} rows scored in {elapsed:.1f}s "
+          f"({stats['rows'] / max(elapsed, 1e-9):,.0f} rows/s)")
+    if stats['scored'] < stats['rows']:
+        print(f"  ⚠ {stats['rows'] - stats['scored']:,} rows missing glucose or age were left unscored")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 echo "==> Checking for trained models..."
-if [ ! -f "models/glucose_model.joblib" ] || [ ! -f "models/ohio_glucose_predictor.joblib" ]; then
+if [ ! -f "models/pima_risk.bundle" ] || [ ! -f "models/ohio_glucose.bundle" ]; then
     echo "==> Model files not found. Training models..."
     
     # Train Pima model (only needs data/diabetes.csv)
@@ -0,0 +1,280 @@
+"""
+Bluely Model Compaction
+========================
+Measures how much of the served tree ensembles is worth its serving cost
+and writes the compact model picked from the measurements.
+
+Candidates are cut from the bundled ensembles without retraining:
+  - fewer trees: the first k boosting stages of the OhioT1DM GBR (a
+    prefix of a boosted ensemble is a valid, smaller model), or the first k
+    trees of the Pima random forest
+  - shallower trees: every node at depth d becomes a leaf predicting its
+    stored node value (the mean residual for the GBR, the class
+    distribution for the forest); unreachable nodes are dropped
+
+Each candidate is scored on the held-out test sets the models were trained
+against — MAE on the OhioT1DM testing files, ROC AUC (and accuracy) on the
+stratified 20% Pima split of train.py — and timed with the same single-row
+and 1000-row batch predict measurement as tune_ohio.py. Candidates that no
+other candidate beats on both error and single-row latency form the Pareto
+frontier; the fastest frontier point whose error is within `--tolerance`
+(relative) of the full model is written as a compact bundle, with the
+frontier and its source recorded in the bundle metadata.
+
+Usage:
+    python compact_models.py
+    python compact_models.py --model ohio --tolerance 0.01
+    python compact_models.py --model pima --trees 0.1,0.25,0.5,1 --depths 6,8,10
+    python compact_models.py --replace          # overwrite the served bundles
+
+Output:
+    models/ohio_glucose.compact.bundle, models/pima_risk.compact.bundle
+    (the Ohio one with its drift reference, <bundle>.drift.json)
+    compaction_report.json — every candidate with error, latency and size
+"""
+
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+import drift
+from model_bundle import COMPONENT_TYPES, OHIO_BUNDLE_PATH, PIMA_BUNDLE_PATH, load_bundle, write_bundle
+from pipeline import StageCache
+from predict import clean_pima_frame
+from train_ohio import FEATURE_PARAMS, build_feature_sets
+from tune_ohio import measure_latency
+
+Component = Tuple[str, Dict[str, Any], Dict[str, np.ndarray]]
+
+PIMA_DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "diabetes.csv")
+
+DEFAULT_TREE_FRACTIONS = (0.1, 0.25, 0.375, 0.5, 0.75, 1.0)
+DEFAULT_TOLERANCE = 0.02
+
+# name → (bundle path, ensemble component)
+MODELS: Dict[str, Tuple[str, str]] = {
+    "ohio": (OHIO_BUNDLE_PATH, "gbr"),
+    "pima": (PIMA_BUNDLE_PATH, "rf"),
+}
+
+
+# ── Cutting ensembles ───────────────────────────────────────────────────────
+
+def node_depths(children: np.ndarray, roots: np.ndarray) -> np.ndarray:
+    """Depth of every node reachable from `roots` (root = 0), -1 for unreachable nodes."""
+    depth = np.full(len(children), -1, dtype=np.int32)
+    frontier = np.asarray(roots, dtype=np.int64)
+    d = 0
+    while frontier.size:
+        depth[frontier] = d
+        kids = children[frontier]
+        internal = kids[:, 0] != frontier  # leaves point at themselves
+        frontier = kids[internal].reshape(-1)
+        d += 1
+    return depth
+
+
+def cut_ensemble(component: Component, n_trees: int, max_depth: Optional[int] = None) -> Component:
+    """The first `n_trees` trees of a flattened ensemble, pruned to `max_depth`."""
+    kind, params, arrays = component
+    roots = np.asarray(arrays["roots"][:n_trees], dtype=np.int64)
+    end = int(arrays["roots"][n_trees]) if n_trees < len(arrays["roots"]) else len(arrays["feature"])
+    feature = np.array(arrays["feature"][:end])
+    threshold = np.array(arrays["threshold"][:end])
+    children = np.array(arrays["children"][:end], dtype=np.int64)
+
+    depth = node_depths(children, roots)
+    if max_depth is not None:
+        cut = depth == max_depth
+        idx = np.flatnonzero(cut)
+        children[idx] = idx[:, None]
+        threshold[idx] = np.inf
+        feature[idx] = 0
+        depth[depth > max_depth] = -1
+
+    # Drop unreachable nodes and renumber the rest
+    keep = depth >= 0
+    new_index = np.cumsum(keep) - 1
+    out = {
+        "feature": feature[keep].astype(np.int32),
+        "threshold": threshold[keep],
+        "children": new_index[children[keep]].astype(np.int32),
+        "value": np.array(arrays["value"][:end][keep]),
+        "cover": np.array(arrays["cover"][:end][keep]),
+        "roots": new_index[roots].astype(np.int32),
+    }
+    return kind, dict(params, max_depth=int(depth[keep].max())), out
+
+
+def component_bytes(component: Component) -> int:
+    return int(sum(a.nbytes for a in component[2].values()))
+
+
+# ── Test sets ───────────────────────────────────────────────────────────────
+
+def ohio_test_set(bundle) -> Tuple[np.ndarray, np.ndarray]:
+    """Stacked OhioT1DM testing matrices for the bundle's feature spec (from the stage cache)."""
+    feature_params = bundle.metadata.get("feature_params", FEATURE_PARAMS)
+    sets = build_feature_sets(StageCache(), feature_params, verbose=False)["testing"]
+    if not sets:
+        raise SystemExit("ERROR: No OhioT1DM testing data found in data/ohiot1dm/")
+    X = np.vstack([X for _, X, _ in sets.values()])
+    y = np.concatenate([y for _, _, y in sets.values()])
+    return X, y
+
+
+def pima_test_set() -> Tuple[np.ndarray, np.ndarray]:
+    """The held-out split of train.py (same cleaning, 20% stratified, seed 42), unscaled."""
+    df = clean_pima_frame(pd.read_csv(PIMA_DATA_PATH))
+    X = df.drop("Outcome", axis=1).to_numpy(dtype=np.float64)
+    y = df["Outcome"].to_numpy()
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    return X_test, y_test
+
+
+# ── Evaluation ──────────────────────────────────────────────────────────────
+
+def evaluate(name: str, model, scaler, X: np.ndarray, y: np.ndarray) -> Dict[str, float]:
+    """Accuracy metrics; `error` is the value minimised on the frontier."""
+    scaled = scaler.transform(X)
+    if name == "ohio":
+        pred = model.predict(scaled)
+        mae = float(np.mean(np.abs(pred - y)))
+        return {"error": mae, "mae": mae, "rmse": float(np.sqrt(np.mean((pred - y) ** 2)))}
+    proba = model.predict_proba(scaled)
+    auc = float(roc_auc_score(y, proba[:, 1]))
+    return {"error": 1.0 - auc, "auc": auc, "accuracy": float(accuracy_score(y, model.classes_[proba.argmax(axis=1)]))}
+
+
+def pareto_frontier(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows not dominated on (error, single-row latency), fastest first."""
+    frontier: List[Dict[str, Any]] = []
+    best_error = np.inf
+    for row in sorted(rows, key=lambda r: (r["single_ms"], r["error"])):
+        if row["error"] < best_error:
+            frontier.append(row)
+            best_error = row["error"]
+    return frontier
+
+
+def compact(
+    name: str,
+    tree_fractions=DEFAULT_TREE_FRACTIONS,
+    depths: Optional[List[int]] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+    repeats: int = 200,
+    output: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Evaluate the candidate grid for one model and write the selected compact bundle."""
+    bundle_path, ensemble = MODELS[name]
+    bundle = load_bundle(bundle_path)
+    full = bundle.component(ensemble)
+    scaler = bundle["scaler"]
+    n_full, depth_full = bundle[ensemble].n_trees, bundle[ensemble].max_depth
+    print(f"  {bundle_path}: {n_full} trees, depth {depth_full}, "
+          f"{component_bytes(full) / 1024:.0f} KiB (version {bundle.version})")
+
+    X, y = ohio_test_set(bundle) if name == "ohio" else pima_test_set()
+    print(f"  Test set: {len(y)} rows")
+
+    tree_counts = sorted({max(1, int(round(f * n_full))) for f in tree_fractions} | {n_full})
+    depth_grid = sorted({d for d in (depths or range(max(2, depth_full - 3), depth_full + 1)) if 1 <= d <= depth_full})
+    rows = []
+    for n_trees in tree_counts:
+        for depth in depth_grid:
+            candidate = cut_ensemble(full, n_trees, None if depth == depth_full else depth)
+            kind, params, arrays = candidate
+            model = COMPONENT_TYPES[kind](arrays, params)
+            row = {"n_trees": n_trees, "max_depth": params["max_depth"], "kib": round(component_bytes(candidate) / 1024, 1)}
+            row.update(evaluate(name, model, scaler, X, y))
+            row.update(measure_latency(model, scaler, X, repeats=repeats))
+            rows.append(row)
+
+    base = next(r for r in rows if r["n_trees"] == n_full and r["max_depth"] == depth_full)
+    frontier = pareto_frontier(rows)
+    for row in rows:
+        row["pareto"] = row in frontier
+    allowed = [r for r in frontier if r["error"] <= base["error"] * (1 + tolerance)]
+    chosen = allowed[0] if allowed else base
+
+    metric = "mae" if name == "ohio" else "auc"
+    print(f"\n  {'trees':>5} {'depth':>5} {metric:>7} {'1-row ms':>9} {'µs/row':>7} {'KiB':>7}")
+    for row in frontier:
+        mark = "  ← selected" if row is chosen else ("  (full)" if row is base else "")
+        print(f"  {row['n_trees']:>5} {row['max_depth']:>5} {row[metric]:>7.3f} {row['single_ms']:>9.3f} "
+              f"{row['batch_us_per_row']:>7.1f} {row['kib']:>7.1f}{mark}")
+    print(f"  ({len(rows)} candidates, {len(frontier)} on the frontier)")
+
+    out_path = output or bundle_path.replace(".bundle", ".compact.bundle")
+    components = {
+        part: (cut_ensemble(full, chosen["n_trees"], None if chosen["max_depth"] == depth_full else chosen["max_depth"])
+               if part == ensemble else bundle.component(part))
+        for part in bundle.header["components"]
+    }
+    summary = {
+        "source_version": bundle.version,
+        "source_checksum": bundle.checksum,
+        "tolerance": tolerance,
+        "selected": chosen,
+        "full": base,
+        "frontier": frontier,
+    }
+    metadata = {k: v for k, v in bundle.metadata.items() if k not in ("version", "created_at")}
+    header = write_bundle(out_path, components, feature_names=bundle.feature_names,
+                          metadata=dict(metadata, compaction=summary))
+    print(f"\n  ✓ {out_path}: {chosen['n_trees']} trees, depth {chosen['max_depth']} — "
+          f"{metric} {base[metric]:.3f} → {chosen[metric]:.3f}, "
+          f"1-row {base['single_ms']:.3f} → {chosen['single_ms']:.3f} ms, "
+          f"{base['kib']:.0f} → {chosen['kib']:.0f} KiB (version {header['metadata']['version']})")
+    if name == "ohio":
+        # Fewer or shallower trees change the prediction and residual channels
+        compacted = load_bundle(out_path)
+        reference = drift.write_reference(out_path, compacted["gbr"], compacted["scaler"], compacted.version)
+        print(f"  ✓ Drift reference: {reference}" if reference else
+              "  ⚠ No OhioT1DM training readings to rebuild the drift reference from")
+    return dict(summary, candidates=rows, output=out_path)
+
+
+def _floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compact the bundled tree ensembles along an accuracy/latency frontier.")
+    parser.add_argument("--model", choices=["ohio", "pima", "both"], default="both")
+    parser.add_argument("--trees", type=_floats, default=list(DEFAULT_TREE_FRACTIONS),
+                        metavar="F,...", help="fractions of the trees to keep")
+    parser.add_argument("--depths", type=lambda v: [int(d) for d in _floats(v)], default=None,
+                        metavar="D,...", help="maximum tree depths to try (default: full depth and 3 below)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="accepted relative error increase over the full model")
+    parser.add_argument("--repeats", type=int, default=200, help="single-row latency repeats per candidate")
+    parser.add_argument("--replace", action="store_true", help="overwrite the served bundle instead of writing *.compact.bundle")
+    parser.add_argument("--report", default=os.path.join(os.path.dirname(__file__), "compaction_report.json"))
+    args = parser.parse_args(argv)
+
+    names = ["ohio", "pima"] if args.model == "both" else [args.model]
+    print("=" * 60)
+    print("Bluely Model Compaction — Accuracy vs Latency")
+    print("=" * 60)
+    report = {}
+    for i, name in enumerate(names, 1):
+        print(f"\n[{i}/{len(names)}] {name} ...")
+        report[name] = compact(
+            name, args.trees, args.depths, args.tolerance, args.repeats,
+            output=MODELS[name][0] if args.replace else None,
+        )
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Report saved: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
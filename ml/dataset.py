@@ -0,0 +1,443 @@
+"""
+Sharded Training Dataset
+=========================
+Builds the OhioT1DM temporal feature matrix once and stores it as
+fixed-size float32 `.npy` shards that training and evaluation runs stream
+back memory-mapped, instead of re-parsing XML and rebuilding features in
+RAM every run.
+
+Sources are the OhioT1DM XML files (both splits), exported app data as
+CSV (readings: timestamp,value[,user]; meals: timestamp,carbs[,user];
+medications: timestamp,medication_type,dosage[,user] — rapid insulin
+doses become the bolus features), or JSONL exports of the app's Mongo
+collections streamed per user by app_export.py. Each patient's features
+are built with build_temporal_features and appended to the current shard;
+a shard is flushed once it holds `shard_rows` rows, so memory stays at one
+patient's matrix plus one shard buffer however large the corpus is.
+
+Layout of a dataset directory:
+    manifest.json          feature names, feature params, shard list and,
+                           per patient: id, split, source, row range and
+                           the time range of its samples
+    features-00000.npy     (shard_rows, n_features) float32
+    targets-00000.npy      (shard_rows,) float32
+    ...                    (the last shard may be shorter)
+
+Rows are numbered globally across shards and each patient's rows are
+contiguous, so a split or patient subset is a list of row ranges.
+
+Usage:
+    python dataset.py build datasets/ohio
+    python dataset.py build datasets/app --source csv --readings readings.csv \\
+        --meals meals.csv --medications medications.csv --split training
+    python dataset.py build datasets/app --source jsonl --readings readings.jsonl \\
+        --meals meals.jsonl --medications medication_logs.jsonl --activities activities.jsonl
+    python dataset.py build datasets/ohio-iob --families iob,stress
+    python dataset.py info datasets/ohio
+
+    from dataset import ShardedDataset
+    ds = ShardedDataset("datasets/ohio")
+    for patient, X, y in ds.iter_batches(split="testing"):
+        ...
+
+Output:
+    <out>/manifest.json plus features-*.npy / targets-*.npy shards
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from parse_ohio import (
+    load_patient_xml, build_temporal_features, temporal_feature_names, required_sections, DATA_DIR, PATIENT_IDS,
+)
+from pipeline import file_digest, hash_key
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+DEFAULT_SHARD_ROWS = 65_536
+DTYPE = np.float32
+
+DEFAULT_FEATURE_PARAMS: Dict[str, Any] = {
+    "prediction_horizon": 6,
+    "lookback": 12,
+}
+
+SPLITS = ("training", "testing")
+
+# A source yields (patient id, split, source label, file digests, parsed data)
+Source = Tuple[Any, str, str, List[str], Dict[str, pd.DataFrame]]
+
+
+# ── Sources ─────────────────────────────────────────────────────────────────
+
+def _events(*columns: str) -> pd.DataFrame:
+    return pd.DataFrame({c: [] for c in ("timestamp",) + columns})
+
+
+def ohio_sources(
+    splits: Tuple[str, ...] = SPLITS,
+    patients: Optional[List[int]] = None,
+    families: Optional[List[str]] = None,
+) -> Iterator[Source]:
+    """One source per available OhioT1DM patient file, parsing only the sections `families` need."""
+    sections = required_sections(families)
+    for pid in patients or PATIENT_IDS:
+        for split in splits:
+            path = os.path.join(DATA_DIR, f"{pid}-ws-{split}.xml")
+            if not os.path.exists(path):
+                print(f"  ⚠ Skipping patient {pid} {split}: {path} not found")
+                continue
+            yield pid, split, os.path.basename(path), [file_digest(path)], load_patient_xml(path, sections)
+
+
+def _by_user(df: Optional[pd.DataFrame], user: str, columns: List[str]) -> pd.DataFrame:
+    if df is None:
+        return _events(*columns)
+    if "user" in df.columns:
+        df = df[df["user"].astype(str) == user]
+    return df[["timestamp"] + columns].reset_index(drop=True)
+
+
+def export_sources(
+    readings_path: str,
+    meals_path: Optional[str] = None,
+    medications_path: Optional[str] = None,
+    split: str = "training",
+) -> Iterator[Source]:
+    """
+    One source per `user` of exported app CSVs (a single source when there
+    is no user column), in the dict shape load_patient_xml returns.
+    """
+    paths = [p for p in (readings_path, meals_path, medications_path) if p]
+    digests = [file_digest(p) for p in paths]
+    readings = pd.read_csv(readings_path, parse_dates=["timestamp"]).dropna(subset=["value"])
+    meals = pd.read_csv(meals_path, parse_dates=["timestamp"]) if meals_path else None
+    meds = pd.read_csv(medications_path, parse_dates=["timestamp"]) if medications_path else None
+    if meds is not None:
+        meds = meds[meds["medication_type"] == "insulin_rapid"].rename(columns={"dosage": "dose"})
+
+    users = readings["user"].astype(str).unique() if "user" in readings.columns else ["all"]
+    for user in users:
+        yield user, split, os.path.basename(readings_path), digests, {
+            "glucose": _by_user(readings, user, ["value"]),
+            "meal": _by_user(meals, user, ["carbs"]),
+            "bolus": _by_user(meds, user, ["dose"]),
+            "exercise": _events(),
+            "sleep": _events(),
+            "heart_rate": _events("value"),
+            "steps": _events("value"),
+        }
+
+
+# ── Writing ─────────────────────────────────────────────────────────────────
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    """Write atomically so an interrupted build never leaves a truncated shard."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class ShardWriter:
+    """Accumulates rows into one fixed-size float32 buffer and flushes full shards."""
+
+    def __init__(self, root: str, n_features: int, shard_rows: int = DEFAULT_SHARD_ROWS):
+        self.root = root
+        self.shard_rows = shard_rows
+        self.X = np.empty((shard_rows, n_features), dtype=DTYPE)
+        self.y = np.empty(shard_rows, dtype=DTYPE)
+        self.fill = 0
+        self.rows = 0
+        self.shards: List[Dict[str, Any]] = []
+
+    def append(self, X: np.ndarray, y: np.ndarray) -> None:
+        start = 0
+        while start < len(y):
+            take = min(len(y) - start, self.shard_rows - self.fill)
+            self.X[self.fill:self.fill + take] = X[start:start + take]
+            self.y[self.fill:self.fill + take] = y[start:start + take]
+            self.fill += take
+            start += take
+            if self.fill == self.shard_rows:
+                self.flush()
+
+    def flush(self) -> None:
+        if self.fill == 0:
+            return
+        index = len(self.shards)
+        names = {"features": f"features-{index:05d}.npy", "targets": f"targets-{index:05d}.npy"}
+        _save_npy(os.path.join(self.root, names["features"]), self.X[:self.fill])
+        _save_npy(os.path.join(self.root, names["targets"]), self.y[:self.fill])
+        self.shards.append({**names, "row_start": self.rows, "rows": self.fill})
+        self.rows += self.fill
+        self.fill = 0
+
+
+def _sample_times(glucose: pd.DataFrame, n: int, lookback: int) -> Tuple[Optional[str], Optional[str]]:
+    """Timestamps of the first and last sample (sample i is the reading at index lookback + i)."""
+    if n == 0:
+        return None, None
+    times = glucose["timestamp"].sort_values().reset_index(drop=True)
+    return pd.Timestamp(times[lookback]).isoformat(), pd.Timestamp(times[lookback + n - 1]).isoformat()
+
+
+def build_dataset(
+    sources: Iterator[Source],
+    out_dir: str,
+    feature_params: Optional[Dict[str, Any]] = None,
+    shard_rows: int = DEFAULT_SHARD_ROWS,
+) -> Dict[str, Any]:
+    """Build features for every source into shards under `out_dir`. Returns the manifest."""
+    feature_params = dict(DEFAULT_FEATURE_PARAMS, **(feature_params or {}))
+    feature_names = temporal_feature_names(feature_params["lookback"], feature_params.get("families"))
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        if name == MANIFEST or (name.endswith(".npy") and name.startswith(("features-", "targets-"))):
+            os.remove(os.path.join(out_dir, name))
+
+    writer = ShardWriter(out_dir, len(feature_names), shard_rows)
+    patients: List[Dict[str, Any]] = []
+    digests: List[str] = []
+    for pid, split, label, source_digests, data in sources:
+        X, y = build_temporal_features(
+            glucose_df=data["glucose"],
+            meal_df=data["meal"],
+            bolus_df=data["bolus"],
+            exercise_df=data["exercise"],
+            sleep_df=data["sleep"],
+            heart_rate_df=data["heart_rate"],
+            steps_df=data["steps"],
+            context=data,
+            **feature_params,
+        )
+        n = len(y)
+        time_start, time_end = _sample_times(data["glucose"], n, feature_params["lookback"])
+        row_start = writer.rows + writer.fill
+        if n:
+            writer.append(np.asarray(X, dtype=DTYPE), np.asarray(y, dtype=DTYPE))
+        patients.append({
+            "id": pid,
+            "split": split,
+            "source": label,
+            "rows": n,
+            "row_start": row_start,
+            "row_end": row_start + n,
+            "time_start": time_start,
+            "time_end": time_end,
+        })
+        digests.extend(source_digests)
+        print(f"  Patient {pid} {split[:5]}: {n} samples")
+    writer.flush()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "dataset_id": hash_key(FORMAT_VERSION, feature_params, sorted(set(digests)), shard_rows),
+        "created": pd.Timestamp.now(tz="UTC").isoformat(),
+        "dtype": np.dtype(DTYPE).name,
+        "feature_names": feature_names,
+        "feature_params": feature_params,
+        "shard_rows": shard_rows,
+        "n_rows": writer.rows,
+        "n_features": len(feature_names),
+        "shards": writer.shards,
+        "patients": patients,
+    }
+    tmp = os.path.join(out_dir, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    return manifest
+
+
+# ── Reading ─────────────────────────────────────────────────────────────────
+
+class ShardedDataset:
+    """Read-only view of a built dataset; shards are opened memory-mapped on demand."""
+
+    def __init__(self, root: str):
+        self.root = root
+        path = os.path.join(root, MANIFEST)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No {MANIFEST} in {root} — build it with `python dataset.py build {root}`")
+        with open(path) as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format {self.manifest.get('format_version')} in {root}")
+        self._open: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.manifest["feature_names"]
+
+    @property
+    def feature_params(self) -> Dict[str, Any]:
+        return self.manifest["feature_params"]
+
+    @property
+    def dataset_id(self) -> str:
+        return self.manifest["dataset_id"]
+
+    @property
+    def n_features(self) -> int:
+        return self.manifest["n_features"]
+
+    def __len__(self) -> int:
+        return self.manifest["n_rows"]
+
+    def patients(self, split: Optional[str] = None, patients: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """Manifest entries of the selected patients, in row order."""
+        wanted = {str(p) for p in patients} if patients else None
+        return [
+            p for p in self.manifest["patients"]
+            if p["rows"] and (split is None or p["split"] == split) and (wanted is None or str(p["id"]) in wanted)
+        ]
+
+    def rows(self, split: Optional[str] = None, patients: Optional[List[Any]] = None) -> int:
+        return sum(p["rows"] for p in self.patients(split, patients))
+
+    def shard(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(features, targets) of one shard, memory-mapped read-only."""
+        if index not in self._open:
+            entry = self.manifest["shards"][index]
+            X = np.load(os.path.join(self.root, entry["features"]), mmap_mode="r")
+            y = np.load(os.path.join(self.root, entry["targets"]), mmap_mode="r")
+            if X.shape != (entry["rows"], self.n_features) or y.shape != (entry["rows"],):
+                raise ValueError(f"Shard {entry['features']} does not match the manifest")
+            self._open[index] = (X, y)
+        return self._open[index]
+
+    def iter_batches(
+        self, split: Optional[str] = None, patients: Optional[List[Any]] = None
+    ) -> Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+        """
+        Yield (patient entry, X, y) memmap slices of the selected rows. A
+        patient whose rows straddle a shard boundary is yielded in two parts.
+        """
+        shards = self.manifest["shards"]
+        starts = np.array([s["row_start"] for s in shards], dtype=np.int64)
+        for patient in self.patients(split, patients):
+            row, end = patient["row_start"], patient["row_end"]
+            while row < end:
+                index = int(np.searchsorted(starts, row, side="right") - 1)
+                X, y = self.shard(index)
+                lo = row - shards[index]["row_start"]
+                hi = min(end - shards[index]["row_start"], shards[index]["rows"])
+                yield patient, X[lo:hi], y[lo:hi]
+                row += hi - lo
+
+    def load(
+        self,
+        split: Optional[str] = None,
+        patients: Optional[List[Any]] = None,
+        max_rows: Optional[int] = None,
+        seed: int = 42,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Selected rows copied into memory (float32). With `max_rows`, a
+        uniform sample without replacement is drawn shard slice by shard
+        slice, so only the sampled rows are ever materialised.
+        """
+        total = self.rows(split, patients)
+        keep = None
+        if max_rows is not None and max_rows < total:
+            keep = np.zeros(total, dtype=bool)
+            keep[np.random.default_rng(seed).choice(total, size=max_rows, replace=False)] = True
+            total = max_rows
+
+        X_out = np.empty((total, self.n_features), dtype=DTYPE)
+        y_out = np.empty(total, dtype=DTYPE)
+        offset = fill = 0
+        for _, X, y in self.iter_batches(split, patients):
+            if keep is not None:
+                mask = keep[offset:offset + len(y)]
+                offset += len(y)
+                X, y = X[mask], y[mask]
+            X_out[fill:fill + len(y)] = X
+            y_out[fill:fill + len(y)] = y
+            fill += len(y)
+        return X_out, y_out
+
+
+# ── CLI ─────────────────────────────────────────────────────────────────────
+
+def print_info(root: str) -> None:
+    ds = ShardedDataset(root)
+    m = ds.manifest
+    print(f"Dataset {root} (id {m['dataset_id']}, created {m['created']})")
+    print(f"  {m['n_rows']:,} rows × {m['n_features']} features ({m['dtype']}) "
+          f"in {len(m['shards'])} shard(s) of up to {m['shard_rows']:,} rows")
+    print(f"  Feature params: {m['feature_params']}")
+    for split in sorted({p["split"] for p in m["patients"]}):
+        print(f"  {split}: {ds.rows(split):,} rows")
+    for p in m["patients"]:
+        print(f"    {str(p['id']):>8s} {p['split']:<8s} {p['rows']:>8,} rows  "
+              f"{p['time_start'] or '-'} → {p['time_end'] or '-'}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or inspect a sharded OhioT1DM feature dataset.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="build shards and manifest")
+    build.add_argument("out", help="output directory")
+    build.add_argument("--source", choices=["ohio", "csv", "jsonl"], default="ohio")
+    build.add_argument("--patients", type=int, nargs="*", default=None, help="OhioT1DM patient ids")
+    build.add_argument("--readings", help="readings export (--source csv/jsonl)")
+    build.add_argument("--meals", help="meals export (--source csv/jsonl)")
+    build.add_argument("--medications", help="medications export (--source csv/jsonl)")
+    build.add_argument("--activities", help="Activity export (--source jsonl)")
+    build.add_argument("--partitions", type=int, default=64, help="spill partitions for --source jsonl")
+    build.add_argument("--split", default="training", help="split label for --source csv/jsonl")
+    build.add_argument("--lookback", type=int, default=DEFAULT_FEATURE_PARAMS["lookback"])
+    build.add_argument("--horizon", type=int, default=DEFAULT_FEATURE_PARAMS["prediction_horizon"])
+    build.add_argument("--shard-rows", type=int, default=DEFAULT_SHARD_ROWS)
+    build.add_argument("--families", type=lambda v: [f for f in v.split(",") if f], default=[],
+                       metavar="NAME,...", help="optional feature families (see feature_families.py)")
+
+    info = sub.add_parser("info", help="print a dataset manifest summary")
+    info.add_argument("root")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        print_info(args.root)
+        return
+
+    print("=" * 60)
+    print("Sharded Dataset Builder")
+    print("=" * 60)
+    if args.source in ("csv", "jsonl") and not args.readings:
+        parser.error(f"--source {args.source} requires --readings")
+    if args.source == "csv":
+        sources = export_sources(args.readings, args.meals, args.medications, args.split)
+    elif args.source == "jsonl":
+        from app_export import jsonl_sources
+        sources = jsonl_sources(args.readings, args.meals, args.medications, args.activities,
+                                split=args.split, partitions=args.partitions)
+    else:
+        sources = ohio_sources(patients=args.patients, families=args.families)
+
+    feature_params: Dict[str, Any] = {"lookback": args.lookback, "prediction_horizon": args.horizon}
+    if args.families:
+        feature_params["families"] = args.families
+    t0 = time.perf_counter()
+    manifest = build_dataset(sources, args.out, feature_params=feature_params, shard_rows=args.shard_rows)
+    elapsed = time.perf_counter() - t0
+    print(f"\n✓ {manifest['n_rows']:,} rows in {len(manifest['shards'])} shard(s) → {args.out} ({elapsed:.1f}s)")
+    print(f"  Dataset id: {manifest['dataset_id']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Bluely Inference Deadlines
+===========================
+Latency budgets for model inference, so a forecast is always answered in
+time — by the model when it can finish, by the statistical fallback when it
+cannot.
+
+Each request gets a budget (INFERENCE_BUDGET_MS, or the caller's
+X-Latency-Budget-Ms header when it is a finite number above 0) counted from
+when the request reached the server, so time spent queued for a worker thread is charged to it. Model
+inference runs on a small dedicated thread pool and the request waits for
+it only until the deadline, minus a reserve kept back for the fallback and
+the response:
+
+  - pool_saturated:     MODEL_QUEUE calls are already running or waiting,
+                        so the call is not queued at all
+  - deadline_exceeded:  the budget ran out before or during inference; the
+                        late result is discarded (the call still holds its
+                        pool slot until it finishes, which is what makes a
+                        slow model show up as saturation for later requests)
+
+Outcomes are counted in InferenceStats and reported by /health.
+
+Configuration (env):
+    INFERENCE_BUDGET_MS=150     default per-request budget (0 = no deadline,
+                                inference runs inline on the request thread)
+    INFERENCE_RESERVE_MS=5      part of the budget kept for the fallback
+    MODEL_WORKERS=2             model inference threads
+    MODEL_QUEUE=8               model calls in flight (running + waiting)
+
+Usage:
+    from deadline import DeadlineExecutor, DeadlineExceeded, PoolSaturated, request_deadline
+    executor = DeadlineExecutor.from_env()
+    deadline, budget_ms = request_deadline(x_latency_budget_ms, executor.default_budget_ms)
+    try:
+        y = executor.run(model_fn, X, deadline=deadline)
+    except (DeadlineExceeded, PoolSaturated) as e:
+        y = fallback(X)   # e.reason names the fallback
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from reqlog import current_trace
+
+DEFAULT_BUDGET_MS = 150.0
+DEFAULT_RESERVE_MS = 5.0
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 8
+MAX_BUDGET_MS = 10_000.0
+
+
+class InferenceSkipped(Exception):
+    """Model inference was not (or not in time) completed; use the fallback."""
+
+    reason = "skipped"
+
+
+class DeadlineExceeded(InferenceSkipped):
+    reason = "deadline_exceeded"
+
+
+class PoolSaturated(InferenceSkipped):
+    reason = "pool_saturated"
+
+
+class InferenceStats:
+    """Thread-safe counters of model results and fallbacks by reason."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.model = 0
+        self.fallbacks: Dict[str, int] = {}
+
+    def record_model(self) -> None:
+        with self._lock:
+            self.model += 1
+
+    def record_fallback(self, reason: str) -> None:
+        with self._lock:
+            self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"model": self.model, "fallbacks": dict(self.fallbacks)}
+
+
+def request_deadline(header_ms: Optional[str], default_ms: float) -> Tuple[Optional[float], float]:
+    """
+    (deadline as a perf_counter() value, budget in ms) for the current
+    request. The header is honoured only when it is a finite, positive
+    number (capped at MAX_BUDGET_MS); absent, unparsable, NaN, infinite or
+    non-positive values use `default_ms`. A default of 0 means no deadline
+    (None).
+    """
+    budget = default_ms
+    if header_ms is not None:
+        try:
+            requested = float(header_ms)
+        except ValueError:
+            requested = math.nan
+        if math.isfinite(requested) and requested > 0:
+            budget = min(requested, MAX_BUDGET_MS)
+    if budget <= 0:
+        return None, 0.0
+    trace = current_trace()
+    start = trace.start if trace is not None else time.perf_counter()
+    return start + budget / 1000, budget
+
+
+class DeadlineExecutor:
+    """Bounded model-inference pool whose callers stop waiting at their deadline."""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_QUEUE,
+        default_budget_ms: float = DEFAULT_BUDGET_MS,
+        reserve_ms: float = DEFAULT_RESERVE_MS,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.default_budget_ms = default_budget_ms
+        self.reserve = reserve_ms / 1000
+        self.stats = InferenceStats()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bluely-model")
+
+    @classmethod
+    def from_env(cls) -> "DeadlineExecutor":
+        return cls(
+            workers=int(os.environ.get("MODEL_WORKERS", DEFAULT_WORKERS)),
+            max_pending=int(os.environ.get("MODEL_QUEUE", DEFAULT_QUEUE)),
+            default_budget_ms=float(os.environ.get("INFERENCE_BUDGET_MS", DEFAULT_BUDGET_MS)),
+            reserve_ms=float(os.environ.get("INFERENCE_RESERVE_MS", DEFAULT_RESERVE_MS)),
+        )
+
+    def run(self, fn: Callable[..., Any], *args: Any, deadline: Optional[float]) -> Any:
+        """fn(*args), or DeadlineExceeded / PoolSaturated if it cannot finish before `deadline`."""
+        if deadline is None:
+            return fn(*args)
+        remaining = deadline - self.reserve - time.perf_counter()
+        if remaining <= 0:
+            raise DeadlineExceeded("budget spent before inference started")
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"{self.max_pending} model calls already in flight")
+        # Run in the request's context so its trace spans are recorded
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeout:
+            future.cancel()
+            raise DeadlineExceeded(f"no result within {remaining * 1000:.1f} ms") from None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "defaultBudgetMs": self.default_budget_ms,
+            "reserveMs": self.reserve * 1000,
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            **self.stats.snapshot(),
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,372 @@
+"""
+Bluely Drift Monitoring
+========================
+Whether live /predict-glucose-30 traffic still looks like the OhioT1DM data
+the model was trained on: the glucose features `_build_ohio_features`
+produces (calendar features and the unused padding are skipped), the
+model's base prediction and, once outcomes are known, the forecast
+residual (actual − predicted).
+
+Each monitored channel is a fixed-bin histogram. Bin edges are the
+reference distribution's quantiles (up to DRIFT_BINS bins per channel), so
+a sketch is a (channels, bins) count matrix — constant memory however much
+traffic it sees — and recording a request is one vectorized comparison
+against the edges plus a bincount.
+
+The reference (edges + bin proportions per channel) is built by replaying
+the OhioT1DM training split through the serving pipeline (backtest.py), so
+it describes the same feature vector the server builds, and is saved next
+to the model bundle (`<bundle>.drift.json`) by train_ohio.py,
+update_ohio.py, compact_models.py or this script — whatever writes a
+bundle rebuilds its reference. The live side keeps two rotating windows (DRIFT_WINDOW_MINUTES
+each) and scores the current + previous window against the reference with
+the population stability index:
+
+    PSI = Σ_bins (p_live − p_ref) · ln(p_live / p_ref)
+    < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant shift
+
+Channels with fewer than DRIFT_MIN_SAMPLES live observations are not
+scored. When the reference was built for another bundle version, the
+prediction and residual channels describe a different model: they are
+dropped and the scores report `referenceStale` (feature channels still
+apply, since the serving features do not depend on the model).
+
+Configuration (env):
+    DRIFT_WINDOW_MINUTES=60     length of each rotating window
+    DRIFT_MIN_SAMPLES=200       observations needed before a channel is scored
+
+Usage:
+    python drift.py                        # build the reference for the current bundle
+    python drift.py --check testing        # PSI of another split against it
+
+Output:
+    models/ohio_glucose.drift.json — reference sketch (bundle version,
+    channel names, bin edges and proportions)
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import forecast
+from model_bundle import OHIO_BUNDLE_PATH
+
+DRIFT_BINS = 20
+DEFAULT_WINDOW_MINUTES = 60.0
+DEFAULT_MIN_SAMPLES = 200
+PSI_EPSILON = 1e-4              # floor for empty bins, so ln() stays finite
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+
+# Calendar features follow the clock rather than the population (an hour's
+# traffic has a single hour_sin), and the unused_* padding is constant
+UNMONITORED = {"hour_sin", "hour_cos", "dow_sin", "dow_cos"}
+FEATURE_COLUMNS = np.array([
+    i for i, name in enumerate(forecast.OHIO_FEATURE_NAMES)
+    if name not in UNMONITORED and not name.startswith("unused_")
+])
+FEATURE_CHANNELS = [forecast.OHIO_FEATURE_NAMES[i] for i in FEATURE_COLUMNS]
+N_FEATURES = len(FEATURE_CHANNELS)
+PREDICTION_CHANNEL = "prediction"
+RESIDUAL_CHANNEL = "residual"
+MODEL_CHANNELS = (PREDICTION_CHANNEL, RESIDUAL_CHANNEL)     # only valid for the reference's bundle
+CHANNELS = FEATURE_CHANNELS + list(MODEL_CHANNELS)
+
+
+def reference_path(bundle_path: str = OHIO_BUNDLE_PATH) -> str:
+    """Sidecar file holding a bundle's drift reference."""
+    root, _ = os.path.splitext(bundle_path)
+    return root + ".drift.json"
+
+
+def psi(reference: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Population stability index of count rows against reference proportion rows."""
+    counts = np.asarray(counts, dtype=np.float64)
+    live = counts / np.maximum(counts.sum(axis=-1, keepdims=True), 1)
+    p = np.maximum(live, PSI_EPSILON)
+    q = np.maximum(reference, PSI_EPSILON)
+    return ((p - q) * np.log(p / q)).sum(axis=-1)
+
+
+def drift_level(score: Optional[float]) -> Optional[str]:
+    if score is None:
+        return None
+    if score > PSI_SIGNIFICANT:
+        return "significant"
+    if score > PSI_MODERATE:
+        return "moderate"
+    return "stable"
+
+
+# ── Sketches ────────────────────────────────────────────────────────────────
+
+class HistogramSketch:
+    """
+    Fixed-bin counts for several channels. `edges` is (channels, bins - 1),
+    padded with +inf where a channel has fewer distinct edges; a value lands
+    in bin = number of edges strictly below it.
+    """
+
+    def __init__(self, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.n_channels, n_edges = self.edges.shape
+        self.n_bins = n_edges + 1
+        self.counts = np.zeros((self.n_channels, self.n_bins), dtype=np.int64)
+        self._offsets = np.arange(self.n_channels) * self.n_bins
+
+    def bins(self, X: np.ndarray, channels: slice = slice(None)) -> np.ndarray:
+        """Flat count indices of X's values (rows × the given channels); NaN rows are dropped."""
+        edges = self.edges[channels]
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(edges))
+        X = X[~np.isnan(X).any(axis=1)]
+        return ((X[:, :, None] > edges[None]).sum(axis=2) + self._offsets[channels]).ravel()
+
+    def add_bins(self, flat: np.ndarray) -> None:
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def clear(self) -> None:
+        self.counts[:] = 0
+
+
+def reference_edges(values: np.ndarray, bins: int = DRIFT_BINS) -> np.ndarray:
+    """Distinct interior quantiles of `values`, at most bins - 1 of them."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.empty(0)
+    return np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+
+
+def build_reference(
+    channels: Dict[str, np.ndarray], bundle_version: Optional[str] = None, bins: int = DRIFT_BINS
+) -> Dict[str, Any]:
+    """JSON-ready reference sketch: per channel, quantile bin edges and the data's proportions in them."""
+    out: Dict[str, Any] = {
+        "bundle_version": bundle_version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "bins": bins,
+        "channels": {},
+    }
+    for name, values in channels.items():
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        edges = reference_edges(values, bins)
+        counts = np.bincount(np.searchsorted(edges, values, side="left"), minlength=len(edges) + 1)
+        out["channels"][name] = {
+            "edges": edges.tolist(),
+            "proportions": (counts / max(len(values), 1)).tolist(),
+            "count": int(len(values)),
+        }
+    return out
+
+
+def save_reference(reference: Dict[str, Any], path: str) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(reference, f)
+    os.replace(tmp, path)
+
+
+def load_reference(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def ohio_reference_channels(model, scaler, split: str = "training") -> Dict[str, np.ndarray]:
+    """
+    Replay an OhioT1DM split through the serving pipeline (backtest.py) and
+    collect every channel: features as the server builds them, the model's
+    base prediction and the residual of the served forecast.
+    """
+    from backtest import build_payloads, load_ohio_series, replay
+
+    batches = [b for b in (build_payloads(s) for s in load_ohio_series(split).values()) if b]
+    if not batches:
+        return {}
+    batch = {k: np.concatenate([b[k] for b in batches]) for k in batches[0]}
+    features = forecast.ohio_features(batch["values"], batch["counts"], batch["current"], batch["hour"], batch["dow"])
+    out = replay(batch, model, scaler)
+    channels = {name: features[:, i] for name, i in zip(FEATURE_CHANNELS, FEATURE_COLUMNS)}
+    channels[PREDICTION_CHANNEL] = out["base"]
+    channels[RESIDUAL_CHANNEL] = batch["target"] - out["predicted"]
+    return channels
+
+
+def write_reference(bundle_path: str, model, scaler, bundle_version: str, split: str = "training") -> Optional[str]:
+    """
+    Build a bundle's reference from an OhioT1DM split and save it next to
+    the bundle. Returns the path, or None when there are no readings.
+    """
+    channels = ohio_reference_channels(model, scaler, split)
+    if not channels:
+        return None
+    path = reference_path(bundle_path)
+    save_reference(build_reference(channels, bundle_version=bundle_version), path)
+    return path
+
+
+# ── Live monitor ────────────────────────────────────────────────────────────
+
+class DriftMonitor:
+    """Live sketches of the monitored channels, scored against a reference."""
+
+    def __init__(
+        self,
+        reference: Dict[str, Any],
+        window_minutes: float = DEFAULT_WINDOW_MINUTES,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        model_version: Optional[str] = None,
+    ):
+        """`model_version`: the served bundle's; a reference for another drops the model channels."""
+        self.reference = reference
+        self.window = window_minutes * 60
+        self.min_samples = min_samples
+        self.stale = model_version is not None and reference.get("bundle_version") != model_version
+        self.channels = [c for c in CHANNELS if c in reference["channels"]
+                         and not (self.stale and c in MODEL_CHANNELS)]
+        if self.channels[:N_FEATURES] != FEATURE_CHANNELS:
+            raise ValueError("drift reference does not cover the serving feature vector")
+        refs = [reference["channels"][c] for c in self.channels]
+        width = max(len(r["edges"]) for r in refs)
+        edges = np.full((len(refs), width), np.inf)
+        self._reference = np.zeros((len(refs), width + 1))
+        for i, r in enumerate(refs):
+            edges[i, :len(r["edges"])] = r["edges"]
+            self._reference[i, :len(r["proportions"])] = r["proportions"]
+        self._index = {c: i for i, c in enumerate(self.channels)}
+        self._lock = threading.Lock()
+        self._current = HistogramSketch(edges)
+        self._previous = HistogramSketch(edges)
+        self._window_start = time.time()
+        self.observed = 0
+
+    @classmethod
+    def from_env(
+        cls, bundle_path: str = OHIO_BUNDLE_PATH, model_version: Optional[str] = None
+    ) -> Optional["DriftMonitor"]:
+        """Monitor for the bundle's saved reference, or None when there is none."""
+        path = reference_path(bundle_path)
+        if not os.path.exists(path):
+            return None
+        return cls(
+            load_reference(path),
+            window_minutes=float(os.environ.get("DRIFT_WINDOW_MINUTES", DEFAULT_WINDOW_MINUTES)),
+            min_samples=int(os.environ.get("DRIFT_MIN_SAMPLES", DEFAULT_MIN_SAMPLES)),
+            model_version=model_version,
+        )
+
+    def _rotate(self, now: float) -> None:
+        if now - self._window_start >= self.window:
+            self._current, self._previous = self._previous, self._current
+            self._current.clear()
+            # A gap longer than a whole window leaves nothing worth keeping
+            if now - self._window_start >= 2 * self.window:
+                self._previous.clear()
+            self._window_start = now
+
+    def observe(self, features: np.ndarray, predictions=None) -> None:
+        """Record one or more serving feature rows (n, 26) and, when the model ran, its base predictions."""
+        features = np.asarray(features).reshape(-1, len(forecast.OHIO_FEATURE_NAMES))[:, FEATURE_COLUMNS]
+        flat = self._current.bins(features, slice(0, N_FEATURES))
+        if predictions is not None and PREDICTION_CHANNEL in self._index:
+            i = self._index[PREDICTION_CHANNEL]
+            flat = np.concatenate([flat, self._current.bins(predictions, slice(i, i + 1))])
+        with self._lock:
+            self._rotate(time.time())
+            self._current.add_bins(flat)
+            self.observed += 1
+
+    def observe_residuals(self, residuals: Sequence[float]) -> None:
+        """Record forecast residuals (actual − predicted mg/dL) once outcomes are known."""
+        if RESIDUAL_CHANNEL not in self._index:
+            return
+        i = self._index[RESIDUAL_CHANNEL]
+        flat = self._current.bins(np.asarray(residuals, dtype=np.float64)[:, None], slice(i, i + 1))
+        with self._lock:
+            self._rotate(time.time())
+            self._current.add_bins(flat)
+
+    def scores(self) -> Dict[str, Any]:
+        """PSI per channel over the current + previous window, plus a summary."""
+        with self._lock:
+            self._rotate(time.time())
+            counts = self._current.counts + self._previous.counts
+        n = counts.sum(axis=1)
+        values = psi(self._reference, counts)
+        channels = {
+            name: {
+                "psi": round(float(values[i]), 4) if n[i] >= self.min_samples else None,
+                "samples": int(n[i]),
+                "level": drift_level(float(values[i])) if n[i] >= self.min_samples else None,
+            }
+            for i, name in enumerate(self.channels)
+        }
+        feature_scores = [(name, channels[name]["psi"]) for name in self.channels[:N_FEATURES]
+                          if channels[name]["psi"] is not None]
+        worst = max(feature_scores, key=lambda item: item[1], default=(None, None))
+        return {
+            "referenceVersion": self.reference.get("bundle_version"),
+            "referenceStale": self.stale,
+            "windowMinutes": self.window / 60,
+            "observed": self.observed,
+            "maxFeaturePsi": worst[1],
+            "maxFeature": worst[0],
+            "level": drift_level(worst[1]),
+            "drifted": sorted(name for name, score in feature_scores if score > PSI_MODERATE),
+            "prediction": channels.get(PREDICTION_CHANNEL),
+            "residual": channels.get(RESIDUAL_CHANNEL),
+            "features": {name: channels[name] for name in self.channels[:N_FEATURES]},
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or check the OhioT1DM drift reference.")
+    parser.add_argument("--bundle", default=OHIO_BUNDLE_PATH)
+    parser.add_argument("--split", default="training", help="OhioT1DM split the reference describes")
+    parser.add_argument("--check", metavar="SPLIT", help="score this split against the saved reference instead")
+    args = parser.parse_args(argv)
+
+    from model_bundle import load_bundle
+
+    print("=" * 60)
+    print("Bluely Drift Reference")
+    print("=" * 60)
+
+    bundle = load_bundle(args.bundle)
+    path = reference_path(args.bundle)
+    split = args.check or args.split
+    print(f"\n[1/2] Replaying OhioT1DM {split} split through the serving pipeline ...")
+    channels = ohio_reference_channels(bundle["gbr"], bundle["scaler"], split)
+    if not channels:
+        raise SystemExit("ERROR: No OhioT1DM readings found")
+    print(f"  {len(channels[PREDICTION_CHANNEL]):,} samples, {len(channels)} channels")
+
+    if args.check:
+        print(f"\n[2/2] Scoring against {path} ...")
+        monitor = DriftMonitor(load_reference(path), min_samples=1)
+        features = np.zeros((len(channels[PREDICTION_CHANNEL]), len(forecast.OHIO_FEATURE_NAMES)))
+        features[:, FEATURE_COLUMNS] = np.column_stack([channels[name] for name in FEATURE_CHANNELS])
+        monitor.observe(features, channels[PREDICTION_CHANNEL])
+        monitor.observe_residuals(channels[RESIDUAL_CHANNEL])
+        scores = monitor.scores()
+        ranked = sorted(scores["features"].items(), key=lambda item: -(item[1]["psi"] or 0))
+        for name, s in ranked[:10]:
+            print(f"  {name:<20} PSI {s['psi']:.4f}  {s['level']}")
+        print(f"  {'prediction':<20} PSI {scores['prediction']['psi']:.4f}")
+        print(f"  {'residual':<20} PSI {scores['residual']['psi']:.4f}")
+        print(f"\n✓ Overall: {scores['level']} (max feature PSI {scores['maxFeaturePsi']:.4f})")
+        return
+
+    print("\n[2/2] Building reference sketch ...")
+    save_reference(build_reference(channels, bundle_version=bundle.version), path)
+    print(f"\n✓ Drift reference saved: {path} (bundle {bundle.version})")
+
+
+if __name__ == "__main__":
+    main()
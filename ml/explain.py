@@ -0,0 +1,300 @@
+"""
+Bluely TreeSHAP Attributions
+============================
+Per-feature contributions for the bundled tree ensembles — the OhioT1DM
+GBR and the Pima Random Forest — so forecast and risk factors can say what
+the model actually used.
+
+Attributions are path-dependent TreeSHAP values (Lundberg et al., 2018):
+the exact Shapley values of f_S(x) = E[f(x) | x_S], where the expectation
+over the features outside S follows the training data's own split
+proportions (each node's `cover`, its weighted sample count). They are
+additive, so per sample
+
+    base + contributions.sum() == model output
+
+(GBR: the predicted value; RF: the probability of the positive class),
+with base the cover-weighted mean output, and — unlike per-path
+attributions — consistent: a feature the model relies on more never gets
+less credit.
+
+A leaf's share only depends on which of its d unique path features the
+sample satisfies. With z_j the product of cover ratios along feature j's
+edges on the path and o_j = 1 when x_j lies in the interval that reaches
+the leaf,
+
+    φ_i = v_leaf · (o_i − z_i) · Σ_s s!(d−1−s)!/d! · [tˢ] Π_{j≠i}(z_j + o_j t)
+
+which is TreeSHAP's EXTEND/UNWIND recursion written as polynomial
+coefficients. Since d ≤ max_depth, every leaf's φ for all 2^d on/off
+patterns is precomputed when the explainer is built (the "v2" table of
+Fast TreeSHAP, Yang 2021: ~1.5M values for either bundled model), so
+explaining a batch is one interval test per path feature, a table lookup
+and a per-feature sum — still every leaf of every tree per row, about ten
+times the cost of a prediction (~1 ms per row for the Ohio GBR).
+
+Usage:
+    from explain import TreeExplainer
+    explainer = TreeExplainer.for_model(bundle["gbr"])
+    base, contributions = explainer.explain(X_scaled)     # (n,), (n, n_features)
+
+    python explain.py --model ohio
+    python explain.py --model pima --rows 5000
+
+Output:
+    Additivity check (max |base + Σ contributions − prediction|), explain vs
+    predict time per row, and the features with the largest mean |contribution|
+"""
+
+import argparse
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from model_bundle import BundledForest, BundledGBR, TreeEnsemble
+
+GATHER_ELEMENTS = 1 << 20       # rows × leaves × path features evaluated per pass
+
+
+class TreeExplainer:
+    """Path-dependent TreeSHAP for one output of a flattened tree ensemble."""
+
+    def __init__(
+        self, ensemble: TreeEnsemble, output: int = 0, scale: float = 1.0, offset: float = 0.0,
+        roots: Optional[np.ndarray] = None,
+    ):
+        """
+        Model output = offset + scale · Σ_trees value[leaf, output]; use
+        scale = 1 / n_trees for an averaging forest. `roots` restricts the
+        explanation to a subset of the trees (default: all of them).
+        """
+        self.ensemble = ensemble
+        self.scale = scale
+        self._n_features = n_features = ensemble.n_features_in_
+        feature, threshold = ensemble.feature, ensemble.threshold
+        left, right = ensemble.left, ensemble.right
+        cover = np.asarray(ensemble.cover, dtype=np.float64)
+        node_value = np.asarray(ensemble.value[:, output], dtype=np.float64)
+
+        # Walk every tree top-down, carrying each path's per-feature cover
+        # product and reachable interval lo < x <= hi (split: x > threshold
+        # goes right); a feature split twice on a path keeps one merged entry
+        node = np.asarray(ensemble.roots if roots is None else roots, dtype=np.int64)
+        z = np.ones((len(node), n_features))
+        lo = np.full((len(node), n_features), -np.inf)
+        hi = np.full((len(node), n_features), np.inf)
+        used = np.zeros((len(node), n_features), dtype=bool)
+        parts = []
+        while len(node):
+            is_leaf = left[node] == node
+            parts.append((node[is_leaf], z[is_leaf], lo[is_leaf], hi[is_leaf], used[is_leaf]))
+            p = node[~is_leaf]
+            rows = np.arange(len(p))
+            f, thr = feature[p], threshold[p]
+            pz, plo, phi, pused = z[~is_leaf], lo[~is_leaf], hi[~is_leaf], used[~is_leaf]
+            pused[rows, f] = True
+            zl, zr = pz.copy(), pz.copy()
+            zl[rows, f] *= cover[left[p]] / cover[p]
+            zr[rows, f] *= cover[right[p]] / cover[p]
+            hl, lr = phi.copy(), plo.copy()
+            hl[rows, f] = np.minimum(hl[rows, f], thr)
+            lr[rows, f] = np.maximum(lr[rows, f], thr)
+            node = np.concatenate([left[p], right[p]])
+            z, lo = np.concatenate([zl, zr]), np.concatenate([plo, lr])
+            hi, used = np.concatenate([hl, phi]), np.concatenate([pused, pused])
+        leaves, z, lo, hi, used = (np.concatenate(a) for a in zip(*parts))
+        leaf_value = scale * node_value[leaves]
+        self.n_leaves = len(leaves)
+        self.base = offset + float(leaf_value @ z.prod(axis=1))
+
+        # Compress each leaf to its d unique path features, first d of
+        # `depth` slots; arrays are slot-major, (depth, leaves)
+        n_path = used.sum(axis=1)
+        depth = int(n_path.max(initial=0)) or 1
+        order = np.argsort(~used, axis=1, kind="stable")[:, :depth]
+        valid = np.take_along_axis(used, order, axis=1).T
+        self._feature = order.T.copy()
+        self._lo = np.where(valid, np.take_along_axis(lo, order, axis=1).T, np.inf)
+        self._hi = np.take_along_axis(hi, order, axis=1).T.copy()
+        z = np.take_along_axis(z, order, axis=1).T
+
+        # φ of every (leaf, on/off pattern, slot) in one flat table: leaf
+        # l's block starts at offsets[l] and holds 2^d patterns × d slots
+        sizes = (1 << n_path) * n_path
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self._table = np.zeros(int(sizes.sum()))
+        fact = np.array([math.factorial(k) for k in range(depth + 1)], dtype=np.float64)
+        for d in range(1, depth + 1):
+            group = np.flatnonzero(n_path == d)
+            if not len(group):
+                continue
+            s = np.arange(d)
+            weights = fact[s] * fact[d - 1 - s] / fact[d]
+            codes = np.arange(1 << d)
+            on = ((codes[:, None] >> s) & 1).T.astype(bool)               # (d, 2^d)
+            terms = _path_terms(on[:, :, None], z[:d, group][:, None], weights[:, None, None])
+            index = offsets[group] + codes[:, None] * d + s[:, None, None]  # (d, 2^d, group)
+            self._table[index] = terms * leaf_value[group]
+
+        # Lookup position of each (slot, leaf) entry, before adding
+        # pattern · d
+        slot, leaf = np.nonzero(valid)
+        self._entry_leaf = leaf
+        self._entry_start = offsets[leaf] + slot
+        self._entry_stride = n_path[leaf]
+        self._entry_feature = self._feature[slot, leaf]
+        self._bits = (1 << np.arange(depth))[:, None, None]
+
+    @classmethod
+    def for_model(cls, model: TreeEnsemble) -> "TreeExplainer":
+        """Explainer of a BundledGBR's prediction or a BundledForest's positive-class probability."""
+        if isinstance(model, BundledGBR):
+            return cls(model, output=0, scale=model.learning_rate, offset=model.init_value)
+        if isinstance(model, BundledForest):
+            return cls(model, output=len(model.classes_) - 1, scale=1.0 / model.n_trees)
+        raise TypeError(f"No tree attributions for {type(model).__name__}")
+
+    @property
+    def n_features(self) -> int:
+        return self._n_features
+
+    @property
+    def depth(self) -> int:
+        """Most unique features on any leaf's path."""
+        return self._feature.shape[0]
+
+    def explain(self, X) -> Tuple[np.ndarray, np.ndarray]:
+        """(base, contributions) for every row of X, shapes (n,) and (n, n_features)."""
+        # Same float32-against-float64 comparison as TreeEnsemble.apply;
+        # padding slots have an empty interval, so they are never on
+        X = np.asarray(X, dtype=np.float32)
+        n = len(X)
+        contributions = np.empty((n, self.n_features))
+        step = max(1, GATHER_ELEMENTS // self._feature.size)
+        for start in range(0, n, step):
+            block = X[start:start + step]
+            values = np.moveaxis(block[:, self._feature], 0, 1)          # (depth, m, leaves)
+            on = (values > self._lo[:, None]) & (values <= self._hi[:, None])
+            pattern = (on * self._bits).sum(axis=0)                        # (m, leaves)
+            terms = self._table[self._entry_start + pattern[:, self._entry_leaf] * self._entry_stride]
+            # Sum every row's terms per feature: bin = row · n_features + feature
+            bins = np.arange(len(block))[:, None] * self.n_features + self._entry_feature
+            contributions[start:start + step] = np.bincount(
+                bins.reshape(-1), weights=terms.reshape(-1), minlength=len(block) * self.n_features
+            ).reshape(len(block), self.n_features)
+        return np.full(n, self.base), contributions
+
+
+def _path_terms(on: np.ndarray, z: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    (o_i − z_i) · Σ_s w_s [tˢ] Π_{j≠i}(z_j + o_j t) for every path slot i
+    (axis 0) of paths with d = len(on) features; `z` and `weights` broadcast
+    against `on`.
+    """
+    depth = len(on)
+    o = on.astype(np.float64)
+
+    # Coefficients of P(t) = Π_j (z_j + o_j t), lowest power first
+    poly = [np.ones(on.shape[1:])] + [np.zeros(on.shape[1:]) for _ in range(depth)]
+    for j in range(depth):
+        for k in range(j + 1, 0, -1):
+            poly[k] = z[j] * poly[k] + o[j] * poly[k - 1]
+        poly[0] = z[j] * poly[0]
+
+    # Off slots (o_i = 0): dividing out the constant z_i cancels against
+    # the (0 − z_i) factor, leaving −Σ_s w_s [tˢ] P
+    off = -sum(weights[k] * poly[k] for k in range(depth))
+    # On slots: divide P by (z_i + t) from the top coefficient down
+    q = np.broadcast_to(poly[depth], np.broadcast_shapes(on.shape, z.shape))
+    total = weights[depth - 1] * q
+    for k in range(depth - 1, 0, -1):
+        q = poly[k] - z * q
+        total = total + weights[k - 1] * q
+    return np.where(on, (1.0 - z) * total, off)
+
+
+def top_contributions(
+    contributions: np.ndarray, names: Sequence[str], k: int = 5, min_abs: float = 0.0, digits: int = 4
+) -> List[Dict[str, float]]:
+    """The `k` largest |contributions| of one sample as [{feature, contribution}], largest first."""
+    order = np.argsort(-np.abs(contributions), kind="stable")[:k]
+    return [
+        {"feature": names[i], "contribution": round(float(contributions[i]), digits)}
+        for i in order if abs(contributions[i]) > min_abs
+    ]
+
+
+def _test_rows(model: str, rows: int) -> Tuple[TreeEnsemble, np.ndarray, np.ndarray, List[str]]:
+    """Model, scaled inputs, reference outputs and feature names for the CLI check."""
+    if model == "ohio":
+        import forecast
+        from model_bundle import OHIO_BUNDLE_PATH, load_bundle
+        bundle = load_bundle(OHIO_BUNDLE_PATH)
+        rng = np.random.default_rng(0)
+        histories = [np.clip(rng.uniform(70, 250) + rng.normal(0, 6, 20).cumsum(), 40, 400) for _ in range(rows)]
+        values, counts = forecast.history_matrix(histories)
+        current = values[:, -1]
+        X = bundle["scaler"].transform(forecast.ohio_features(
+            values, counts, current, rng.integers(0, 24, rows), rng.integers(0, 7, rows),
+        ))
+        gbr = bundle["gbr"]
+        return gbr, X, gbr.predict(X), list(forecast.OHIO_FEATURE_NAMES)
+
+    import pandas as pd
+    from compact_models import PIMA_DATA_PATH
+    from predict import PIMA_FEATURE_NAMES, clean_pima_frame, load_bundle_cached
+    bundle = load_bundle_cached()
+    features = clean_pima_frame(pd.read_csv(PIMA_DATA_PATH))[PIMA_FEATURE_NAMES].to_numpy(dtype=np.float64)
+    features = np.resize(features, (rows, features.shape[1]))
+    X = bundle["scaler"].transform(features)
+    rf = bundle["rf"]
+    return rf, X, rf.predict_proba(X)[:, -1], PIMA_FEATURE_NAMES
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Check and time TreeSHAP attributions.")
+    parser.add_argument("--model", choices=("ohio", "pima"), default="ohio")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print(f"Bluely TreeSHAP Attributions ({args.model})")
+    print("=" * 60)
+
+    print("\n[1/3] Loading model and precomputing leaf paths ...")
+    model, X, reference, names = _test_rows(args.model, args.rows)
+    t0 = time.perf_counter()
+    explainer = TreeExplainer.for_model(model)
+    print(f"  {model.n_trees} trees, {explainer.n_leaves} leaves, "
+          f"≤ {explainer.depth} of {explainer.n_features} features per path "
+          f"in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    print(f"\n[2/3] Explaining {args.rows} rows ...")
+    predict = model.predict if isinstance(model, BundledGBR) else model.predict_proba
+    timings = {}
+    for label, fn in (("predict", lambda: predict(X)), ("explain", lambda: explainer.explain(X)),
+                      ("predict, 1 row", lambda: predict(X[:1])), ("explain, 1 row", lambda: explainer.explain(X[:1]))):
+        fn()
+        repeats = 5 if "1 row" not in label else 200
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        timings[label] = (time.perf_counter() - t0) / repeats * 1000
+    base, contributions = explainer.explain(X)
+    error = np.abs(base + contributions.sum(axis=1) - reference).max()
+    print(f"  Additivity: max |base + Σ contributions − output| = {error:.2e}")
+    print(f"  Batch:  predict {timings['predict']:.1f} ms, explain {timings['explain']:.1f} ms")
+    print(f"  1 row:  predict {timings['predict, 1 row']:.3f} ms, explain {timings['explain, 1 row']:.3f} ms")
+
+    print(f"\n[3/3] Largest mean |contribution| (base {base[0]:.3f})")
+    mean_abs = np.abs(contributions).mean(axis=0)
+    for item in top_contributions(mean_abs, names, args.top):
+        print(f"  {item['feature']:<28} {item['contribution']:.4f}")
+    print("\n✓ Attributions add up to the model output" if error < 1e-6 else "\n✗ Attributions do not add up")
+
+
+if __name__ == "__main__":
+    main()
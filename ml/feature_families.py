@@ -0,0 +1,218 @@
+"""
+OhioT1DM Feature Families
+==========================
+Optional feature groups appended to the 26 base temporal features, built
+from OhioT1DM sections the base features do not use.
+
+Each family declares the parsed sections it reads (keys of the dict
+load_patient_xml returns), its column names and a vectorized compute step
+over the sample times. Families are opt-in through the feature spec
+(`feature_params["families"]`): a spec without families builds exactly the
+base matrix, and `parse_ohio.required_sections` only asks the parser for the
+sections that the base features and the chosen families read — nothing
+else in the XML file is converted.
+
+    iob          bolus, basal, temp_basal    bolus insulin on board, current basal rate
+    kinetics     bolus, meal                 insulin / carbs on board and acting in the next
+                                             30 min, from kinetics.py's activity curves
+    gsr          gsr                         mean galvanic skin response, last hour
+    skin_temp    skin_temp                   mean skin temperature and its change, last hour
+    stress       stressors, illness, work    recent stressor, illness, work intensity
+    band_sleep   basis_sleep                 asleep according to the wristband
+
+Missing sections (e.g. app exports, which have no wristband data) give the
+family's neutral value (0) rather than an error.
+
+Usage:
+    from feature_families import family_feature_names, family_features
+    names = family_feature_names(["iob", "gsr"])
+    F = family_features(["iob", "gsr"], sample_times, data)   # (n, len(names))
+
+    python train_ohio.py --families iob,stress
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import kinetics
+
+# Linear-decay insulin action: a bolus is fully active when given and spent
+# after this many minutes.
+INSULIN_ACTION_MIN = 240.0
+WINDOW_MIN = 60.0
+STRESSOR_MIN = 120.0
+
+Compute = Callable[[np.ndarray, Dict[str, pd.DataFrame], np.datetime64], np.ndarray]
+
+
+class FeatureFamily:
+    """A named group of feature columns computed from some parsed sections."""
+
+    def __init__(self, name: str, sections: Tuple[str, ...], columns: Tuple[str, ...], compute: Compute):
+        self.name = name
+        self.sections = sections
+        self.columns = columns
+        self.compute = compute
+
+
+# ── Vectorized helpers ──────────────────────────────────────────────────────
+# Times are minutes as float64, relative to the first sample, so that sums of
+# dose × time stay well inside float64 precision.
+
+def _minutes(times: np.ndarray, origin: np.datetime64) -> np.ndarray:
+    return (np.asarray(times, dtype="datetime64[ns]") - origin) / np.timedelta64(1, "m")
+
+
+def _section(data: Dict[str, pd.DataFrame], name: str, origin: np.datetime64, *columns: str):
+    """(times, column arrays...) of a section, sorted by time; empty arrays if absent."""
+    df = data.get(name)
+    if df is None or len(df) == 0 or any(c not in df.columns for c in ("timestamp",) + columns):
+        return (np.empty(0),) + tuple(np.empty(0) for _ in columns)
+    df = df.sort_values("timestamp", kind="stable")
+    return tuple(
+        _minutes(df[c].values, origin) if pd.api.types.is_datetime64_any_dtype(df[c])
+        else df[c].to_numpy(dtype=np.float64)
+        for c in ("timestamp",) + columns
+    )
+
+
+def _window_sums(
+    event_t: np.ndarray, values: np.ndarray, t: np.ndarray, width: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum and count of `values` with event time in [t - width, t), per sample."""
+    lo = np.searchsorted(event_t, t - width, side="left")
+    hi = np.searchsorted(event_t, t, side="left")
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    return csum[hi] - csum[lo], (hi - lo).astype(np.float64)
+
+
+def _window_mean(event_t: np.ndarray, values: np.ndarray, t: np.ndarray, width: float) -> np.ndarray:
+    total, count = _window_sums(event_t, values, t, width)
+    return np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+
+
+def _covering(begin: np.ndarray, end: np.ndarray, values: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Value of the latest interval begun at or before t that has not ended, else 0."""
+    idx = np.searchsorted(begin, t, side="right") - 1
+    safe = np.maximum(idx, 0)
+    active = (idx >= 0) & (end[safe] >= t) if len(begin) else np.zeros(len(t), dtype=bool)
+    return np.where(active, values[safe] if len(begin) else 0.0, 0.0)
+
+
+# ── Families ────────────────────────────────────────────────────────────────
+
+def _iob(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    # Bolus IOB = Σ dose·(1 - (t - t_j)/D) over boluses in [t - D, t), which
+    # splits into window sums of dose and dose·t_j.
+    bt, dose = _section(data, "bolus", origin, "dose")
+    lo = np.searchsorted(bt, t - INSULIN_ACTION_MIN, side="left")
+    hi = np.searchsorted(bt, t, side="left")
+    c_dose = np.concatenate([[0.0], np.cumsum(dose)])
+    c_dose_t = np.concatenate([[0.0], np.cumsum(dose * bt)])
+    s_dose = c_dose[hi] - c_dose[lo]
+    s_dose_t = c_dose_t[hi] - c_dose_t[lo]
+    iob = s_dose * (1.0 - t / INSULIN_ACTION_MIN) + s_dose_t / INSULIN_ACTION_MIN
+
+    # Basal rate: last scheduled rate change, overridden by an active temp basal
+    at, rate = _section(data, "basal", origin, "value")
+    idx = np.searchsorted(at, t, side="right") - 1
+    basal = np.where(idx >= 0, rate[np.maximum(idx, 0)] if len(at) else 0.0, 0.0)
+    tb, tend, trate = _section(data, "temp_basal", origin, "end", "value")
+    if len(tb):
+        idx = np.searchsorted(tb, t, side="right") - 1
+        safe = np.maximum(idx, 0)
+        active = (idx >= 0) & (tend[safe] >= t)
+        basal = np.where(active, trate[safe], basal)
+    return np.column_stack([np.maximum(iob, 0.0), basal])
+
+
+def _kinetics(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    # Every bolus (rapid-acting curve) and meal still active, not a linear decay
+    bt, dose = _section(data, "bolus", origin, "dose")
+    mt, carbs = _section(data, "meal", origin, "carbs")
+    iob, insulin_next = kinetics.event_sums(bt, np.nan_to_num(dose), t, kinetics.INSULIN_REMAINING[kinetics.MED_RAPID])
+    cob, carbs_next = kinetics.event_sums(mt, np.nan_to_num(carbs), t, kinetics.CARB_REMAINING)
+    return np.column_stack([iob, insulin_next, cob, carbs_next])
+
+
+def _gsr(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    gt, value = _section(data, "gsr", origin, "value")
+    return _window_mean(gt, value, t, WINDOW_MIN)[:, None]
+
+
+def _skin_temp(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    st, value = _section(data, "skin_temp", origin, "value")
+    mean = _window_mean(st, value, t, WINDOW_MIN)
+    lo = np.searchsorted(st, t - WINDOW_MIN, side="left")
+    hi = np.searchsorted(st, t, side="left")
+    if len(st):
+        change = np.where(hi > lo, value[np.maximum(hi - 1, 0)] - value[np.minimum(lo, len(st) - 1)], 0.0)
+    else:
+        change = np.zeros(len(t))
+    return np.column_stack([mean, change])
+
+
+def _stress(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    rt, _ = _section(data, "stressors", origin, "value")
+    _, recent = _window_sums(rt, np.ones(len(rt)), t, STRESSOR_MIN)
+    ib, iend, ival = _section(data, "illness", origin, "end", "value")
+    wb, wend, wval = _section(data, "work", origin, "end", "value")
+    return np.column_stack([
+        (recent > 0).astype(np.float64),
+        (_covering(ib, iend, ival, t) > 0).astype(np.float64),
+        _covering(wb, wend, wval, t),
+    ])
+
+
+def _band_sleep(t: np.ndarray, data: Dict[str, pd.DataFrame], origin: np.datetime64) -> np.ndarray:
+    sb, send = _section(data, "basis_sleep", origin, "end")
+    return (_covering(sb, send, np.ones(len(sb)), t) > 0).astype(np.float64)[:, None]
+
+
+FAMILIES: Dict[str, FeatureFamily] = {
+    f.name: f
+    for f in (
+        FeatureFamily("iob", ("bolus", "basal", "temp_basal"), ("iob_bolus", "basal_rate"), _iob),
+        FeatureFamily("kinetics", ("bolus", "meal"),
+                      ("insulin_on_board", "insulin_next_30min", "carbs_on_board", "carbs_next_30min"), _kinetics),
+        FeatureFamily("gsr", ("gsr",), ("gsr_mean",), _gsr),
+        FeatureFamily("skin_temp", ("skin_temp",), ("skin_temp_mean", "skin_temp_change"), _skin_temp),
+        FeatureFamily("stress", ("stressors", "illness", "work"),
+                      ("recent_stressor", "illness", "work_intensity"), _stress),
+        FeatureFamily("band_sleep", ("basis_sleep",), ("band_asleep",), _band_sleep),
+    )
+}
+
+
+def resolve(families: Optional[Iterable[str]]) -> List[FeatureFamily]:
+    """FeatureFamily objects for family names, in the given order; ValueError for unknown names."""
+    out = []
+    for name in families or ():
+        if name not in FAMILIES:
+            raise ValueError(f"Unknown feature family {name!r} (known: {', '.join(FAMILIES)})")
+        out.append(FAMILIES[name])
+    return out
+
+
+def family_sections(families: Optional[Iterable[str]]) -> List[str]:
+    """Parsed sections read by the given families (deduplicated, in order)."""
+    return list(dict.fromkeys(s for f in resolve(families) for s in f.sections))
+
+
+def family_feature_names(families: Optional[Iterable[str]]) -> List[str]:
+    return [c for f in resolve(families) for c in f.columns]
+
+
+def family_features(
+    families: Sequence[str], sample_times: np.ndarray, data: Dict[str, pd.DataFrame]
+) -> np.ndarray:
+    """(n_samples, n_family_columns) matrix for the given sample timestamps."""
+    resolved = resolve(families)
+    times = np.asarray(sample_times, dtype="datetime64[ns]")
+    if not resolved or len(times) == 0:
+        return np.empty((len(times), sum(len(f.columns) for f in resolved)))
+    origin = times[0]
+    t = _minutes(times, origin)
+    return np.hstack([f.compute(t, data, origin) for f in resolved])
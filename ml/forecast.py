@@ -0,0 +1,382 @@
+"""
+Bluely 30-Minute Forecast Core
+================================
+Vectorized numeric pipeline behind POST /predict-glucose-30.
+
+Every step that turns readings and context into the final predicted value
+lives here and operates on whole batches of NumPy arrays:
+
+    1. Ohio feature vector / statistical extrapolation (base prediction)
+    2. Meal and medication effects (per-factor rules)
+    3. Meal + insulin interaction, time-of-day and activity adjustments
+    4. Total adjustment cap, sparse-data anchoring, safety bounds
+
+The server calls these functions with a batch of one; backtest.py and other
+offline tools call them with millions of rows. Both therefore evaluate the
+exact same production logic.
+
+Reading histories are passed as a right-aligned matrix `values` of shape
+(n, window) — newest reading in the last column, NaN to the left of the
+oldest — plus `counts`, the number of valid readings per row.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+N_OHIO_FEATURES = 26
+# Columns of `ohio_features`, in order
+OHIO_FEATURE_NAMES = (
+    [f"glucose_lag_{i}" for i in range(1, 7)]
+    + [f"glucose_diff_{i}" for i in range(1, 6)]
+    + ["recent_mean", "recent_std", "recent_min", "recent_max",
+       "hour_sin", "hour_cos", "dow_sin", "dow_cos",
+       "rate_of_change", "acceleration", "current_glucose"]
+    + [f"unused_{i}" for i in range(1, N_OHIO_FEATURES - 21)]
+)
+
+# Medication type codes used by `medication_effect`
+MED_NONE, MED_RAPID, MED_LONG, MED_MIXED, MED_METFORMIN = 0, 1, 2, 3, 4
+MED_TYPE_CODES = {
+    "insulin_rapid": MED_RAPID,
+    "insulin_long": MED_LONG,
+    "insulin_mixed": MED_MIXED,
+    "metformin": MED_METFORMIN,
+}
+
+# Meal phases returned by `meal_effect`
+MEAL_NONE = 0
+MEAL_CARBS_RECENT = 1      # < 30 min, carbs known
+MEAL_CARBS_POST = 2        # 30-90 min, carbs known
+MEAL_CARBS_LATE = 3        # 90-180 min, carbs known
+MEAL_RECENT = 4            # < 1 hr, carbs unknown
+MEAL_POST = 5              # 1-2 hrs, carbs unknown
+MEAL_WINDOW = 6            # 2-3 hrs, carbs unknown (counted, no effect)
+
+# Medication phases returned by `medication_effect`
+MED_PHASE_NONE = 0
+MED_PHASE_RAPID_ONSET = 1
+MED_PHASE_RAPID_PEAK = 2
+MED_PHASE_RAPID_WANING = 3
+MED_PHASE_LONG = 4
+MED_PHASE_MIXED_PEAK = 5
+MED_PHASE_MIXED_ACTIVE = 6
+MED_PHASE_METFORMIN = 7
+
+# Hours since medication implied by a reading's `medicationTiming`
+TIMING_HOURS = {
+    "just_before": 0.05,
+    "with_reading": 0.0,
+    "30min_before": 0.5,
+    "1hr_before": 1.0,
+    "2hr_before": 2.0,
+    "previous_night": 10.0,
+    "earlier_today": 4.0,
+}
+DEFAULT_TIMING_HOURS = 0.5
+
+# Time-of-day codes returned by `apply_context`
+TOD_NONE, TOD_DAWN, TOD_NIGHT = 0, 1, 2
+
+# Risk levels returned by `risk_level` (riskAlert thresholds, mg/dL)
+RISK_NONE, RISK_LOW, RISK_HIGH, RISK_VERY_HIGH = 0, 1, 2, 3
+RISK_NAMES = {RISK_LOW: "low", RISK_HIGH: "high", RISK_VERY_HIGH: "very_high"}
+RISK_LOW_BELOW = 70
+RISK_HIGH_ABOVE = 180
+RISK_VERY_HIGH_ABOVE = 250
+
+
+# ── Reading histories ───────────────────────────────────────────────────────
+
+def history_matrix(histories: Sequence[Sequence[float]], window: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack ragged reading lists (oldest → newest) into a right-aligned
+    NaN-padded matrix. With `window`, only the newest `window` readings of
+    each history are kept.
+    """
+    counts = np.array([len(h) for h in histories], dtype=np.int64)
+    width = int(window or (counts.max() if len(counts) else 1))
+    width = max(width, 1)
+    values = np.full((len(histories), width), np.nan)
+    for i, h in enumerate(histories):
+        tail = np.asarray(h[-width:], dtype=np.float64)
+        if len(tail):
+            values[i, width - len(tail):] = tail
+    return values, np.minimum(counts, width)
+
+
+def _tail6(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Last 6 readings per row, left-padded by repeating the oldest reading."""
+    width = values.shape[1]
+    if width < 6:
+        # Histories narrower than 6 columns: pad the matrix on the left first
+        pad = np.full((values.shape[0], 6 - width), np.nan)
+        values, width = np.hstack([pad, values]), 6
+    cols = np.arange(width - 6, width)[None, :]
+    first_valid = (width - np.asarray(counts))[:, None]
+    src = np.minimum(np.maximum(cols, first_valid), width - 1)
+    return np.take_along_axis(values, src, axis=1)
+
+
+def ohio_features(
+    values: np.ndarray,
+    counts: np.ndarray,
+    current: np.ndarray,
+    hour: np.ndarray,
+    dow: np.ndarray,
+) -> np.ndarray:
+    """
+    Build the 26-feature vectors compatible with the OhioT1DM model.
+    For sparse user data we extrapolate from available readings.
+    """
+    recent = _tail6(values, counts)  # (n, 6), oldest → newest
+
+    lags = recent[:, ::-1]                        # 6: glucose_lag_1..6 (most recent first)
+    diffs = recent[:, 1:] - recent[:, :-1]        # 5: glucose_diff_1..5
+    constant = (recent == recent[:, :1]).all(axis=1)
+    std = np.where(constant, 0.0, recent.std(axis=1))
+    stats = np.column_stack([recent.mean(axis=1), std, recent.min(axis=1), recent.max(axis=1)])
+
+    hour = np.asarray(hour, dtype=np.float64)
+    dow = np.asarray(dow, dtype=np.float64)
+    time = np.column_stack([
+        np.sin(2 * np.pi * hour / 24),
+        np.cos(2 * np.pi * hour / 24),
+        np.sin(2 * np.pi * dow / 7),
+        np.cos(2 * np.pi * dow / 7),
+    ])
+
+    roc = (recent[:, -1] - recent[:, 0]) / 5      # rate of change over 6 points
+    accel = diffs[:, -1] - diffs[:, -2]
+
+    n = len(recent)
+    features = np.column_stack([
+        lags, diffs, stats, time, roc, accel, np.asarray(current, dtype=np.float64),
+        np.zeros((n, N_OHIO_FEATURES - 22)),      # unused trailing slots
+    ])
+    return features
+
+
+def index_slope(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Least-squares slope of each row's readings against their index
+    (0..count-1), i.e. `np.polyfit(arange(n), values, 1)[0]`, in closed form.
+    Rows with fewer than 2 readings get slope 0.
+    """
+    width = values.shape[1]
+    valid = ~np.isnan(values)
+    x = np.arange(width)[None, :] - (width - counts)[:, None]   # 0 at the oldest valid reading
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, values, 0.0)
+    n = counts.astype(np.float64)
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+    denom = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sxy - sx * sy) / denom
+    return np.where(counts >= 2, slope, 0.0)
+
+
+def statistical_30min(values: np.ndarray, counts: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Fallback: linear extrapolation for 30 min using available readings."""
+    return extrapolate_30min(current, index_slope(values, counts))
+
+
+def extrapolate_30min(current: np.ndarray, slope: np.ndarray) -> np.ndarray:
+    """statistical_30min from an already computed per-reading slope."""
+    # Assume ~30 min step
+    return np.asarray(current, dtype=np.float64) + np.asarray(slope, dtype=np.float64) * 0.5
+
+
+def reading_stats(values: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and population std of each row's valid readings."""
+    valid = ~np.isnan(values)
+    n = np.maximum(counts, 1)
+    mean = np.where(valid, values, 0.0).sum(axis=1) / n
+    var = np.where(valid, (values - mean[:, None]) ** 2, 0.0).sum(axis=1) / n
+    return mean, np.sqrt(var)
+
+
+# ── Context rules ───────────────────────────────────────────────────────────
+
+def meal_effect(hours: np.ndarray, carbs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Glucose effect (mg/dL, positive = rise) of a logged meal `hours` ago.
+
+    Returns (effect, phase). Meals 3+ hours ago (or with unknown time, NaN)
+    have phase MEAL_NONE and do not count as a factor.
+    """
+    hours = np.asarray(hours, dtype=np.float64)
+    carbs = np.nan_to_num(np.asarray(carbs, dtype=np.float64))
+    with np.errstate(invalid="ignore"):
+        in_window = hours < 3
+        has_carbs = carbs > 0
+        phase = np.select(
+            [
+                in_window & has_carbs & (hours < 0.5),
+                in_window & has_carbs & (hours < 1.5),
+                in_window & has_carbs,
+                in_window & (hours < 1),
+                in_window & (hours < 2),
+                in_window,
+            ],
+            [MEAL_CARBS_RECENT, MEAL_CARBS_POST, MEAL_CARBS_LATE, MEAL_RECENT, MEAL_POST, MEAL_WINDOW],
+            default=MEAL_NONE,
+        )
+    effect = np.select(
+        [phase == MEAL_CARBS_RECENT, phase == MEAL_CARBS_POST, phase == MEAL_CARBS_LATE,
+         phase == MEAL_RECENT, phase == MEAL_POST],
+        [np.minimum(carbs * 0.12, 20), np.minimum(carbs * 0.06, 12), 2.0, 8.0, 3.0],
+        default=0.0,
+    )
+    return effect, phase
+
+
+def medication_effect(
+    med_type: np.ndarray, hours: np.ndarray, dosage: np.ndarray, inline: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Glucose-lowering effect (mg/dL, positive = lowers) of one medication dose.
+
+    `med_type` holds MED_* codes. `inline` selects the rules for medication
+    recorded on a glucose reading (timing is approximate, so long-acting and
+    mixed insulin have no upper time limit). Returns (effect, phase).
+    """
+    med_type = np.asarray(med_type)
+    hours = np.asarray(hours, dtype=np.float64)
+    dosage = np.nan_to_num(np.asarray(dosage, dtype=np.float64))
+    rapid, long_, mixed, metformin = (med_type == MED_RAPID, med_type == MED_LONG,
+                                      med_type == MED_MIXED, med_type == MED_METFORMIN)
+    with np.errstate(invalid="ignore"):
+        if inline:
+            long_ok = long_
+            mixed_active = mixed & ~(hours < 2)
+            metformin_ok = metformin
+        else:
+            long_ok = long_ & (hours < 24)
+            mixed_active = mixed & (hours >= 2) & (hours < 6)
+            metformin_ok = metformin & (hours < 6)
+        phase = np.select(
+            [
+                rapid & (hours < 0.25),
+                rapid & (hours < 2),
+                rapid & (hours < 4),
+                long_ok,
+                mixed & (hours < 2),
+                mixed_active,
+                metformin_ok,
+            ],
+            [MED_PHASE_RAPID_ONSET, MED_PHASE_RAPID_PEAK, MED_PHASE_RAPID_WANING, MED_PHASE_LONG,
+             MED_PHASE_MIXED_PEAK, MED_PHASE_MIXED_ACTIVE, MED_PHASE_METFORMIN],
+            default=MED_PHASE_NONE,
+        )
+    effect = np.select(
+        [phase == MED_PHASE_RAPID_ONSET, phase == MED_PHASE_RAPID_PEAK, phase == MED_PHASE_RAPID_WANING,
+         phase == MED_PHASE_LONG, phase == MED_PHASE_MIXED_PEAK, phase == MED_PHASE_MIXED_ACTIVE,
+         phase == MED_PHASE_METFORMIN],
+        [np.minimum(dosage * 0.2, 6), np.minimum(dosage * 0.5, 15), np.minimum(dosage * 0.2, 8),
+         np.minimum(dosage * 0.1, 6), np.minimum(dosage * 0.35, 12), np.minimum(dosage * 0.15, 6), 3.0],
+        default=0.0,
+    )
+    return effect, phase
+
+
+def apply_context(
+    base: np.ndarray,
+    current: np.ndarray,
+    counts: np.ndarray,
+    hour: np.ndarray,
+    meal_adjustment: np.ndarray,
+    med_adjustment: np.ndarray,
+    has_activity: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Combine the base prediction with context adjustments, cap them, anchor
+    sparse histories to the current value and apply the safety bounds.
+
+    `meal_adjustment` / `med_adjustment` are signed mg/dL (medication is
+    negative). Returns the final `predicted` value plus the flags the server
+    turns into factor strings.
+    """
+    base = np.asarray(base, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    hour = np.asarray(hour)
+    meal_adjustment = np.asarray(meal_adjustment, dtype=np.float64)
+    med_adjustment = np.asarray(med_adjustment, dtype=np.float64)
+
+    adjustment = meal_adjustment + med_adjustment
+
+    # Meal + insulin partially offset each other; shrink the combined
+    # magnitude slightly to avoid double-counting.
+    interaction = (meal_adjustment > 0) & (med_adjustment < 0)
+    reduction = np.minimum(np.abs(meal_adjustment), np.abs(med_adjustment)) * 0.3
+    adjustment = np.where(interaction, np.where(adjustment > 0, adjustment - reduction, adjustment + reduction),
+                          adjustment)
+
+    dawn = (hour >= 4) & (hour <= 7)
+    night = ~dawn & ((hour >= 22) | (hour <= 3))
+    adjustment = adjustment + np.where(dawn, 4.0, 0.0) - np.where(night, 2.0, 0.0)
+    adjustment = adjustment - np.where(has_activity, 4.0, 0.0)
+
+    # Total cap: ±25 mg/dL or ±12% of current (whichever is smaller)
+    max_total = np.minimum(25, current * 0.12)
+    adjustment = np.clip(adjustment, -max_total, max_total)
+
+    # Anchor to current glucose (sparse data protection)
+    adjusted = base + adjustment
+    predicted = np.select(
+        [counts == 1, counts <= 3, counts <= 6],
+        [current * 0.7 + adjusted * 0.3, current * 0.5 + adjusted * 0.5, current * 0.25 + adjusted * 0.75],
+        default=adjusted,
+    )
+
+    # Never predict more than 30% away from current within 30 min
+    lower = np.maximum(60, current * 0.70)
+    upper = np.minimum(400, current * 1.30)
+    floor_hit = predicted < lower
+    ceiling_hit = ~floor_hit & (predicted > upper)
+    predicted = np.clip(np.where(floor_hit, lower, np.where(ceiling_hit, upper, predicted)), 55, 400)
+
+    return {
+        "predicted": predicted,
+        "interaction": interaction,
+        "time_of_day": np.select([dawn, night], [TOD_DAWN, TOD_NIGHT], default=TOD_NONE),
+        "floor_hit": floor_hit,
+        "ceiling_hit": ceiling_hit,
+        "lower": lower,
+        "upper": upper,
+    }
+
+
+def direction_of(predicted: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """+1 rising, -1 dropping, 0 stable (±8 mg/dL dead band)."""
+    delta = np.asarray(predicted) - np.asarray(current)
+    return np.select([delta > 8, delta < -8], [1, -1], default=0)
+
+
+def risk_level(predicted: np.ndarray) -> np.ndarray:
+    """RISK_* code of each predicted value: below 70, above 250, above 180, else none."""
+    predicted = np.asarray(predicted, dtype=np.float64)
+    return np.select(
+        [predicted < RISK_LOW_BELOW, predicted > RISK_VERY_HIGH_ABOVE, predicted > RISK_HIGH_ABOVE],
+        [RISK_LOW, RISK_VERY_HIGH, RISK_HIGH],
+        default=RISK_NONE,
+    )
+
+
+def forecast_confidence(
+    counts: np.ndarray,
+    cv: np.ndarray,
+    model_used: np.ndarray,
+    factor_count: np.ndarray,
+    missing_penalty: np.ndarray,
+) -> np.ndarray:
+    """
+    Confidence: penalize for fewer readings AND fewer context factors.
+    Unrounded; callers round to 2 decimals for display.
+    """
+    base = np.minimum(0.40 + (counts / 15) * 0.30, 0.80)
+    base = np.where(model_used, np.minimum(base + 0.1, 0.90), base)
+    # Bonus for having more context
+    base = np.minimum(base + np.minimum(factor_count * 0.03, 0.12), 0.92)
+    return np.maximum(0.25, base - np.minimum(cv * 0.4, 0.25) - missing_penalty)
@@ -0,0 +1,247 @@
+"""
+Bluely Glycemic Metrics
+========================
+Vectorized CGM summary metrics behind POST /glycemic-metrics, for long
+histories (90 days of 5-minute readings is ~26k points per user) and for
+many users at once.
+
+Like trend.py, a batch is one flat array of readings plus `lengths` (readings
+per user); every metric is built from per-segment sums (np.bincount over a
+segment id) in a fixed number of array passes, never a Python loop over
+readings:
+
+    readings, mean, SD, CV (%)      sums of g and g²
+    GMI (%)                         3.31 + 0.02392 × mean (Bergenstal 2018)
+    time in ranges (% of readings)  <54, 54-69, 70-180, 181-250, >250 mg/dL
+    LBGI / HBGI                     mean low/high risk of Kovatchev's
+                                    symmetrised BG scale
+    hypo episodes                   runs of readings <70 (level 1) and <54
+                                    (level 2) lasting ≥15 minutes, a
+                                    reading covering the 5 minutes after it;
+                                    gaps over 30 minutes end a run
+    MAGE                            mean amplitude of the swings between
+                                    consecutive turning points that exceed
+                                    one SD (turning-point approximation of
+                                    Service's MAGE: no excursion merging)
+
+The same sums taken per (user, day) are daily roll-ups. Roll-ups add up, so
+metrics for any range of days come from combining stored roll-ups instead of
+re-scanning raw readings (`combine_rollups`). Combined results equal the
+direct computation except for MAGE (each day's swings are judged against
+that day's SD) and for hypo episodes crossing midnight (counted per day).
+
+Usage:
+    import glycemic
+    sums = glycemic.segment_sums(values, minutes, lengths)
+    metrics = glycemic.metrics_from_sums(sums)
+
+    python glycemic.py readings.csv --output metrics.csv --daily daily.csv
+
+    readings.csv: user,timestamp,value (any order)
+
+Output:
+    metrics.csv — per-user metrics; daily.csv — per-user, per-day roll-ups
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+VERY_LOW, LOW, HIGH, VERY_HIGH = 54.0, 70.0, 180.0, 250.0
+READING_MINUTES = 5.0        # time one CGM reading stands for
+HYPO_MIN_MINUTES = 15.0
+MAX_GAP_MINUTES = 30.0
+MINUTES_PER_DAY = 1440
+
+# Additive per-segment sums; a roll-up row is one of these per (user, day)
+SUM_FIELDS = (
+    "n", "sum", "sum_sq", "very_low", "low", "in_range", "high", "very_high",
+    "lbgi_sum", "hbgi_sum", "hypo_episodes", "severe_hypo_episodes", "mage_sum", "mage_count",
+)
+
+
+def _segment_starts(seg: np.ndarray) -> np.ndarray:
+    return np.r_[True, seg[1:] != seg[:-1]] if len(seg) else np.zeros(0, dtype=bool)
+
+
+def risk_scores(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Kovatchev low and high BG risk per reading (mg/dL)."""
+    f = 1.509 * (np.log(np.maximum(values, 1.0)) ** 1.084 - 5.381)
+    r = 10.0 * f * f
+    return np.where(f < 0, r, 0.0), np.where(f > 0, r, 0.0)
+
+
+def episode_counts(
+    values: np.ndarray, minutes: np.ndarray, seg: np.ndarray, n_seg: int, threshold: float
+) -> np.ndarray:
+    """Per-segment number of runs below `threshold` lasting at least HYPO_MIN_MINUTES."""
+    below = values < threshold
+    if not below.any():
+        return np.zeros(n_seg)
+    breaks = _segment_starts(seg) | (np.r_[np.inf, np.diff(minutes)] > MAX_GAP_MINUTES)
+    prev_below = np.r_[False, below[:-1]]
+    next_below = np.r_[below[1:], False]
+    next_break = np.r_[breaks[1:], True]
+    starts = np.flatnonzero(below & (breaks | ~prev_below))
+    ends = np.flatnonzero(below & (next_break | ~next_below))
+    duration = minutes[ends] - minutes[starts] + READING_MINUTES
+    return np.bincount(seg[starts], weights=(duration >= HYPO_MIN_MINUTES), minlength=n_seg)
+
+
+def mage_sums(values: np.ndarray, seg: np.ndarray, n_seg: int, sd: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-segment sum and count of turning-point swings larger than the segment's SD."""
+    if len(values) < 2:
+        return np.zeros(n_seg), np.zeros(n_seg)
+    # Drop repeated values so flat stretches do not hide a turning point
+    first = _segment_starts(seg)
+    keep = first | (values != np.r_[np.nan, values[:-1]])
+    v, s = values[keep], seg[keep]
+    first = _segment_starts(s)
+    last = np.r_[first[1:], True]
+    step = np.sign(np.diff(v))
+    turning = np.r_[False, step[1:] != step[:-1], False]
+    points = np.flatnonzero(first | last | turning)
+    pv, ps = v[points], s[points]
+    same = ps[1:] == ps[:-1]
+    swing = np.abs(np.diff(pv))[same]
+    owner = ps[1:][same]
+    counted = swing > sd[owner]
+    return (np.bincount(owner, weights=swing * counted, minlength=n_seg),
+            np.bincount(owner, weights=counted, minlength=n_seg))
+
+
+def segment_sums_by_id(values: np.ndarray, minutes: np.ndarray, seg: np.ndarray, n_seg: int) -> Dict[str, np.ndarray]:
+    """SUM_FIELDS for every segment; readings of a segment must be contiguous and time-ordered."""
+    def seg_sum(w: np.ndarray) -> np.ndarray:
+        return np.bincount(seg, weights=w, minlength=n_seg)
+
+    n = np.bincount(seg, minlength=n_seg).astype(np.float64)
+    total = seg_sum(values)
+    mean = total / np.maximum(n, 1)
+    sd = np.sqrt(seg_sum((values - mean[seg]) ** 2) / np.maximum(n, 1))
+    rl, rh = risk_scores(values)
+    mage_sum, mage_count = mage_sums(values, seg, n_seg, sd)
+    return {
+        "n": n,
+        "sum": total,
+        "sum_sq": seg_sum(values * values),
+        "very_low": seg_sum(values < VERY_LOW),
+        "low": seg_sum((values >= VERY_LOW) & (values < LOW)),
+        "in_range": seg_sum((values >= LOW) & (values <= HIGH)),
+        "high": seg_sum((values > HIGH) & (values <= VERY_HIGH)),
+        "very_high": seg_sum(values > VERY_HIGH),
+        "lbgi_sum": seg_sum(rl),
+        "hbgi_sum": seg_sum(rh),
+        "hypo_episodes": episode_counts(values, minutes, seg, n_seg, LOW),
+        "severe_hypo_episodes": episode_counts(values, minutes, seg, n_seg, VERY_LOW),
+        "mage_sum": mage_sum,
+        "mage_count": mage_count,
+    }
+
+
+def segment_sums(values: np.ndarray, minutes: np.ndarray, lengths: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-user sums over a flat, per-user time-ordered batch (minutes: reading times in minutes)."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    seg = np.repeat(np.arange(len(lengths)), lengths)
+    return segment_sums_by_id(np.asarray(values, dtype=np.float64), np.asarray(minutes, dtype=np.float64),
+                              seg, len(lengths))
+
+
+def daily_rollups(
+    values: np.ndarray, minutes: np.ndarray, lengths: np.ndarray, tz_offset_minutes: int = 0
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Per-(user, day) sums. Returns (user index, day number since the epoch in
+    local time, sums), one entry per day that has readings.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    user = np.repeat(np.arange(len(lengths)), lengths)
+    day = np.floor((minutes + tz_offset_minutes) / MINUTES_PER_DAY).astype(np.int64)
+    new = np.r_[True, (user[1:] != user[:-1]) | (day[1:] != day[:-1])] if len(values) else np.zeros(0, dtype=bool)
+    seg = np.cumsum(new) - 1
+    firsts = np.flatnonzero(new)
+    return user[firsts], day[firsts], segment_sums_by_id(values, minutes, seg, len(firsts))
+
+
+def combine_rollups(sums: Dict[str, np.ndarray], group: np.ndarray, n_groups: int) -> Dict[str, np.ndarray]:
+    """Add roll-up rows into `n_groups` groups (e.g. per user over a date range)."""
+    group = np.asarray(group, dtype=np.int64)
+    return {k: np.bincount(group, weights=np.asarray(sums[k], dtype=np.float64), minlength=n_groups)
+            for k in SUM_FIELDS}
+
+
+def metrics_from_sums(sums: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Metric arrays from (direct or combined) sums; NaN where a segment has no readings."""
+    n = np.asarray(sums["n"], dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums["sum"] / n
+        sd = np.sqrt(np.maximum(sums["sum_sq"] / n - mean * mean, 0.0))
+        pct = 100.0 / n
+        return {
+            "readings": n.astype(np.int64),
+            "mean": mean,
+            "sd": sd,
+            "cv": 100.0 * sd / mean,
+            "gmi": 3.31 + 0.02392 * mean,
+            "tir_very_low": sums["very_low"] * pct,
+            "tir_low": sums["low"] * pct,
+            "tir": sums["in_range"] * pct,
+            "tar_high": sums["high"] * pct,
+            "tar_very_high": sums["very_high"] * pct,
+            "lbgi": sums["lbgi_sum"] / n,
+            "hbgi": sums["hbgi_sum"] / n,
+            "mage": np.where(sums["mage_count"] > 0, sums["mage_sum"] / np.maximum(sums["mage_count"], 1), 0.0),
+            "hypo_episodes": np.asarray(sums["hypo_episodes"]).astype(np.int64),
+            "severe_hypo_episodes": np.asarray(sums["severe_hypo_episodes"]).astype(np.int64),
+        }
+
+
+def sort_batch(
+    values: np.ndarray, minutes: np.ndarray, lengths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Order each user's readings by time (stable), keeping the user blocks in place."""
+    user = np.repeat(np.arange(len(lengths)), lengths)
+    order = np.lexsort((minutes, user))
+    return np.asarray(values)[order], np.asarray(minutes)[order]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Glycemic metrics for every user in a readings CSV.")
+    parser.add_argument("readings", help="CSV with user,timestamp,value columns (mg/dL)")
+    parser.add_argument("--output", default="glycemic_metrics.csv")
+    parser.add_argument("--daily", default=None, help="also write per-user daily roll-ups to this CSV")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.readings, parse_dates=["timestamp"]).dropna(subset=["value"])
+    df = df.sort_values(["user", "timestamp"], kind="stable")
+    lengths = df.groupby("user", sort=False).size()
+    values = df["value"].to_numpy(dtype=np.float64)
+    minutes = df["timestamp"].to_numpy(dtype="datetime64[ns]").astype(np.int64) / 6e10
+    print(f"  {len(lengths)} user(s), {len(values):,} readings")
+
+    t0 = time.perf_counter()
+    metrics = metrics_from_sums(segment_sums(values, minutes, lengths.to_numpy()))
+    elapsed = time.perf_counter() - t0
+    out = pd.DataFrame({"user": lengths.index, **metrics})
+    out.round(3).to_csv(args.output, index=False)
+    print(f"  Computed in {elapsed * 1000:.1f} ms ({len(values) / max(elapsed, 1e-9):,.0f} readings/s)")
+    print(f"✓ Metrics saved: {args.output}")
+
+    if args.daily:
+        user, day, sums = daily_rollups(values, minutes, lengths.to_numpy())
+        daily = pd.DataFrame({
+            "user": lengths.index.to_numpy()[user],
+            "date": pd.to_datetime(day, unit="D").strftime("%Y-%m-%d"),
+            **sums,
+        })
+        daily.to_csv(args.daily, index=False)
+        print(f"✓ Daily roll-ups saved: {args.daily} ({len(daily)} user-days)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Bluely Kalman Forecaster
+=========================
+A state-space alternative to the straight-line statistical fallback: a
+Kalman filter over glucose level and rate of change that uses the real
+time between readings, so sparse fingerstick histories and CGM streams are
+handled by the same model, and every forecast comes with its uncertainty.
+
+State x = [level (mg/dL), rate (mg/dL per minute)]. Between readings dt
+minutes apart the level moves by the rate, and the rate relaxes toward
+zero with time constant `rate_tau` (glucose trends do not persist
+indefinitely):
+
+    φ = exp(−dt / rate_tau)
+    level' = level + rate · rate_tau · (1 − φ)
+    rate'  = rate · φ
+
+with white-noise acceleration of spectral density `q` as process noise and
+a reading noise of `r` mg/dL (1 sd). Each reading is one predict + update
+step — O(1) per reading, with no history kept — and the forecast at any
+horizon h is the state propagated h minutes past the newest reading, with
+the propagated level variance as its uncertainty.
+
+All functions are vectorized over rows (users), so a request is a batch of
+one and the scanner / backtest run every history at once. Histories come as
+the forecast core's right-aligned NaN-padded matrix plus a matching matrix
+of reading times in minutes; without times, readings are taken to be
+DEFAULT_SPACING_MIN apart (the spacing statistical_30min assumes).
+
+Configuration (env):
+    KALMAN_PROCESS_NOISE=0.005     q, (mg/dL/min)² per minute
+    KALMAN_READING_NOISE=8         r, mg/dL (≈ CGM / meter error)
+    KALMAN_RATE_TAU_MIN=90         rate persistence time constant
+
+Usage:
+    from kalman import KalmanForecaster
+    kf = KalmanForecaster.from_env()
+    state = kf.filter(values, minutes)              # (n, w) history matrices
+    mean, sd = kf.forecast(state, 30)
+
+    state = kf.update(state, new_values, new_minutes)   # streaming, one reading per row
+
+    python kalman.py --tune                          # grid search on the training split
+
+Output:
+    30-minute MAE / ±20 mg/dL hit rate of the Kalman and statistical
+    forecasts on OhioT1DM, and the coverage of the ±1.28 sd interval
+"""
+
+import argparse
+import itertools
+import math
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_PROCESS_NOISE = 0.005
+DEFAULT_READING_NOISE = 8.0
+DEFAULT_RATE_TAU_MIN = 90.0
+DEFAULT_SPACING_MIN = 60.0      # statistical_30min: slope per reading × 0.5 per 30 min
+INITIAL_RATE_SD = 1.0           # mg/dL per minute, before a second reading
+MAX_GAP_MIN = 24 * 60           # longer gaps restart the filter
+
+
+class KalmanState(NamedTuple):
+    """Filter state of each row; `time` is NaN before the first reading."""
+    level: np.ndarray
+    rate: np.ndarray
+    p_ll: np.ndarray            # covariance: level-level, level-rate, rate-rate
+    p_lr: np.ndarray
+    p_rr: np.ndarray
+    time: np.ndarray            # minutes, of the newest reading
+
+    @classmethod
+    def empty(cls, n: int) -> "KalmanState":
+        z = np.zeros(n)
+        return cls(np.full(n, np.nan), z, z.copy(), z.copy(), z.copy(), np.full(n, np.nan))
+
+
+def spacing_minutes(counts: np.ndarray, width: int, spacing: float = DEFAULT_SPACING_MIN) -> np.ndarray:
+    """Reading-time matrix for histories without timestamps: evenly spaced, newest at 0."""
+    minutes = (np.arange(width) - (width - 1)) * spacing
+    out = np.broadcast_to(minutes, (len(counts), width)).copy()
+    out[np.arange(width)[None, :] < (width - np.asarray(counts))[:, None]] = np.nan
+    return out
+
+
+class KalmanForecaster:
+    """Local-trend Kalman filter with a decaying rate (see module docstring)."""
+
+    def __init__(
+        self,
+        process_noise: float = DEFAULT_PROCESS_NOISE,
+        reading_noise: float = DEFAULT_READING_NOISE,
+        rate_tau: float = DEFAULT_RATE_TAU_MIN,
+    ):
+        self.q = process_noise
+        self.r2 = reading_noise ** 2
+        self.rate_tau = rate_tau
+
+    @classmethod
+    def from_env(cls) -> "KalmanForecaster":
+        return cls(
+            process_noise=float(os.environ.get("KALMAN_PROCESS_NOISE", DEFAULT_PROCESS_NOISE)),
+            reading_noise=float(os.environ.get("KALMAN_READING_NOISE", DEFAULT_READING_NOISE)),
+            rate_tau=float(os.environ.get("KALMAN_RATE_TAU_MIN", DEFAULT_RATE_TAU_MIN)),
+        )
+
+    def _propagate(self, level, rate, p_ll, p_lr, p_rr, dt, exp=np.exp):
+        """Prediction step on floats (exp=math.exp) or arrays: state and covariance `dt` minutes later."""
+        phi = exp(-dt / self.rate_tau)
+        gain = self.rate_tau * (1 - phi)            # level change per unit rate
+        # F P Fᵀ with F = [[1, gain], [0, phi]], plus white-noise acceleration
+        return (
+            level + gain * rate,
+            rate * phi,
+            p_ll + 2 * gain * p_lr + gain ** 2 * p_rr + self.q * dt ** 3 / 3,
+            phi * (p_lr + gain * p_rr) + self.q * dt ** 2 / 2,
+            phi ** 2 * p_rr + self.q * dt,
+        )
+
+    def _correct(self, level, rate, p_ll, p_lr, p_rr, value):
+        """Measurement step (H = [1, 0]) on floats or arrays."""
+        s = p_ll + self.r2
+        k_l, k_r = p_ll / s, p_lr / s
+        innovation = value - level
+        return (
+            level + k_l * innovation,
+            rate + k_r * innovation,
+            (1 - k_l) * p_ll,
+            (1 - k_l) * p_lr,
+            p_rr - k_r * p_lr,
+        )
+
+    def propagate(self, state: KalmanState, dt: np.ndarray) -> KalmanState:
+        """State and covariance `dt` minutes later, without a reading."""
+        dt = np.maximum(np.asarray(dt, dtype=np.float64), 0.0)
+        return KalmanState(*self._propagate(*state[:5], dt), state.time + dt)
+
+    def update(self, state: KalmanState, values: np.ndarray, minutes: np.ndarray) -> KalmanState:
+        """
+        Add one reading per row (NaN values leave a row unchanged). Rows
+        without state, or whose newest reading is more than MAX_GAP_MIN old,
+        start over from the reading with an unknown rate.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        minutes = np.asarray(minutes, dtype=np.float64)
+        seen = ~np.isnan(values)
+        fresh = seen & (np.isnan(state.time) | (minutes - state.time > MAX_GAP_MIN))
+        step = seen & ~fresh
+
+        dt = np.maximum(np.where(step, minutes - state.time, 0.0), 0.0)
+        stepped = self._correct(*self._propagate(*state[:5], dt), np.where(step, values, 0.0))
+        start = (values, 0.0, self.r2, 0.0, INITIAL_RATE_SD ** 2)
+        moments = [np.where(fresh, first, np.where(step, after, before))
+                   for first, after, before in zip(start, stepped, state[:5])]
+        time = np.where(seen, np.where(step, np.maximum(minutes, state.time), minutes), state.time)
+        return KalmanState(*moments, time)
+
+    def _filter_row(self, values: np.ndarray, minutes: np.ndarray) -> KalmanState:
+        """filter() for a single history, on Python floats (a request's forecast)."""
+        moments, last = None, float("nan")
+        for value, t in zip(values.tolist(), minutes.tolist()):
+            if value != value:
+                continue
+            if moments is None or t - last > MAX_GAP_MIN:
+                moments = (value, 0.0, self.r2, 0.0, INITIAL_RATE_SD ** 2)
+            else:
+                moments = self._correct(*self._propagate(*moments, max(t - last, 0.0), math.exp), value)
+            last = max(t, last) if last == last else t
+        if moments is None:
+            return KalmanState.empty(1)
+        return KalmanState(*(np.array([float(m)]) for m in moments), np.array([last]))
+
+    def filter(
+        self, values: np.ndarray, minutes: Optional[np.ndarray] = None, counts: Optional[np.ndarray] = None
+    ) -> KalmanState:
+        """Run every row of a right-aligned history matrix (oldest → newest) through the filter."""
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        if minutes is None:
+            if counts is None:
+                counts = (~np.isnan(values)).sum(axis=1)
+            minutes = spacing_minutes(counts, values.shape[1])
+        minutes = np.atleast_2d(np.asarray(minutes, dtype=np.float64))
+        if len(values) == 1:
+            return self._filter_row(values[0], minutes[0])
+        state = KalmanState.empty(len(values))
+        for j in range(values.shape[1]):
+            state = self.update(state, values[:, j], minutes[:, j])
+        return state
+
+    def forecast(self, state: KalmanState, horizon: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(mean, sd) of glucose `horizon` minutes after each row's newest reading."""
+        if len(state.level) == 1:
+            level, _, p_ll, _, _ = self._propagate(*(float(m[0]) for m in state[:5]), float(horizon), math.exp)
+            return np.array([level]), np.array([math.sqrt(p_ll)])
+        ahead = self.propagate(state, np.full(len(state.level), float(horizon)))
+        return ahead.level, np.sqrt(ahead.p_ll)
+
+
+# ── Evaluation ──────────────────────────────────────────────────────────────
+
+def _evaluate(kf: KalmanForecaster, batch) -> Tuple[float, float, float]:
+    """MAE, ±20 mg/dL hit rate and ±1.28 sd (80%) interval coverage of the 30-minute forecast."""
+    mean, sd = kf.forecast(kf.filter(batch["values"], batch["minutes"]), 30)
+    error = np.abs(mean - batch["target"])
+    return float(error.mean()), float((error <= 20).mean()), float((error <= 1.28 * sd).mean())
+
+
+def _load(split: str):
+    from backtest import build_payloads, load_ohio_series
+    batches = [b for b in (build_payloads(s) for s in load_ohio_series(split).values()) if b]
+    return {k: np.concatenate([b[k] for b in batches]) for k in batches[0]}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluate (and tune) the Kalman forecaster on OhioT1DM.")
+    parser.add_argument("--split", default="testing")
+    parser.add_argument("--tune", action="store_true", help="grid-search q, r and rate_tau on the training split")
+    parser.add_argument("--sparse", type=int, default=6, help="also evaluate keeping every k-th reading")
+    args = parser.parse_args(argv)
+
+    import forecast
+
+    print("=" * 60)
+    print("Bluely Kalman Forecaster")
+    print("=" * 60)
+
+    kf = KalmanForecaster.from_env()
+    if args.tune:
+        print("\n[0/2] Tuning on the training split ...")
+        train = _load("training")
+        grid = itertools.product((0.001, 0.002, 0.005, 0.01, 0.02, 0.05), (4.0, 8.0, 12.0), (45.0, 90.0, 180.0))
+        best = min(grid, key=lambda p: _evaluate(KalmanForecaster(*p), train)[0])
+        kf = KalmanForecaster(*best)
+        print(f"  Best: q={best[0]}, r={best[1]}, rate_tau={best[2]}")
+
+    print(f"\n[1/2] Loading OhioT1DM {args.split} split ...")
+    batch = _load(args.split)
+    print(f"  {len(batch['target']):,} samples")
+
+    print("\n[2/2] 30-minute forecasts")
+    sparse = dict(batch)
+    keep = np.zeros(batch["values"].shape[1], dtype=bool)
+    keep[::-args.sparse] = True
+    sparse["values"] = np.where(keep, batch["values"], np.nan)
+    sparse["minutes"] = np.where(keep, batch["minutes"], np.nan)
+    for label, b in (("CGM history", batch), (f"Every {args.sparse}th reading", sparse)):
+        mae, hits, coverage = _evaluate(kf, b)
+        values, counts = forecast.history_matrix([row[~np.isnan(row)] for row in b["values"]])
+        stat = forecast.statistical_30min(values, counts, b["current"])
+        stat_error = np.abs(stat - b["target"])
+        print(f"\n  {label}:")
+        print(f"    Kalman       MAE {mae:6.2f} mg/dL   ±20: {hits * 100:5.1f}%   80% interval coverage {coverage * 100:.1f}%")
+        print(f"    Statistical  MAE {stat_error.mean():6.2f} mg/dL   ±20: {(stat_error <= 20).mean() * 100:5.1f}%")
+    print("\n✓ Done")
+
+
+if __name__ == "__main__":
+    main()
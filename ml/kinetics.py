@@ -0,0 +1,288 @@
+"""
+Bluely Insulin / Carb Kinetics
+===============================
+Insulin-on-board (IOB) and carbs-on-board (COB) from activity curves, as
+an opt-in replacement (KINETICS_ENABLED=1) for the step rules that key a
+fixed effect on hours since a dose or meal and only look at the first
+matching entry.
+
+Every curve is precomputed at import as a lookup table of the fraction
+still to act, one entry per minute since the dose / meal:
+
+    insulin_rapid   exponential insulin model, peak 75 min, duration 6 h
+    insulin_long    flat (peakless basal): 2 h onset, active to 22 h, gone by 24 h
+    insulin_mixed   70/30: 30 % rapid + 70 % NPH (exponential, peak 6 h, duration 16 h)
+    carbs           trapezoid absorption: 15 min ramp-up, steady to 1 h, done by 3 h
+
+(exponential model: Maksimovic / OpenAPS, the curves Loop and oref0 use).
+On-board amounts and the glucose effect over the next `horizon` minutes
+are then a table gather per dose or meal and a sum over all of them:
+
+    IOB = Σ dose · remaining(t_since)
+    insulin effect = ISF · Σ dose · (remaining(t_since) − remaining(t_since + horizon))
+    carb effect    = CSF · Σ carbs · (absorbed(t_since + horizon) − absorbed(t_since))
+
+Inputs are (rows, events) arrays — one row per forecast, NaN hours for
+empty slots — so the server (one row) and backtest (every reading at once)
+share one code path; `event_sums` does the same for sample times against a
+sorted event log (OhioT1DM boluses and meals, see the "kinetics" feature
+family).
+
+`meal_adjustment` / `medication_adjustment` are what the server and
+backtest apply. With the curves enabled that is the summed curves plus the
+step rules for what has no curve (meals without a carb estimate,
+metformin), capped per factor as before; otherwise it is the step rules
+alone, first match only, exactly as before the curves existed.
+Sensitivities are population defaults, and forecast.apply_context still
+caps the total adjustment.
+
+Configuration (env):
+    KINETICS_ENABLED=1        apply the curves to forecasts (default: step rules)
+    KINETICS_ISF=40           mg/dL lowered per unit of insulin
+    KINETICS_CARB_RATIO=12    grams of carbs covered by one unit (CSF = ISF / ratio)
+
+Usage:
+    import kinetics
+    iob = kinetics.insulin_on_board(med_type, hours, dosage)       # (n,) units
+    drop = kinetics.insulin_effect(med_type, hours, dosage)        # (n,) mg/dL over 30 min
+    rise = kinetics.carb_effect(meal_hours, carbs)
+    rise, cob, phase = kinetics.meal_adjustment(meal_hours, carbs)  # as applied to forecasts
+
+    python kinetics.py              # print the curves
+
+Output:
+    Fraction remaining / absorbed at each hour for every curve
+"""
+
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import forecast
+from forecast import MED_LONG, MED_METFORMIN, MED_MIXED, MED_NONE, MED_RAPID, MED_TYPE_CODES
+
+TABLE_MINUTES = 24 * 60                 # longest curve; later lookups read 0 remaining
+HORIZON_MIN = 30
+DEFAULT_ISF = 40.0
+DEFAULT_CARB_RATIO = 12.0
+MAX_MEAL_EFFECT = 20.0                  # per-factor caps of the step rules these replace
+MAX_MEDICATION_EFFECT = 15.0
+
+RAPID_PEAK_MIN, RAPID_DURATION_MIN = 75.0, 360.0
+NPH_PEAK_MIN, NPH_DURATION_MIN = 360.0, 960.0
+MIXED_RAPID_SHARE = 0.3
+LONG_ONSET_MIN, LONG_PLATEAU_END_MIN = 120.0, 1320.0
+CARB_RISE_MIN, CARB_PLATEAU_END_MIN, CARB_DURATION_MIN = 15.0, 60.0, 180.0
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+ENABLED = _env_flag("KINETICS_ENABLED")
+ISF = float(os.environ.get("KINETICS_ISF", DEFAULT_ISF))
+CSF = ISF / float(os.environ.get("KINETICS_CARB_RATIO", DEFAULT_CARB_RATIO))
+
+
+# ── Curves ──────────────────────────────────────────────────────────────────
+
+def exponential_remaining(t: np.ndarray, peak: float, duration: float) -> np.ndarray:
+    """Fraction of an insulin dose still to act `t` minutes after it (exponential model)."""
+    tau = peak * (1 - peak / duration) / (1 - 2 * peak / duration)
+    a = 2 * tau / duration
+    s = 1 / (1 - a + (1 + a) * np.exp(-duration / tau))
+    t = np.clip(t, 0, duration)
+    remaining = 1 - s * (1 - a) * ((t ** 2 / (tau * duration * (1 - a)) - t / tau - 1) * np.exp(-t / tau) + 1)
+    return np.clip(remaining, 0.0, 1.0)
+
+
+def trapezoid_remaining(t: np.ndarray, rise: float, plateau_end: float, end: float) -> np.ndarray:
+    """Fraction still to act when the action rate ramps up over `rise`, holds, and ramps down to `end`."""
+    rate = np.interp(t, [0, rise, plateau_end, end], [0, 1, 1, 0])
+    acted = np.concatenate([[0.0], np.cumsum((rate[1:] + rate[:-1]) / 2 * np.diff(t))])
+    return 1 - acted / acted[-1]
+
+
+def _tables() -> Tuple[np.ndarray, np.ndarray]:
+    t = np.arange(TABLE_MINUTES + 1, dtype=np.float64)
+    rapid = exponential_remaining(t, RAPID_PEAK_MIN, RAPID_DURATION_MIN)
+    nph = exponential_remaining(t, NPH_PEAK_MIN, NPH_DURATION_MIN)
+    # Rows indexed by MED_* code; types without an insulin curve stay 0
+    insulin = np.zeros((max(MED_TYPE_CODES.values()) + 1, len(t)))
+    insulin[MED_RAPID] = rapid
+    insulin[MED_LONG] = trapezoid_remaining(t, LONG_ONSET_MIN, LONG_PLATEAU_END_MIN, TABLE_MINUTES)
+    insulin[MED_MIXED] = MIXED_RAPID_SHARE * rapid + (1 - MIXED_RAPID_SHARE) * nph
+    carbs = trapezoid_remaining(np.minimum(t, CARB_DURATION_MIN), CARB_RISE_MIN, CARB_PLATEAU_END_MIN, CARB_DURATION_MIN)
+    carbs[t > CARB_DURATION_MIN] = 0.0
+    return insulin, carbs
+
+
+INSULIN_REMAINING, CARB_REMAINING = _tables()
+
+
+def _minute(minutes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Table index of each elapsed time (clipped to the table) and whether the event has happened."""
+    valid = minutes >= 0                        # False for NaN too
+    index = np.clip(np.nan_to_num(np.round(minutes), nan=0.0), 0, TABLE_MINUTES).astype(np.int64)
+    return index, valid
+
+
+# ── On-board amounts and effects ────────────────────────────────────────────
+
+def insulin_on_board(med_type: np.ndarray, hours: np.ndarray, dosage: np.ndarray) -> np.ndarray:
+    """Units of insulin still to act, summed over the last axis (one slot per logged dose)."""
+    codes = np.asarray(med_type, dtype=np.int64)
+    index, valid = _minute(np.asarray(hours, dtype=np.float64) * 60)
+    dose = np.nan_to_num(np.asarray(dosage, dtype=np.float64))
+    return np.where(valid, dose * INSULIN_REMAINING[codes, index], 0.0).sum(axis=-1)
+
+
+def insulin_effect(
+    med_type: np.ndarray, hours: np.ndarray, dosage: np.ndarray, horizon: float = HORIZON_MIN, isf: float = ISF
+) -> np.ndarray:
+    """mg/dL lowered over the next `horizon` minutes by every logged dose (positive = lowers)."""
+    codes = np.asarray(med_type, dtype=np.int64)
+    minutes = np.asarray(hours, dtype=np.float64) * 60
+    now, valid = _minute(minutes)
+    later, _ = _minute(minutes + horizon)
+    dose = np.nan_to_num(np.asarray(dosage, dtype=np.float64))
+    acting = INSULIN_REMAINING[codes, now] - INSULIN_REMAINING[codes, later]
+    return isf * np.where(valid, dose * acting, 0.0).sum(axis=-1)
+
+
+def carbs_on_board(hours: np.ndarray, carbs: np.ndarray) -> np.ndarray:
+    """Grams of carbs still to be absorbed, summed over the last axis."""
+    index, valid = _minute(np.asarray(hours, dtype=np.float64) * 60)
+    grams = np.nan_to_num(np.asarray(carbs, dtype=np.float64))
+    return np.where(valid, grams * CARB_REMAINING[index], 0.0).sum(axis=-1)
+
+
+def carb_effect(hours: np.ndarray, carbs: np.ndarray, horizon: float = HORIZON_MIN, csf: float = CSF) -> np.ndarray:
+    """mg/dL rise over the next `horizon` minutes from every logged meal."""
+    minutes = np.asarray(hours, dtype=np.float64) * 60
+    now, valid = _minute(minutes)
+    later, _ = _minute(minutes + horizon)
+    grams = np.nan_to_num(np.asarray(carbs, dtype=np.float64))
+    return csf * np.where(valid, grams * (CARB_REMAINING[now] - CARB_REMAINING[later]), 0.0).sum(axis=-1)
+
+
+def _first(mask: np.ndarray) -> np.ndarray:
+    """Only the first True of `mask` along the last axis."""
+    return mask & (np.cumsum(mask, axis=-1) == 1)
+
+
+def meal_adjustment(
+    hours: np.ndarray, carbs: np.ndarray, curves: Optional[bool] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (rise in mg/dL, carbs on board) of the logged meals, summed over the
+    last axis, plus each meal's forecast.meal_effect phase (MEAL_NONE for
+    meals that do not count). With `curves` (default: KINETICS_ENABLED)
+    every meal's carbs follow the absorption curve and meals without a carb
+    estimate keep the step rule, the largest of those counting once;
+    without, the first meal within 3 h sets the step-rule rise alone.
+    """
+    hours = np.asarray(hours, dtype=np.float64)
+    carbs = np.nan_to_num(np.asarray(carbs, dtype=np.float64))
+    step, phase = forecast.meal_effect(hours, carbs)
+    minutes = hours * 60
+    now, valid = _minute(minutes)
+    grams = np.where(valid, carbs, 0.0)
+    on_board = (grams * CARB_REMAINING[now]).sum(axis=-1)
+    if not (ENABLED if curves is None else curves):
+        first = _first(phase != forecast.MEAL_NONE)
+        return np.where(first, step, 0.0).sum(axis=-1), on_board, np.where(first, phase, forecast.MEAL_NONE)
+
+    step = np.where(carbs > 0, 0.0, step).max(axis=-1, initial=0.0)
+    later, _ = _minute(minutes + HORIZON_MIN)
+    rise = CSF * (grams * (CARB_REMAINING[now] - CARB_REMAINING[later])).sum(axis=-1)
+    return np.minimum(rise + step, MAX_MEAL_EFFECT), on_board, phase
+
+
+def medication_adjustment(
+    med_type: np.ndarray, hours: np.ndarray, dosage: np.ndarray, curves: Optional[bool] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (lowering in mg/dL, insulin on board) of the logged doses, summed over
+    the last axis, plus each dose's forecast.medication_effect phase
+    (MED_PHASE_NONE for doses that are not reported). With `curves`
+    (default: KINETICS_ENABLED) insulin follows its activity curve and
+    metformin keeps its rule; without, the first dose with a step-rule
+    effect sets it alone and later doses are not reported.
+    """
+    codes = np.asarray(med_type, dtype=np.int64)
+    hours = np.asarray(hours, dtype=np.float64)
+    dose = np.nan_to_num(np.asarray(dosage, dtype=np.float64))
+    step, phase = forecast.medication_effect(codes, hours, dose)
+    minutes = hours * 60
+    now, valid = _minute(minutes)
+    units = np.where(valid, dose, 0.0)
+    remaining = INSULIN_REMAINING[codes, now]
+    on_board = (units * remaining).sum(axis=-1)
+    if not (ENABLED if curves is None else curves):
+        first = _first(step > 0)
+        reported = np.cumsum(first, axis=-1) - first == 0
+        return np.where(first, step, 0.0).sum(axis=-1), on_board, np.where(reported, phase, forecast.MED_PHASE_NONE)
+
+    step = np.where(codes == MED_METFORMIN, step, 0.0).max(axis=-1, initial=0.0)
+    later, _ = _minute(minutes + HORIZON_MIN)
+    drop = ISF * (units * (remaining - INSULIN_REMAINING[codes, later])).sum(axis=-1)
+    return np.minimum(drop + step, MAX_MEDICATION_EFFECT), on_board, phase
+
+
+def event_sums(
+    event_minutes: np.ndarray,
+    amounts: np.ndarray,
+    sample_minutes: np.ndarray,
+    table: np.ndarray,
+    horizon: float = HORIZON_MIN,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (on board, acting over the next `horizon` minutes) at every sample time
+    for a sorted event log, summing every event at or before the sample
+    that is still active. Loops over the k-th most recent event (at most the
+    number of events in one curve length), vectorized over samples.
+    """
+    on_board = np.zeros(len(sample_minutes))
+    acting = np.zeros(len(sample_minutes))
+    if not len(event_minutes):
+        return on_board, acting
+    hi = np.searchsorted(event_minutes, sample_minutes, side="right")
+    lo = np.searchsorted(event_minutes, sample_minutes - TABLE_MINUTES, side="left")
+    for k in range(int((hi - lo).max(initial=0))):
+        idx = hi - 1 - k
+        live = idx >= lo
+        safe = np.maximum(idx, 0)
+        now, _ = _minute(sample_minutes - event_minutes[safe])
+        later, _ = _minute(sample_minutes - event_minutes[safe] + horizon)
+        amount = np.where(live, amounts[safe], 0.0)
+        on_board += amount * table[now]
+        acting += amount * (table[now] - table[later])
+    return on_board, acting
+
+
+def curves() -> Dict[str, np.ndarray]:
+    return {
+        "insulin_rapid": INSULIN_REMAINING[MED_RAPID],
+        "insulin_long": INSULIN_REMAINING[MED_LONG],
+        "insulin_mixed": INSULIN_REMAINING[MED_MIXED],
+        "carbs": CARB_REMAINING,
+    }
+
+
+def main():
+    print("=" * 60)
+    print("Bluely Insulin / Carb Kinetics")
+    print("=" * 60)
+    hours = [0, 0.5, 1, 2, 3, 4, 6, 8, 12, 16, 20, 24]
+    print(f"\n  Fraction remaining (ISF {ISF:g} mg/dL/U, CSF {CSF:.2f} mg/dL/g)")
+    print("  " + " " * 14 + "".join(f"{h:>6g}h" for h in hours))
+    for name, table in curves().items():
+        print(f"  {name:<14}" + "".join(f"{table[min(int(h * 60), TABLE_MINUTES)]:>7.2f}" for h in hours))
+    assert MED_NONE == 0 and not INSULIN_REMAINING[MED_NONE].any()
+    print(f"\n✓ Tables: {len(curves())} curves × {TABLE_MINUTES + 1} minutes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Bluely ML API Load Test
+========================
+Drives a running prediction server with realistic synthetic requests and
+reports throughput, latency percentiles and error rates, so instance sizes
+can be chosen from numbers and regressions show up between releases.
+
+Payloads are generated up front (random-walk glucose histories with
+varying reading counts, inline medication, logged meals and medication
+logs) and sent from a pool of async workers. Each worker keeps exactly one
+request in flight, so `--concurrency` is the number of simultaneous
+requests the server sees.
+
+Usage:
+    uvicorn server:app --port 8000 &
+    python loadtest.py --url http://localhost:8000 --concurrency 16 --duration 30
+    python loadtest.py --mix glucose30=1 --requests 5000 --output report.json
+
+Output:
+    loadtest_report.json — per-endpoint throughput, p50/p95/p99 latency and errors
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+ENDPOINTS = {
+    "glucose30": "/predict-glucose-30",
+    "trend": "/predict-trend",
+    "predict": "/predict",
+}
+DEFAULT_MIX = "glucose30=6,trend=3,predict=1"
+
+READING_TYPES = ["fasting", "before_meal", "after_meal", "random", "bedtime"]
+MEAL_TYPES = ["breakfast", "lunch", "dinner", "snack"]
+MEDICATIONS = [
+    ("insulin_rapid", "NovoRapid", "units", (2, 12)),
+    ("insulin_long", "Lantus", "units", (10, 30)),
+    ("insulin_mixed", "NovoMix 30", "units", (6, 20)),
+    ("metformin", "Metformin", "mg", (500, 1000)),
+]
+TIMINGS = ["just_before", "with_reading", "30min_before", "1hr_before", "2hr_before",
+           "previous_night", "earlier_today"]
+ACTIVITY_LEVELS = [None, "low", "medium", "high"]
+
+
+# ── Payload generation ──────────────────────────────────────────────────────
+
+def _readings(rng: np.random.Generator, n: int) -> List[Dict[str, Any]]:
+    """Random-walk history of `n` readings, oldest → newest, spaced 1–4 hours apart."""
+    value = rng.normal(150, 35)
+    hour = int(rng.integers(0, 24))
+    dow = int(rng.integers(0, 7))
+    readings = []
+    for i in range(n):
+        if i:
+            step = int(rng.integers(1, 5))
+            dow = (dow + (hour + step) // 24) % 7
+            hour = (hour + step) % 24
+            value += rng.normal(0, 18)
+        value = float(np.clip(value, 45, 420))
+        reading: Dict[str, Any] = {
+            "value": round(value, 1),
+            "readingType": str(rng.choice(READING_TYPES)),
+            "hour": hour,
+            "dayOfWeek": dow,
+            "medicationTaken": False,
+        }
+        if reading["readingType"] == "after_meal" and rng.random() < 0.5:
+            reading["mealContext"] = str(rng.choice(MEAL_TYPES))
+        if rng.random() < 0.1:
+            reading["activityContext"] = "walk"
+        if rng.random() < 0.2:
+            med_type, name, unit, (lo, hi) = MEDICATIONS[int(rng.integers(len(MEDICATIONS)))]
+            reading.update(
+                medicationTaken=True,
+                medicationTiming=str(rng.choice(TIMINGS)),
+                medicationName=name,
+                medicationType=med_type,
+                medicationDose=float(rng.integers(lo, hi + 1)),
+                medicationDoseUnit=unit,
+            )
+        readings.append(reading)
+    return readings
+
+
+def glucose30_payload(rng: np.random.Generator) -> Dict[str, Any]:
+    """A Glucose30Input like the backend sends (1–20 readings plus meal/medication logs)."""
+    readings = _readings(rng, int(rng.integers(1, 21)))
+    meals = [
+        {
+            "mealType": str(rng.choice(MEAL_TYPES)),
+            "carbsEstimate": None if rng.random() < 0.2 else float(rng.integers(10, 120)),
+            "hoursSinceMeal": round(float(rng.uniform(0, 4)), 1),
+        }
+        for _ in range(int(rng.choice([0, 0, 1, 1, 2])))
+    ]
+    meds = []
+    for _ in range(int(rng.choice([0, 0, 1, 2]))):
+        med_type, _, unit, (lo, hi) = MEDICATIONS[int(rng.integers(len(MEDICATIONS)))]
+        meds.append({
+            "medicationType": med_type,
+            "dosage": float(rng.integers(lo, hi + 1)),
+            "doseUnit": unit,
+            "hoursSincesTaken": round(float(rng.uniform(0, 6)), 1),
+        })
+    meals.sort(key=lambda m: m["hoursSinceMeal"])
+    meds.sort(key=lambda m: m["hoursSincesTaken"])
+    return {
+        "readings": readings,
+        "currentGlucose": readings[-1]["value"],
+        "diabetesType": str(rng.choice(["type1", "type2"])),
+        "onMedication": bool(rng.random() < 0.6),
+        "lastMealHoursAgo": meals[0]["hoursSinceMeal"] if meals else None,
+        "activityLevel": rng.choice(ACTIVITY_LEVELS),
+        "recentMedications": meds,
+        "recentMeals": meals,
+    }
+
+
+def trend_payload(rng: np.random.Generator) -> Dict[str, Any]:
+    """A TrendPredictionInput (3–20 readings)."""
+    readings = _readings(rng, int(rng.integers(3, 21)))
+    return {
+        "readings": readings,
+        "currentGlucose": readings[-1]["value"],
+        "diabetesType": str(rng.choice(["type1", "type2"])),
+        "onMedication": bool(rng.random() < 0.6),
+        "lastMealHoursAgo": None if rng.random() < 0.3 else round(float(rng.uniform(0, 8)), 1),
+        "activityLevel": rng.choice(ACTIVITY_LEVELS),
+    }
+
+
+def risk_payload(rng: np.random.Generator) -> Dict[str, Any]:
+    """A PredictionInput with values in the Pima feature ranges."""
+    return {
+        "pregnancies": float(rng.integers(0, 10)),
+        "glucose": round(float(np.clip(rng.normal(120, 30), 50, 300)), 1),
+        "blood_pressure": round(float(np.clip(rng.normal(72, 12), 40, 130)), 1),
+        "skin_thickness": round(float(np.clip(rng.normal(29, 10), 5, 80)), 1),
+        "insulin": round(float(np.clip(rng.normal(100, 60), 0, 600)), 1),
+        "bmi": round(float(np.clip(rng.normal(32, 7), 16, 60)), 1),
+        "diabetes_pedigree": round(float(np.clip(rng.gamma(2, 0.25), 0.05, 2.5)), 3),
+        "age": float(rng.integers(18, 85)),
+    }
+
+
+GENERATORS = {
+    "glucose30": glucose30_payload,
+    "trend": trend_payload,
+    "predict": risk_payload,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'glucose30=6,trend=3' → normalised weights."""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    return {k: v / total for k, v in mix.items() if v > 0}
+
+
+def build_requests(mix: Dict[str, float], n: int, seed: int = 42) -> List[Tuple[str, bytes]]:
+    """Pre-serialised (endpoint, body) pairs drawn according to `mix`."""
+    rng = np.random.default_rng(seed)
+    names = list(mix)
+    picks = rng.choice(len(names), size=n, p=[mix[k] for k in names])
+    return [(names[i], json.dumps(GENERATORS[names[i]](rng)).encode("utf-8")) for i in picks]
+
+
+# ── Driver ──────────────────────────────────────────────────────────────────
+
+async def _worker(
+    client: httpx.AsyncClient,
+    requests: List[Tuple[str, bytes]],
+    cursor: List[int],
+    deadline: float,
+    limit: Optional[int],
+    results: List[Tuple[str, float, Optional[str], float]],
+):
+    headers = {"Content-Type": "application/json"}
+    while time.perf_counter() < deadline:
+        i = cursor[0]
+        if limit is not None and i >= limit:
+            return
+        cursor[0] += 1
+        name, body = requests[i % len(requests)]
+        t0 = time.perf_counter()
+        error = None
+        try:
+            resp = await client.post(ENDPOINTS[name], content=body, headers=headers)
+            if resp.status_code >= 400:
+                error = f"HTTP {resp.status_code}"
+        except httpx.HTTPError as exc:
+            error = type(exc).__name__
+        t1 = time.perf_counter()
+        results.append((name, (t1 - t0) * 1000, error, t1))
+
+
+async def run_load(
+    url: str,
+    requests: List[Tuple[str, bytes]],
+    concurrency: int,
+    duration: Optional[float] = None,
+    limit: Optional[int] = None,
+    warmup: float = 0.0,
+    timeout: float = 10.0,
+) -> Tuple[List[Tuple[str, float, Optional[str], float]], float]:
+    """
+    Keep `concurrency` requests in flight until `duration` seconds pass or
+    `limit` requests were sent. Requests finishing in the first `warmup`
+    seconds are discarded. Returns (results, measured wall time).
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        results: List[Tuple[str, float, Optional[str], float]] = []
+        cursor = [0]
+        start = time.perf_counter()
+        deadline = start + warmup + duration if duration is not None else float("inf")
+        await asyncio.gather(*(
+            _worker(client, requests, cursor, deadline, limit, results) for _ in range(concurrency)
+        ))
+        end = time.perf_counter()
+    measured_from = start + warmup
+    return [r for r in results if r[3] >= measured_from], end - measured_from
+
+
+def _latency_stats(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    arr = np.asarray(latencies)
+    return {
+        "mean": float(arr.mean()),
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "p99": float(np.percentile(arr, 99)),
+        "max": float(arr.max()),
+    }
+
+
+def summarize(results: List[Tuple[str, float, Optional[str], float]], elapsed: float) -> Dict[str, Any]:
+    """Overall and per-endpoint throughput, latency (ms) and error breakdown."""
+    def block(rows):
+        errors = Counter(r[2] for r in rows if r[2])
+        ok = [r[1] for r in rows if not r[2]]
+        return {
+            "requests": len(rows),
+            "errors": sum(errors.values()),
+            "error_rate": sum(errors.values()) / len(rows) if rows else 0.0,
+            "throughput_rps": len(rows) / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": _latency_stats(ok),
+            "error_kinds": dict(errors),
+        }
+
+    return {
+        "elapsed_seconds": elapsed,
+        "overall": block(results),
+        "endpoints": {
+            name: block([r for r in results if r[0] == name])
+            for name in ENDPOINTS if any(r[0] == name for r in results)
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load-test the Bluely ML API.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run (after warm-up)")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests instead")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds excluded from the report")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. glucose30=6,trend=3,predict=1")
+    parser.add_argument("--payloads", type=int, default=2000, help="distinct payloads to cycle through")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "loadtest_report.json"))
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    duration = None if args.requests else args.duration
+    warmup = 0.0 if args.requests else args.warmup
+
+    print("=" * 60)
+    print("Bluely ML API Load Test")
+    print("=" * 60)
+    print(f"\n[1/3] Generating {args.payloads} payloads ({', '.join(f'{k} {v:.0%}' for k, v in mix.items())}) ...")
+    requests = build_requests(mix, args.payloads, seed=args.seed)
+
+    target = f"{args.requests} requests" if args.requests else f"{args.duration:.0f}s (+{warmup:.0f}s warm-up)"
+    print(f"\n[2/3] Driving {args.url} at concurrency {args.concurrency} for {target} ...")
+    results, elapsed = asyncio.run(run_load(
+        args.url, requests, args.concurrency, duration=duration, limit=args.requests,
+        warmup=warmup, timeout=args.timeout,
+    ))
+    report = summarize(results, elapsed)
+    report["config"] = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration": duration,
+        "requests": args.requests,
+        "warmup": warmup,
+        "mix": mix,
+        "payloads": args.payloads,
+        "seed": args.seed,
+    }
+
+    print("\n[3/3] Results")
+    print(f"  {'endpoint':<10} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, m in [("overall", report["overall"])] + list(report["endpoints"].items()):
+        lat = m["latency_ms"] or {"p50": float("nan"), "p95": float("nan"), "p99": float("nan")}
+        print(f"  {name:<10} {m['requests']:>7} {m['throughput_rps']:>8.1f} {lat['p50']:>8.2f} "
+              f"{lat['p95']:>8.2f} {lat['p99']:>8.2f} {m['error_rate']:>6.1%}")
+    if report["overall"]["error_kinds"]:
+        print(f"  Errors: {report['overall']['error_kinds']}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Report saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,562 @@
+"""
+Bluely Model Bundle Format
+===========================
+Single-file, versioned container for trained models. A bundle holds every
+component a prediction path needs — tree ensembles, linear models and the
+feature scaler — together with the feature spec, training metadata and a
+SHA-256 checksum, so a scaler can never be deployed against the wrong model.
+
+Layout (little-endian):
+
+    8 bytes   magic  b"BLUELYMB"
+    4 bytes   uint32 format version
+    4 bytes   uint32 header length N
+    N bytes   JSON header: components, array table, feature spec, metadata,
+              checksum
+    ...       zero padding to a 64-byte boundary
+    ...       raw array data, each array 64-byte aligned
+
+Arrays are plain C-ordered buffers, so `load_bundle` memory-maps the file
+and wraps them with `np.frombuffer` — no unpickling and no copies. Trees are
+stored flattened (all trees' nodes concatenated, leaves pointing at
+themselves) and evaluated level by level with NumPy, which gives the same
+predictions as scikit-learn without needing the original estimator objects.
+
+Usage:
+    from model_bundle import write_bundle, load_bundle
+
+    write_bundle("models/ohio_glucose.bundle",
+                 {"gbr": model, "scaler": scaler},
+                 feature_names=[...], metadata={...})
+
+    bundle = load_bundle("models/ohio_glucose.bundle")
+    y = bundle["gbr"].predict(bundle["scaler"].transform(X))
+
+    # Migrate legacy joblib pickles:
+    python model_bundle.py convert
+    python model_bundle.py info models/ohio_glucose.bundle
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+PIMA_BUNDLE_PATH = os.path.join(MODEL_DIR, "pima_risk.bundle")
+OHIO_BUNDLE_PATH = os.path.join(MODEL_DIR, "ohio_glucose.bundle")
+# Bundles trained with feature families: the server cannot build their inputs
+OHIO_FAMILIES_BUNDLE_PATH = os.path.join(MODEL_DIR, "ohio_glucose.families.bundle")
+
+MAGIC = b"BLUELYMB"
+FORMAT_VERSION = 1
+ALIGN = 64
+_PREFIX = struct.Struct("<8sII")
+
+
+class BundleError(ValueError):
+    """Raised when a bundle file is malformed or fails its checksum."""
+
+
+# ── In-memory predictors ────────────────────────────────────────────────────
+
+class BundledScaler:
+    """StandardScaler equivalent: (X - mean) / scale."""
+
+    kind = "standard_scaler"
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        self.mean_ = arrays["mean"]
+        self.scale_ = arrays["scale"]
+        self.n_features_in_ = len(self.mean_)
+
+    def transform(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class TreeEnsemble:
+    """
+    Flattened tree ensemble. Node arrays are shared by all trees; `roots`
+    holds each tree's first node and `children[i] = (left, right)`. Leaves
+    have threshold +inf and point at themselves, so traversal is a fixed
+    `max_depth` loop of gathers with no per-node branching.
+    """
+
+    chunk_size = 1024  # rows per traversal pass; keeps index arrays cache-sized
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.value = arrays["value"]
+        self.cover = arrays["cover"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(params["max_depth"])
+        self.n_features_in_ = int(params["n_features"])
+        self._children_flat = self.children.reshape(-1)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def left(self) -> np.ndarray:
+        return self.children[:, 0]
+
+    @property
+    def right(self) -> np.ndarray:
+        return self.children[:, 1]
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf node index reached in every tree, shape (n_samples, n_trees)."""
+        # Trees compare float32 features against float64 thresholds, exactly
+        # as scikit-learn does, so predictions match per tree.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n, n_features = X.shape
+        out = np.empty((n, self.n_trees), dtype=np.int32)
+        for start in range(0, n, self.chunk_size):
+            block = X[start:start + self.chunk_size]
+            m = len(block)
+            flat = block.reshape(-1)
+            row_base = np.repeat(np.arange(m, dtype=np.int32) * n_features, self.n_trees)
+            node = np.tile(self.roots, m)
+            for _ in range(self.max_depth):
+                go_right = flat.take(row_base + self.feature.take(node)) > self.threshold.take(node)
+                node = self._children_flat.take(2 * node + go_right)
+            out[start:start + m] = node.reshape(m, self.n_trees)
+        return out
+
+
+class BundledGBR(TreeEnsemble):
+    """GradientBoostingRegressor (squared error) equivalent."""
+
+    kind = "gbr_regressor"
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        super().__init__(arrays, params)
+        self.init_value = float(params["init"])
+        self.learning_rate = float(params["learning_rate"])
+        self.n_estimators_ = self.n_trees
+
+    def predict(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        return self.init_value + self.learning_rate * self.value[leaves, 0].sum(axis=1)
+
+
+class BundledForest(TreeEnsemble):
+    """RandomForestClassifier equivalent (leaf values are class probabilities)."""
+
+    kind = "rf_classifier"
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        super().__init__(arrays, params)
+        self.classes_ = np.asarray(params["classes"])
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class BundledLogistic:
+    """Binary LogisticRegression equivalent."""
+
+    kind = "logistic_classifier"
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        self.coef_ = arrays["coef"]
+        self.intercept_ = arrays["intercept"]
+        self.classes_ = np.asarray(params["classes"])
+        self.n_features_in_ = self.coef_.shape[1]
+
+    def decision_function(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) @ self.coef_[0] + self.intercept_[0]
+
+    def predict_proba(self, X) -> np.ndarray:
+        p1 = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+COMPONENT_TYPES = {cls.kind: cls for cls in (BundledScaler, BundledGBR, BundledForest, BundledLogistic)}
+
+
+# ── scikit-learn → arrays ───────────────────────────────────────────────────
+
+def _flatten_trees(trees: List[Any], normalize: bool) -> Tuple[Dict[str, np.ndarray], int]:
+    """Concatenate sklearn `Tree` objects into shared node arrays."""
+    feature, threshold, children, value, cover, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in trees:
+        n = tree.node_count
+        idx = np.arange(n)
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        children.append(np.column_stack([
+            np.where(is_leaf, idx, tree.children_left),
+            np.where(is_leaf, idx, tree.children_right),
+        ]).astype(np.int32) + offset)
+        v = tree.value[:, 0, :].astype(np.float64)
+        if normalize:
+            v = v / np.maximum(v.sum(axis=1, keepdims=True), 1e-12)
+        value.append(v)
+        cover.append(tree.weighted_n_node_samples.astype(np.float64))
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    arrays = {
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "children": np.concatenate(children),
+        "value": np.concatenate(value),
+        "cover": np.concatenate(cover),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    return arrays, max_depth
+
+
+def component_from_sklearn(estimator: Any) -> Tuple[str, Dict[str, Any], Dict[str, np.ndarray]]:
+    """Convert a fitted scikit-learn estimator into (kind, params, arrays)."""
+    name = type(estimator).__name__
+
+    if name == "StandardScaler":
+        return "standard_scaler", {}, {
+            "mean": np.asarray(estimator.mean_, dtype=np.float64),
+            "scale": np.asarray(estimator.scale_, dtype=np.float64),
+        }
+
+    if name == "GradientBoostingRegressor":
+        if estimator.loss != "squared_error":
+            raise BundleError(f"Unsupported GBR loss '{estimator.loss}'")
+        trees = [est.tree_ for est in estimator.estimators_[:, 0]]
+        arrays, depth = _flatten_trees(trees, normalize=False)
+        init = 0.0 if estimator.init_ == "zero" else float(np.ravel(estimator.init_.constant_)[0])
+        return "gbr_regressor", {
+            "init": init,
+            "learning_rate": float(estimator.learning_rate),
+            "max_depth": depth,
+            "n_features": int(estimator.n_features_in_),
+        }, arrays
+
+    if name == "RandomForestClassifier":
+        arrays, depth = _flatten_trees([est.tree_ for est in estimator.estimators_], normalize=True)
+        return "rf_classifier", {
+            "classes": np.asarray(estimator.classes_).tolist(),
+            "max_depth": depth,
+            "n_features": int(estimator.n_features_in_),
+        }, arrays
+
+    if name == "LogisticRegression":
+        if len(estimator.classes_) != 2:
+            raise BundleError("Only binary LogisticRegression is supported")
+        return "logistic_classifier", {"classes": np.asarray(estimator.classes_).tolist()}, {
+            "coef": np.asarray(estimator.coef_, dtype=np.float64),
+            "intercept": np.asarray(estimator.intercept_, dtype=np.float64),
+        }
+
+    raise BundleError(f"Cannot bundle estimator of type {name}")
+
+
+def append_gbr_stages(
+    base: Tuple[str, Dict[str, Any], Dict[str, np.ndarray]],
+    extra: Tuple[str, Dict[str, Any], Dict[str, np.ndarray]],
+) -> Tuple[str, Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    Append the trees of `extra` to `base` (both gbr_regressor components)
+    so the merged ensemble predicts base(X) + extra(X). Leaf values of the
+    appended trees are rescaled to the base learning rate.
+    """
+    kind, params, arrays = base
+    extra_kind, extra_params, extra_arrays = extra
+    if kind != "gbr_regressor" or extra_kind != "gbr_regressor":
+        raise BundleError("Only gbr_regressor components can be appended")
+    if int(params["n_features"]) != int(extra_params["n_features"]):
+        raise BundleError("Appended trees use a different number of features")
+
+    offset = len(arrays["feature"])
+    scale = float(extra_params["learning_rate"]) / float(params["learning_rate"])
+    merged = {
+        "feature": np.concatenate([arrays["feature"], extra_arrays["feature"]]),
+        "threshold": np.concatenate([arrays["threshold"], extra_arrays["threshold"]]),
+        "children": np.concatenate([arrays["children"], extra_arrays["children"] + offset]).astype(np.int32),
+        "value": np.concatenate([arrays["value"], extra_arrays["value"] * scale]),
+        "cover": np.concatenate([arrays["cover"], extra_arrays["cover"]]),
+        "roots": np.concatenate([arrays["roots"], extra_arrays["roots"] + offset]).astype(np.int32),
+    }
+    return kind, dict(
+        params,
+        init=float(params["init"]) + float(extra_params["init"]),
+        max_depth=max(int(params["max_depth"]), int(extra_params["max_depth"])),
+    ), merged
+
+
+# ── Reading / writing ───────────────────────────────────────────────────────
+
+def _pad(n: int) -> int:
+    return (-n) % ALIGN
+
+
+def _json_default(obj: Any) -> Any:
+    """Serialise NumPy scalars/arrays that end up in params or metadata."""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+def write_bundle(
+    path: str,
+    components: Dict[str, Any],
+    feature_names: List[str],
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Write a bundle file atomically.
+
+    `components` maps a name to either a fitted scikit-learn estimator or a
+    ready (kind, params, arrays) tuple. Returns the written header.
+    """
+    header: Dict[str, Any] = {
+        "format_version": FORMAT_VERSION,
+        "feature_names": list(feature_names),
+        "metadata": dict(metadata or {}),
+        "components": {},
+    }
+    header["metadata"].setdefault("created_at", datetime.now(timezone.utc).isoformat())
+
+    blobs: List[bytes] = []
+    offset = 0
+    digest = hashlib.sha256()
+    for cname, comp in components.items():
+        kind, params, arrays = comp if isinstance(comp, tuple) else component_from_sklearn(comp)
+        table = {}
+        for aname, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            if arr.dtype.byteorder == ">":
+                arr = arr.astype(arr.dtype.newbyteorder("<"))
+            raw = arr.tobytes()
+            table[aname] = {
+                "dtype": arr.dtype.str,
+                "shape": list(arr.shape),
+                "offset": offset,
+                "nbytes": len(raw),
+            }
+            padded = raw + b"\0" * _pad(len(raw))
+            blobs.append(padded)
+            digest.update(padded)
+            offset += len(padded)
+        header["components"][cname] = {"kind": kind, "params": params, "arrays": table}
+
+    header["checksum"] = "sha256:" + digest.hexdigest()
+    header["metadata"].setdefault("version", f"{header['metadata']['created_at'][:10]}-{digest.hexdigest()[:8]}")
+
+    header_bytes = json.dumps(header, sort_keys=True, default=_json_default).encode("utf-8")
+    prefix = _PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes))
+    head = prefix + header_bytes
+    head += b"\0" * _pad(len(head))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(head)
+            for blob in blobs:
+                f.write(blob)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return header
+
+
+class ModelBundle:
+    """A loaded bundle. Index by component name to get a predictor."""
+
+    def __init__(
+        self,
+        path: str,
+        header: Dict[str, Any],
+        components: Dict[str, Any],
+        buffer: Any,
+        arrays: Optional[Dict[str, Dict[str, np.ndarray]]] = None,
+    ):
+        self.path = path
+        self.header = header
+        self.components = components
+        self._buffer = buffer  # keeps the mmap alive for zero-copy arrays
+        self._arrays = arrays or {}
+
+    def __getitem__(self, name: str) -> Any:
+        return self.components[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.components
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.header["feature_names"]
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.header["metadata"]
+
+    @property
+    def version(self) -> str:
+        return self.metadata.get("version", "unknown")
+
+    @property
+    def checksum(self) -> str:
+        return self.header["checksum"]
+
+    def component(self, name: str) -> Tuple[str, Dict[str, Any], Dict[str, np.ndarray]]:
+        """A component as the (kind, params, arrays) tuple write_bundle accepts."""
+        comp = self.header["components"][name]
+        return comp["kind"], dict(comp["params"]), self._arrays[name]
+
+
+def read_header(buf: Any) -> Tuple[Dict[str, Any], int]:
+    """Parse the prefix and JSON header; return (header, data_start)."""
+    if len(buf) < _PREFIX.size:
+        raise BundleError("File too small to be a model bundle")
+    magic, version, header_len = _PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise BundleError("Not a Bluely model bundle (bad magic)")
+    if version > FORMAT_VERSION:
+        raise BundleError(f"Bundle format v{version} is newer than supported v{FORMAT_VERSION}")
+    end = _PREFIX.size + header_len
+    header = json.loads(bytes(buf[_PREFIX.size:end]).decode("utf-8"))
+    return header, end + _pad(end)
+
+
+def load_bundle(path: str, mmap_mode: bool = True, verify: bool = True) -> ModelBundle:
+    """
+    Load a bundle. With `mmap_mode` the file is memory-mapped and arrays are
+    read-only views into it; otherwise it is read into memory once.
+    """
+    with open(path, "rb") as f:
+        if mmap_mode:
+            buf: Any = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+
+    header, data_start = read_header(buf)
+
+    if verify:
+        # Hash the data section through a memoryview so nothing is copied.
+        digest = hashlib.sha256(memoryview(buf)[data_start:]).hexdigest()
+        if "sha256:" + digest != header.get("checksum"):
+            raise BundleError(f"Checksum mismatch for {path}")
+
+    components = {}
+    raw: Dict[str, Dict[str, np.ndarray]] = {}
+    for cname, comp in header["components"].items():
+        cls = COMPONENT_TYPES.get(comp["kind"])
+        if cls is None:
+            raise BundleError(f"Unknown component kind '{comp['kind']}'")
+        arrays = {}
+        for aname, spec in comp["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+            arr = np.frombuffer(buf, dtype=dtype, count=count, offset=data_start + spec["offset"])
+            arrays[aname] = arr.reshape(spec["shape"])
+        components[cname] = cls(arrays, comp["params"])
+        raw[cname] = arrays
+
+    return ModelBundle(path, header, components, buf, raw)
+
+
+# ── CLI ─────────────────────────────────────────────────────────────────────
+
+def _sklearn_version() -> str:
+    try:
+        import sklearn
+        return sklearn.__version__
+    except ImportError:
+        return "unknown"
+
+
+def convert_legacy(model_dir: str = MODEL_DIR) -> None:
+    """Convert the legacy joblib pickles in `model_dir` into bundles."""
+    import joblib
+    from parse_ohio import temporal_feature_names
+    from predict import PIMA_FEATURE_NAMES
+
+    def _check(name, bundle, reference, X):
+        diff = float(np.max(np.abs(bundle - reference)))
+        print(f"  {name}: max |bundle - sklearn| = {diff:.2e}")
+        if diff > 1e-6:
+            raise BundleError(f"{name} bundle does not reproduce the sklearn model")
+
+    rng = np.random.default_rng(0)
+
+    rf_path = os.path.join(model_dir, "glucose_model.joblib")
+    if os.path.exists(rf_path):
+        rf = joblib.load(rf_path)
+        scaler = joblib.load(os.path.join(model_dir, "scaler.joblib"))
+        components = {"rf": rf, "scaler": scaler}
+        lr_path = os.path.join(model_dir, "logistic_model.joblib")
+        if os.path.exists(lr_path):
+            components["logistic"] = joblib.load(lr_path)
+        out = os.path.join(model_dir, os.path.basename(PIMA_BUNDLE_PATH))
+        write_bundle(out, components, PIMA_FEATURE_NAMES, {
+            "model": "pima_risk", "source": "converted from joblib", "sklearn_version": _sklearn_version(),
+        })
+        bundle = load_bundle(out)
+        X = rng.normal(size=(500, len(PIMA_FEATURE_NAMES)))
+        _check("rf", bundle["rf"].predict_proba(X), rf.predict_proba(X), X)
+        if "logistic" in components:
+            _check("logistic", bundle["logistic"].predict_proba(X), components["logistic"].predict_proba(X), X)
+        print(f"✓ {out}")
+
+    gbr_path = os.path.join(model_dir, "ohio_glucose_predictor.joblib")
+    if os.path.exists(gbr_path):
+        gbr = joblib.load(gbr_path)
+        scaler = joblib.load(os.path.join(model_dir, "ohio_scaler.joblib"))
+        out = os.path.join(model_dir, os.path.basename(OHIO_BUNDLE_PATH))
+        write_bundle(out, {"gbr": gbr, "scaler": scaler}, temporal_feature_names(12), {
+            "model": "ohio_glucose", "source": "converted from joblib", "sklearn_version": _sklearn_version(),
+            "feature_params": {"prediction_horizon": 6, "lookback": 12},
+        })
+        bundle = load_bundle(out)
+        X = rng.normal(size=(500, gbr.n_features_in_)) * 2
+        _check("gbr", bundle["gbr"].predict(X), gbr.predict(X), X)
+        print(f"✓ {out}")
+
+
+def print_info(path: str) -> None:
+    bundle = load_bundle(path)
+    print(f"{path}")
+    print(f"  version:  {bundle.version}")
+    print(f"  checksum: {bundle.checksum}")
+    print(f"  features: {len(bundle.feature_names)}")
+    for name, comp in bundle.header["components"].items():
+        n_bytes = sum(a["nbytes"] for a in comp["arrays"].values())
+        print(f"  [{name}] {comp['kind']} — {n_bytes / 1024:.1f} KiB")
+    for key, value in bundle.metadata.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    if command == "convert":
+        convert_legacy(sys.argv[2] if len(sys.argv) > 2 else MODEL_DIR)
+    elif command == "info":
+        for p in sys.argv[2:] or [PIMA_BUNDLE_PATH, OHIO_BUNDLE_PATH]:
+            print_info(p)
+    else:
+        print("Usage: python model_bundle.py [convert [MODEL_DIR] | info [BUNDLE ...]]")
+        sys.exit(1)
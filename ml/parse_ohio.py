@@ -13,16 +13,25 @@ Each XML file contains data for one T1D patient with sections:
   basis_heart_rate, basis_gsr, basis_skin_temperature,
   basis_air_temperature, basis_steps, basis_sleep
 
+Only the sections asked for are built and converted to DataFrames
+(`sections=`): the file is still read through, but elements of the other
+sections are never created. `required_sections(families)` lists what
+build_temporal_features needs for the base features plus any optional
+feature families (feature_families.py).
+
 Usage:
     from parse_ohio import load_patient, load_all_patients
+    data = load_patient_xml(path, sections=required_sections(["iob"]))
 """
 
 import os
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, Iterable, List, Tuple, Optional
 import pandas as pd
 import numpy as np
 
+from feature_families import family_feature_names, family_features, family_sections
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "ohiot1dm")
 
 PATIENT_IDS = [559, 563, 570, 575, 588, 591]
@@ -151,30 +160,141 @@ def _parse_sleep_events(patient_el: ET.Element) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
-def load_patient_xml(filepath: str) -> Dict[str, pd.DataFrame]:
+def _parse_interval_events(
+    patient_el: ET.Element, section: str, value_attr: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Parse events spanning ts_begin..ts_end (or a single ts) into
+    timestamp, end, value. Events without `value_attr` get value 1.0.
+    """
+    section_el = patient_el.find(section)
+    if section_el is None:
+        return pd.DataFrame(columns=["timestamp", "end", "value"])
+
+    rows = []
+    for ev in section_el.findall("event"):
+        ts_begin = ev.get("ts_begin") or ev.get("ts")
+        ts_end = ev.get("ts_end") or ts_begin
+        val = ev.get(value_attr) if value_attr else None
+        if ts_begin:
+            try:
+                rows.append(
+                    {
+                        "timestamp": pd.to_datetime(ts_begin, format=TS_FORMAT),
+                        "end": pd.to_datetime(ts_end, format=TS_FORMAT),
+                        "value": float(val) if val else 1.0,
+                    }
+                )
+            except (ValueError, TypeError):
+                continue
+    return pd.DataFrame(rows, columns=["timestamp", "end", "value"])
+
+
+# Parsed section key -> parser over the <patient> element
+SECTION_PARSERS: Dict[str, Callable[[ET.Element], pd.DataFrame]] = {
+    "glucose": lambda root: _parse_events(root, "glucose_level"),
+    "finger_stick": lambda root: _parse_events(root, "finger_stick"),
+    "basal": lambda root: _parse_events(root, "basal"),
+    "temp_basal": lambda root: _parse_interval_events(root, "temp_basal", "value"),
+    "bolus": _parse_bolus_events,
+    "meal": _parse_meal_events,
+    "exercise": _parse_exercise_events,
+    "sleep": _parse_sleep_events,
+    "work": lambda root: _parse_interval_events(root, "work", "intensity"),
+    "stressors": lambda root: _parse_interval_events(root, "stressors"),
+    "illness": lambda root: _parse_interval_events(root, "illness"),
+    "heart_rate": lambda root: _parse_events(root, "basis_heart_rate"),
+    "gsr": lambda root: _parse_events(root, "basis_gsr"),
+    "steps": lambda root: _parse_events(root, "basis_steps"),
+    "skin_temp": lambda root: _parse_events(root, "basis_skin_temperature"),
+    "basis_sleep": lambda root: _parse_interval_events(root, "basis_sleep", "quality"),
+}
+
+# Parsed section key -> XML element under <patient>
+SECTION_TAGS: Dict[str, str] = {
+    "glucose": "glucose_level", "finger_stick": "finger_stick", "basal": "basal",
+    "temp_basal": "temp_basal", "bolus": "bolus", "meal": "meal", "exercise": "exercise",
+    "sleep": "sleep", "work": "work", "stressors": "stressors", "illness": "illness",
+    "heart_rate": "basis_heart_rate", "gsr": "basis_gsr", "steps": "basis_steps",
+    "skin_temp": "basis_skin_temperature", "basis_sleep": "basis_sleep",
+}
+
+
+class _SectionTreeBuilder:
+    """
+    XMLParser target that builds <patient> and only the listed top-level
+    sections; everything inside other sections is dropped as it is read.
+    """
+
+    def __init__(self, tags: Iterable[str]):
+        self.tags = set(tags)
+        self.builder = ET.TreeBuilder()
+        self.depth = 0
+        self.skip_depth = 0     # depth of the section being skipped (0: none)
+
+    def start(self, tag: str, attrib: Dict[str, str]) -> None:
+        self.depth += 1
+        if not self.skip_depth and self.depth == 2 and tag not in self.tags:
+            self.skip_depth = self.depth
+        if not self.skip_depth:
+            self.builder.start(tag, attrib)
+
+    def end(self, tag: str) -> None:
+        if not self.skip_depth:
+            self.builder.end(tag)
+        elif self.depth == self.skip_depth:
+            self.skip_depth = 0
+        self.depth -= 1
+
+    def data(self, data: str) -> None:
+        if not self.skip_depth:
+            self.builder.data(data)
+
+    def close(self) -> ET.Element:
+        return self.builder.close()
+
+
+# What load_patient_xml returns when no sections are given
+DEFAULT_SECTIONS = (
+    "glucose", "finger_stick", "basal", "bolus", "meal",
+    "exercise", "sleep", "heart_rate", "steps", "skin_temp",
+)
+
+# Read by the base features of build_temporal_features
+TEMPORAL_SECTIONS = ("glucose", "meal", "bolus", "exercise", "sleep", "heart_rate", "steps")
+
+
+def required_sections(families: Optional[Iterable[str]] = None) -> List[str]:
+    """Sections to parse for the base temporal features plus the given feature families."""
+    return list(dict.fromkeys(list(TEMPORAL_SECTIONS) + family_sections(families)))
+
+
+def load_patient_xml(
+    filepath: str, sections: Optional[Iterable[str]] = None
+) -> Dict[str, pd.DataFrame]:
     """
     Parse a single OhioT1DM XML file into a dict of DataFrames.
 
+    Only `sections` (keys of SECTION_PARSERS) are built as elements and
+    converted; the other sections are read past without building them.
+
     Returns:
-        Dict with keys: 'glucose', 'finger_stick', 'basal', 'bolus',
-                         'meal', 'exercise', 'sleep', 'heart_rate',
-                         'steps', 'skin_temp'
+        Dict with one DataFrame per requested section, by default:
+        'glucose', 'finger_stick', 'basal', 'bolus', 'meal', 'exercise',
+        'sleep', 'heart_rate', 'steps', 'skin_temp'
     """
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-
-    data = {
-        "glucose": _parse_events(root, "glucose_level"),
-        "finger_stick": _parse_events(root, "finger_stick"),
-        "basal": _parse_events(root, "basal"),
-        "bolus": _parse_bolus_events(root),
-        "meal": _parse_meal_events(root),
-        "exercise": _parse_exercise_events(root),
-        "sleep": _parse_sleep_events(root),
-        "heart_rate": _parse_events(root, "basis_heart_rate"),
-        "steps": _parse_events(root, "basis_steps"),
-        "skin_temp": _parse_events(root, "basis_skin_temperature"),
-    }
+    sections = DEFAULT_SECTIONS if sections is None else tuple(sections)
+    unknown = [s for s in sections if s not in SECTION_PARSERS]
+    if unknown:
+        raise ValueError(f"Unknown section(s) {unknown} (known: {', '.join(SECTION_PARSERS)})")
+
+    parser = ET.XMLParser(target=_SectionTreeBuilder(SECTION_TAGS[name] for name in sections))
+    with open(filepath, "rb") as f:
+        while chunk := f.read(1 << 20):
+            parser.feed(chunk)
+    root = parser.close()
+
+    data = {name: SECTION_PARSERS[name](root) for name in sections}
 
     # Sort all by timestamp
     for key in data:
@@ -220,6 +340,26 @@ def load_all_patients() -> Dict[int, Tuple[Dict, Dict]]:
     return results
 
 
+def temporal_feature_names(lookback: int = 12, families: Optional[Iterable[str]] = None) -> List[str]:
+    """Column names of the matrix produced by `build_temporal_features`."""
+    return [f"glucose_norm_t-{lookback - i}" for i in range(lookback)] + [
+        "current_glucose",
+        "slope",
+        "std",
+        "hour_sin",
+        "hour_cos",
+        "day_of_week",
+        "mins_since_meal",
+        "last_meal_carbs",
+        "mins_since_bolus",
+        "last_bolus_dose",
+        "recent_exercise",
+        "recent_sleep",
+        "avg_heart_rate",
+        "recent_steps",
+    ] + family_feature_names(families)
+
+
 def build_temporal_features(
     glucose_df: pd.DataFrame,
     meal_df: pd.DataFrame,
@@ -230,6 +370,8 @@ def build_temporal_features(
     steps_df: pd.DataFrame,
     prediction_horizon: int = 6,  # 6 x 5min = 30 minutes ahead
     lookback: int = 12,  # 12 x 5min = 60 minutes history
+    families: Optional[Iterable[str]] = None,
+    context: Optional[Dict[str, pd.DataFrame]] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Build feature matrix from OhioT1DM data for temporal glucose prediction.
@@ -248,6 +390,8 @@ def build_temporal_features(
         - Recent sleep flag (within 30min of sleep event)
         - Average heart rate over lookback (if available)
         - Steps in last hour (if available)
+        - Columns of each optional feature family in `families`, computed
+          from the parsed sections in `context` (see feature_families.py)
 
     Target:
         - Glucose value `prediction_horizon` steps ahead
@@ -374,7 +518,11 @@ def build_temporal_features(
         features_list.append(feature)
         targets.append(target)
 
-    return np.array(features_list), np.array(targets)
+    X = np.array(features_list)
+    if families:
+        sample_times = glucose_times[lookback : lookback + len(X)]
+        X = np.hstack([X, family_features(list(families), sample_times, context or {})])
+    return X, np.array(targets)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+"""
+Content-Hashed Stage Cache
+===========================
+Small helper for running a training pipeline as explicit stages whose
+outputs are stored on disk under a hash of their inputs and parameters.
+
+A stage is identified by its name, a dict of parameters and the keys of
+the upstream stages (or file digests) it consumes. If nothing upstream
+changed, the stored artifact is loaded instead of being recomputed, so
+changing e.g. a model hyperparameter only re-runs the stages downstream
+of it.
+
+Usage:
+    from pipeline import StageCache, file_digest
+
+    cache = StageCache()
+    key = cache.key("features", {"lookback": 12}, [parse_key])
+    X, y = cache.run("features", key, lambda: build(...))
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+import joblib
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content (streamed, so large files are fine)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_key(*parts: Any) -> str:
+    """Stable short hash of JSON-serialisable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class StageCache:
+    """
+    Disk cache of stage outputs keyed by content hash.
+
+    Artifacts are written with joblib (uncompressed) so large arrays can be
+    loaded back memory-mapped instead of copied into RAM.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, enabled: bool = True, mmap: bool = True):
+        self.root = root
+        self.enabled = enabled
+        self.mmap_mode = "r" if mmap else None
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+
+    def key(self, stage: str, params: Optional[Dict[str, Any]] = None, inputs: Optional[List[str]] = None) -> str:
+        """Key for a stage run: hash of stage name, parameters and upstream keys."""
+        return hash_key(stage, params or {}, list(inputs or []))
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, f"{key}.joblib")
+
+    def has(self, stage: str, key: str) -> bool:
+        return self.enabled and os.path.exists(self.path(stage, key))
+
+    def load(self, stage: str, key: str) -> Any:
+        return joblib.load(self.path(stage, key), mmap_mode=self.mmap_mode)
+
+    def save(self, stage: str, key: str, value: Any) -> None:
+        """Write atomically so an interrupted run never leaves a corrupt artifact."""
+        target = self.path(stage, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        os.close(fd)
+        try:
+            joblib.dump(value, tmp)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def run(self, stage: str, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the cached artifact for (stage, key), computing it on a miss."""
+        label = f"{stage}:{key}"
+        if self.has(stage, key):
+            self.hits.append(label)
+            return self.load(stage, key)
+        self.misses.append(label)
+        value = compute()
+        if self.enabled:
+            self.save(stage, key, value)
+        return value
@@ -2,23 +2,173 @@
 Bluely ML Prediction Helper
 ============================
 Utility module for loading the trained model and making predictions.
+
+Inference modes (RISK_INFERENCE_MODE):
+    rf      every request runs the Random Forest (default)
+    tiered  the Logistic Regression answers when its probability is at
+            least RISK_TIER_MARGIN away from 0.5; only the ambiguous rows
+            near the decision boundary are escalated to the Random Forest
+
+Usage:
+    python predict.py                       # quick single prediction
+    python predict.py --compare-tiers       # agreement of tiered vs RF-only
+    python predict.py --compare-tiers --margins 0.2 0.3 0.4
 """
 
 import os
+import time
 import numpy as np
-import joblib
 
-# Paths
-MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
-MODEL_PATH = os.path.join(MODEL_DIR, 'glucose_model.joblib')
-SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.joblib')
+from explain import TreeExplainer, top_contributions
+from model_bundle import load_bundle, PIMA_BUNDLE_PATH
+
+# Column order the Pima models were trained on (data/diabetes.csv)
+PIMA_FEATURE_NAMES = [
+    'Pregnancies',
+    'Glucose',
+    'BloodPressure',
+    'SkinThickness',
+    'Insulin',
+    'BMI',
+    'DiabetesPedigreeFunction',
+    'Age',
+]
+
+# Zeros in these columns are physiologically impossible and mean "missing"
+PIMA_ZERO_AS_MISSING = ['Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI']
+
+INFERENCE_MODES = ('rf', 'tiered')
+INFERENCE_MODE = os.environ.get('RISK_INFERENCE_MODE', 'rf')
+TIER_MARGIN = float(os.environ.get('RISK_TIER_MARGIN', '0.3'))
+# Fail at startup rather than on every request
+if INFERENCE_MODE not in INFERENCE_MODES:
+    raise ValueError(f"RISK_INFERENCE_MODE must be one of {INFERENCE_MODES}, not {INFERENCE_MODE!r}")
+if not 0 <= TIER_MARGIN <= 0.5:
+    raise ValueError(f"RISK_TIER_MARGIN must be between 0 and 0.5, not {TIER_MARGIN}")
+
+_bundle = None
+_explainer = None
+
+
+def clean_pima_frame(df):
+    """train.py's cleaning: zeros in PIMA_ZERO_AS_MISSING → NaN → column median (in place, returned)."""
+    df[PIMA_ZERO_AS_MISSING] = df[PIMA_ZERO_AS_MISSING].replace(0, np.nan)
+    df.fillna(df.median(numeric_only=True), inplace=True)
+    return df
+
+
+def load_bundle_cached():
+    """Load the Pima bundle once per process (memory-mapped)."""
+    global _bundle
+    if _bundle is None:
+        _bundle = load_bundle(PIMA_BUNDLE_PATH)
+    return _bundle
+
+
+def risk_explainer():
+    """TreeSHAP explainer of the Random Forest's high-risk probability (built once)."""
+    global _explainer
+    if _explainer is None:
+        _explainer = TreeExplainer.for_model(load_bundle_cached()['rf'])
+    return _explainer
 
 
 def load_model():
     """Load the trained model and scaler."""
-    model = joblib.load(MODEL_PATH)
-    scaler = joblib.load(SCALER_PATH)
-    return model, scaler
+    bundle = load_bundle_cached()
+    return bundle['rf'], bundle['scaler']
+
+
+RISK_RECOMMENDATIONS = {
+    'normal': (
+        'Current inputs suggest a lower risk profile. '
+        'Consistent habits may help maintain this pattern.'
+    ),
+    'elevated': (
+        'Some factors suggest an elevated risk pattern. '
+        'Consider reviewing this with your healthcare provider.'
+    ),
+    'critical': (
+        'Multiple factors indicate a higher risk profile. '
+        'We recommend discussing these patterns with your healthcare provider.'
+    ),
+}
+
+
+def score_batch(features: np.ndarray, mode: str = None, margin: float = None) -> dict:
+    """
+    Risk predictions for many rows at once.
+
+    Args:
+        features: (n, 8) array in PIMA_FEATURE_NAMES order
+        mode: 'rf' or 'tiered' (default: INFERENCE_MODE)
+        margin: tiered mode only — distance from 0.5 the logistic
+                probability needs to answer on its own (default: TIER_MARGIN)
+
+    Returns:
+        dict of arrays: predicted_risk, risk_level, confidence (unrounded),
+        model ('rf' or 'logistic' per row)
+    """
+    mode = mode or INFERENCE_MODE
+    margin = TIER_MARGIN if margin is None else margin
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}' (expected one of {INFERENCE_MODES})")
+    if not 0 <= margin <= 0.5:
+        raise ValueError(f"Tier margin must be between 0 and 0.5, not {margin}")
+
+    bundle = load_bundle_cached()
+    model = bundle['rf']
+    X = bundle['scaler'].transform(np.asarray(features, dtype=np.float64))
+
+    if mode == 'tiered':
+        probability = bundle['logistic'].predict_proba(X)
+        ambiguous = np.abs(probability[:, 1] - 0.5) < margin
+        if ambiguous.any():
+            probability[ambiguous] = model.predict_proba(X[ambiguous])
+        model_used = np.where(ambiguous, 'rf', 'logistic')
+    else:
+        probability = model.predict_proba(X)
+        model_used = np.full(len(X), 'rf')
+
+    prediction = model.classes_[np.argmax(probability, axis=1)]
+    confidence = probability.max(axis=1)
+
+    risk_level = np.where(
+        prediction == 0, 'normal', np.where(confidence < 0.7, 'elevated', 'critical')
+    )
+    return {
+        'predicted_risk': prediction.astype(int),
+        'risk_level': risk_level,
+        'confidence': confidence,
+        'model': model_used,
+    }
+
+
+def compare_tiers(features: np.ndarray, margins) -> list:
+    """
+    Agreement of tiered inference with RF-only results for each margin:
+    share of rows the logistic model answered, agreement on the predicted
+    class and on the risk level, and per-row scoring time of both modes.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    t0 = time.perf_counter()
+    reference = score_batch(features, mode='rf')
+    rf_seconds = time.perf_counter() - t0
+
+    rows = []
+    for margin in margins:
+        t0 = time.perf_counter()
+        tiered = score_batch(features, mode='tiered', margin=margin)
+        tiered_seconds = time.perf_counter() - t0
+        rows.append({
+            'margin': float(margin),
+            'logistic_share': float(np.mean(tiered['model'] == 'logistic')),
+            'agreement': float(np.mean(tiered['predicted_risk'] == reference['predicted_risk'])),
+            'risk_level_agreement': float(np.mean(tiered['risk_level'] == reference['risk_level'])),
+            'rf_us_per_row': rf_seconds / len(features) * 1e6,
+            'tiered_us_per_row': tiered_seconds / len(features) * 1e6,
+        })
+    return rows
 
 
 def predict_risk(
@@ -30,15 +180,20 @@ def predict_risk(
     bmi: float = 32,
     diabetes_pedigree: float = 0.5,
     age: float = 30,
+    explain: bool = False,
 ) -> dict:
     """
-    Make a diabetes risk prediction.
+    Make a diabetes risk prediction (Random Forest, or tiered when
+    RISK_INFERENCE_MODE=tiered).
+
+    With `explain`, adds per-feature contributions to the Random Forest's
+    high-risk probability (they explain the RF even when the tiered mode
+    answered with the logistic model).
 
     Returns:
         dict with keys: predicted_risk, risk_level, confidence, recommendation
+        (+ explanation: {base, factors})
     """
-    model, scaler = load_model()
-
     features = np.array([[
         pregnancies,
         glucose,
@@ -50,40 +205,46 @@ def predict_risk(
         age,
     ]])
 
-    features_scaled = scaler.transform(features)
-
-    prediction = model.predict(features_scaled)[0]
-    probability = model.predict_proba(features_scaled)[0]
-    confidence = float(max(probability))
-
-    if prediction == 0:
-        risk_level = 'normal'
-        recommendation = (
-            'Current inputs suggest a lower risk profile. '
-            'Consistent habits may help maintain this pattern.'
-        )
-    elif confidence < 0.7:
-        risk_level = 'elevated'
-        recommendation = (
-            'Some factors suggest an elevated risk pattern. '
-            'Consider reviewing this with your healthcare provider.'
-        )
-    else:
-        risk_level = 'critical'
-        recommendation = (
-            'Multiple factors indicate a higher risk profile. '
-            'We recommend discussing these patterns with your healthcare provider.'
-        )
+    result = score_batch(features)
+    risk_level = str(result['risk_level'][0])
 
-    return {
-        'predicted_risk': int(prediction),
+    output = {
+        'predicted_risk': int(result['predicted_risk'][0]),
         'risk_level': risk_level,
-        'confidence': round(confidence, 3),
-        'recommendation': recommendation,
+        'confidence': round(float(result['confidence'][0]), 3),
+        'recommendation': RISK_RECOMMENDATIONS[risk_level],
     }
+    if explain:
+        X = load_bundle_cached()['scaler'].transform(features)
+        base, contributions = risk_explainer().explain(X)
+        output['explanation'] = {
+            'base': round(float(base[0]), 4),
+            'factors': top_contributions(contributions[0], PIMA_FEATURE_NAMES, k=len(PIMA_FEATURE_NAMES)),
+        }
+    return output
 
 
 if __name__ == '__main__':
-    # Quick test
-    result = predict_risk(glucose=148, age=33, bmi=28.5)
-    print(f"Prediction: {result}")
+    import argparse
+
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Quick prediction or tiered-inference comparison.")
+    parser.add_argument('--compare-tiers', action='store_true',
+                        help='compare tiered vs RF-only predictions on a dataset')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(__file__), 'data', 'diabetes.csv'))
+    parser.add_argument('--margins', type=float, nargs='+', default=[0.1, 0.2, 0.3, 0.4])
+    args = parser.parse_args()
+
+    if not args.compare_tiers:
+        # Quick test
+        result = predict_risk(glucose=148, age=33, bmi=28.5)
+        print(f"Prediction: {result}")
+    else:
+        # Cleaned like the training data, so agreement is measured on rows the models know
+        features = clean_pima_frame(pd.read_csv(args.data))[PIMA_FEATURE_NAMES].to_numpy(dtype=np.float64)
+        print(f"Tiered vs RF-only on {len(features)} rows ({args.data})")
+        print(f"  {'margin':>6} {'logistic':>9} {'agree':>7} {'level':>7} {'RF µs/row':>10} {'tiered µs/row':>14}")
+        for row in compare_tiers(features, args.margins):
+            print(f"  {row['margin']:>6.2f} {row['logistic_share']:>8.1%} {row['agreement']:>7.1%} "
+                  f"{row['risk_level_agreement']:>7.1%} {row['rf_us_per_row']:>10.1f} {row['tiered_us_per_row']:>14.1f}")
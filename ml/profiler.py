@@ -0,0 +1,295 @@
+"""
+Bluely Sampling Profiler
+=========================
+Opt-in, low-overhead stack sampling for the prediction server, to see where
+time goes inside e.g. /predict-glucose-30 or /predict when latency spikes.
+
+A fraction of requests (`sample_rate`) is marked as sampled by the ASGI
+middleware, in a context variable that follows the request into worker
+threads. Code that does a request's work in a thread wraps it with
+`attached` (the server does so for every sync endpoint and for the model
+pool), which records the thread ident under the request's path while the
+call runs. While at least one sampled request is in flight, a background
+thread wakes every `interval` seconds, reads the current Python stack of
+each such thread with sys._current_frames() and counts it as a collapsed
+stack ("[path];module:function;module:function;..."); threads serving
+unsampled requests are never read, so their work is not charged to a
+sampled endpoint. Nothing is traced per call, so a sampled request pays
+only for the snapshots taken while it runs, and an unsampled request pays
+one random() call. Idle stacks (threads parked in threading / selectors /
+queue waits) are dropped.
+
+Stacks aggregate into:
+  - top(n):       hottest frames by self and total samples
+  - collapsed():  "frame;frame;frame count" lines, the input format of
+                  flamegraph.pl and speedscope
+
+Configuration (env):
+    PROFILER_ENABLED=1            start enabled
+    PROFILER_SAMPLE_RATE=0.05     fraction of requests sampled
+    PROFILER_INTERVAL_MS=5        stack sampling interval
+
+Usage:
+    from profiler import SamplingProfiler, ProfilerMiddleware
+    profiler = SamplingProfiler.from_env()
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+    handler = profiler.attached(handler)        # sync code run for a request in a thread
+
+    profiler.top(20)
+    open("profile.folded", "w").write(profiler.collapsed())
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_SAMPLE_RATE = 0.05
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 64
+MAX_STACKS = 20_000
+TRUNCATED = "(truncated)"
+
+# A thread whose innermost frame is in one of these modules is waiting, not working
+IDLE_MODULES = ("threading", "selectors", "queue")
+
+
+# Path of the sampled request the current context belongs to (None: not sampled)
+_sampled_path: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("bluely_sampled_path", default=None)
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def frame_label(frame: Any) -> str:
+    """module:function for a frame (module = file name without .py)."""
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Aggregates sampled Python stacks of the threads serving sampled requests."""
+
+    def __init__(
+        self,
+        sample_rate: float = DEFAULT_SAMPLE_RATE,
+        interval: float = DEFAULT_INTERVAL,
+        max_depth: int = MAX_DEPTH,
+        max_stacks: int = MAX_STACKS,
+    ):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.enabled = False
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._active: Dict[int, str] = {}
+        self._threads: Dict[int, str] = {}      # thread ident → path of the sampled request it serves
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reset_stats()
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        profiler = cls(
+            sample_rate=float(os.environ.get("PROFILER_SAMPLE_RATE", DEFAULT_SAMPLE_RATE)),
+            interval=float(os.environ.get("PROFILER_INTERVAL_MS", DEFAULT_INTERVAL * 1000)) / 1000,
+        )
+        if _env_flag("PROFILER_ENABLED"):
+            profiler.start()
+        return profiler
+
+    def _reset_stats(self) -> None:
+        self.samples = 0
+        self.sampled_requests = 0
+        self.sampled_seconds = 0.0
+        self.since = time.time()
+
+    # ── Control ────────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self.enabled = True
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="bluely-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self.enabled = False
+        self._wake.set()
+
+    def configure(self, sample_rate: Optional[float] = None, interval: Optional[float] = None) -> None:
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if interval is not None:
+            self.interval = max(float(interval), 0.0005)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._reset_stats()
+
+    # ── Request hooks (called by the middleware) ───────────────────────────
+
+    def should_sample(self) -> bool:
+        return self.enabled and random.random() < self.sample_rate
+
+    def request_started(self, token: int, path: str) -> None:
+        with self._lock:
+            self._active[token] = path
+            self.sampled_requests += 1
+        self._wake.set()
+
+    def request_finished(self, token: int, elapsed: float) -> None:
+        with self._lock:
+            self._active.pop(token, None)
+            self.sampled_seconds += elapsed
+
+    def attached(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        `fn` with the calling thread marked as serving the current sampled
+        request while it runs (a plain call for unsampled requests). Async
+        functions are returned unchanged: the event loop thread interleaves
+        requests, so its stacks cannot be charged to one of them.
+        """
+        if asyncio.iscoroutinefunction(fn):
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            path = _sampled_path.get()
+            if path is None:
+                return fn(*args, **kwargs)
+            ident = threading.get_ident()
+            with self._lock:
+                previous = self._threads.get(ident)
+                self._threads[ident] = path
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    if previous is None:
+                        self._threads.pop(ident, None)
+                    else:
+                        self._threads[ident] = previous
+
+        return wrapper
+
+    # ── Sampling thread ────────────────────────────────────────────────────
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while self.enabled:
+            if not self._active:
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+                continue
+            self._sample(me)
+            time.sleep(self.interval)
+
+    def _sample(self, skip_thread: int) -> None:
+        with self._lock:
+            threads = dict(self._threads)
+        taken = []
+        for thread_id, frame in sys._current_frames().items():
+            path = threads.get(thread_id)
+            if path is None or thread_id == skip_thread:
+                continue
+            prefix = f"[{path}]"
+            labels: List[str] = []
+            idle = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0] in IDLE_MODULES
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if not idle:
+                taken.append(";".join([prefix] + labels[::-1]))
+        with self._lock:
+            self.samples += 1
+            for stack in taken:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self._stacks[f"{stack.split(';', 1)[0]};{TRUNCATED}"] += 1
+
+    # ── Reports ────────────────────────────────────────────────────────────
+
+    def top(self, n: int = 20) -> List[Dict[str, Any]]:
+        """Hottest frames: self = innermost-frame samples, total = samples with the frame on the stack."""
+        with self._lock:
+            stacks = list(self._stacks.items())
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in stacks:
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        n_stacks = sum(count for _, count in stacks) or 1
+        return [
+            {
+                "frame": frame,
+                "self": self_counts[frame],
+                "total": total_counts[frame],
+                "selfPct": round(100 * self_counts[frame] / n_stacks, 2),
+                "totalPct": round(100 * total_counts[frame] / n_stacks, 2),
+            }
+            for frame, _ in sorted(
+                total_counts.items(), key=lambda kv: (self_counts[kv[0]], kv[1]), reverse=True
+            )[:n]
+        ]
+
+    def collapsed(self) -> str:
+        """Collapsed-stack dump ("frame;frame count" per line)."""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            distinct = len(self._stacks)
+            in_flight = len(self._active)
+        return {
+            "enabled": self.enabled,
+            "sampleRate": self.sample_rate,
+            "intervalMs": round(self.interval * 1000, 3),
+            "since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.since)),
+            "sampledRequests": self.sampled_requests,
+            "sampledSeconds": round(self.sampled_seconds, 3),
+            "inFlight": in_flight,
+            "samples": self.samples,
+            "distinctStacks": distinct,
+        }
+
+
+class ProfilerMiddleware:
+    """ASGI middleware marking a random `sample_rate` fraction of HTTP requests as sampled."""
+
+    def __init__(self, app: Any, profiler: SamplingProfiler, exclude_prefix: str = "/admin"):
+        self.app = app
+        self.profiler = profiler
+        self.exclude_prefix = exclude_prefix
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.profiler.should_sample()
+                or scope["path"].startswith(self.exclude_prefix)):
+            await self.app(scope, receive, send)
+            return
+        token = id(scope)
+        start = time.perf_counter()
+        self.profiler.request_started(token, scope["path"])
+        marker = _sampled_path.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _sampled_path.reset(marker)
+            self.profiler.request_finished(token, time.perf_counter() - start)
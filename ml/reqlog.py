@@ -0,0 +1,240 @@
+"""
+Bluely Structured Request Logs
+===============================
+One JSON log line per request, written off the request path.
+
+Records go through a logging.QueueHandler into a bounded queue; a
+QueueListener thread formats them as JSON and writes them to stdout, so a
+request only pays for building a dict and one put_nowait(). If stdout
+stalls and the queue fills, records are dropped and counted rather than
+blocking the event loop.
+
+Each HTTP request gets a trace (contextvars, so it follows the request
+into FastAPI's threadpool):
+  - requestId: the caller's X-Request-ID (the Express backend forwards
+    its own), or a new one; echoed back as a response header
+  - spans: per-stage timings in ms, recorded with `with span("model"):`
+  - fields added by the endpoint with annotate(): model version and
+    modelUsed, fallbackReason, input sizes (readings, meals, medications)
+
+    {"ts": "...", "level": "info", "event": "request", "requestId": "...",
+     "method": "POST", "path": "/predict-glucose-30", "status": 200,
+     "durationMs": 1.84, "spans": {"features": 0.21, "model": 0.62, ...},
+     "modelUsed": "ohiot1dm", "modelVersion": "...", "readings": 20, ...}
+
+Configuration (env):
+    LOG_LEVEL=INFO          minimum level written
+    LOG_QUEUE_SIZE=10000    records buffered before dropping
+
+Usage:
+    from reqlog import RequestLogMiddleware, annotate, log_event, log_exception, setup_logging, span
+    setup_logging()
+    app.add_middleware(RequestLogMiddleware)
+
+    with span("model"):
+        ...
+    annotate(modelUsed="ohiot1dm", readings=20)
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+LOGGER_NAME = "bluely"
+REQUEST_ID_HEADER = b"x-request-id"
+MAX_REQUEST_ID = 128
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class RequestTrace:
+    """Timing spans and fields of one request."""
+
+    __slots__ = ("request_id", "start", "spans", "fields")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+
+
+_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("bluely_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a stage of the current request (repeated spans add up)."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans[name] = trace.spans.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def add_span(name: str, start: float) -> None:
+    """Record a span that began at perf_counter() value `start` and ends now."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans[name] = trace.spans.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def annotate(**fields: Any) -> None:
+    """Attach fields to the current request's log line."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+# ── Logging setup ───────────────────────────────────────────────────────────
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, event, message, fields, error."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": getattr(record, "event", "log"),
+        }
+        message = record.getMessage()
+        if message:
+            out["message"] = message
+        out.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            out["traceback"] = record.exc_text
+        return json.dumps(out, default=str, separators=(",", ":"))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the traceback is rendered here (while the frames exist); JSON
+        # formatting happens on the listener thread.
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: Optional[str] = None, stream: Any = None) -> logging.Logger:
+    """Route the `bluely` logger through a queue to a JSON stdout writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return logger
+    records: queue.Queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10_000)))
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=False)
+    _listener.start()
+
+    logger.handlers[:] = [DroppingQueueHandler(records)]
+    logger.setLevel((level or os.environ.get("LOG_LEVEL", "INFO")).upper())
+    logger.propagate = False
+    return logger
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(event: str, message: str = "", level: int = logging.INFO, **fields: Any) -> None:
+    """Log a structured event; carries the current request id when inside a request."""
+    trace = _trace.get()
+    if trace is not None:
+        fields.setdefault("requestId", trace.request_id)
+    logger.log(level, message, extra={"event": event, "fields": fields})
+
+
+def log_exception(event: str, message: str = "", **fields: Any) -> None:
+    """log_event at error level with the active exception's traceback."""
+    trace = _trace.get()
+    if trace is not None:
+        fields.setdefault("requestId", trace.request_id)
+    logger.error(message, exc_info=True, extra={"event": event, "fields": fields})
+
+
+# ── Middleware ──────────────────────────────────────────────────────────────
+
+def _request_id(scope: Dict[str, Any]) -> str:
+    for name, value in scope.get("headers", ()):
+        if name == REQUEST_ID_HEADER:
+            rid = value.decode("latin-1").strip()[:MAX_REQUEST_ID]
+            if rid:
+                return rid
+    return uuid.uuid4().hex
+
+
+class RequestLogMiddleware:
+    """ASGI middleware: starts a trace per HTTP request and logs it when the response ends."""
+
+    def __init__(self, app: Any, skip_paths: tuple = ("/health",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace(_request_id(scope))
+        token = _trace.set(trace)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER, trace.request_id.encode("latin-1", "replace"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _trace.reset(token)
+            if scope["path"] not in self.skip_paths or status >= 400:
+                level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 else logging.INFO
+                logger.log(level, "", extra={"event": "request", "fields": {
+                    "requestId": trace.request_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "durationMs": round((time.perf_counter() - trace.start) * 1000, 3),
+                    "spans": {name: round(ms, 3) for name, ms in trace.spans.items()},
+                    **trace.fields,
+                }})
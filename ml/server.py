@@ -5,35 +5,119 @@ Loads the trained model and exposes prediction endpoints.
 
 - POST /predict             — Pima-based diabetes risk classification
 - POST /predict-trend       — User-data-driven glucose trend prediction
+- POST /predict-trend/bulk  — The same for many users at once
 - POST /predict-glucose-30  — OhioT1DM-based 30-minute glucose forecast
+- POST /predict-dashboard   — Trend, 30-minute forecast and risk in one call,
+                              from one validation and feature pass
+- POST /glycemic-metrics    — TIR, GMI, CV, MAGE, LBGI/HBGI, hypo episodes
+                              (+ daily roll-ups, combined via /rollup)
+- POST /scanner/readings    — Feed the background early-warning scanner
+- GET  /scanner/alerts      — Drain its low / high risk alerts
+- GET  /drift               — Input / prediction drift of the OhioT1DM model
+                              against its training-time reference
+- POST /accuracy/outcomes   — Realized readings for earlier forecasts
+- GET  /accuracy            — Running forecast MAE, bias and ±20 mg/dL hit
+                              rate (+ /accuracy/users/{userId})
+
+The two forecast endpoints also accept a columnar body (parallel arrays
+instead of a list of reading objects) at `/predict-trend/columnar` and
+`/predict-glucose-30/columnar`.
+
+Every request is logged as one structured JSON line (reqlog.py) with its
+X-Request-ID, per-stage timing spans, model version, fallback reason and
+input sizes.
+
+/predict-glucose-30 runs the OhioT1DM model under a latency budget
+(deadline.py): when inference cannot finish in time it answers with the
+fallback forecast instead — statistical, or the Kalman filter (kalman.py)
+with FORECAST_FALLBACK=kalman — marked by modelUsed and fallbackReason.
+`forecastModel` in the request picks either fallback forecaster outright.
+
+With SCANNER_ENABLED=1 a background thread (scanner.py) re-forecasts every
+user with recent pushed readings each SCANNER_INTERVAL_S in one batch and
+queues risk alerts; /scanner/* return 404 otherwise.
+
+Every OhioT1DM forecast is also counted into constant-memory histograms
+(drift.py) that /drift scores against the reference saved with the
+bundle; without a reference /drift returns 404. Outcomes posted to
+/accuracy/outcomes update running accuracy aggregates (accuracy.py) and
+give the drift monitor its forecast residuals.
+
+/admin/profiler* control the opt-in sampling profiler (profiler.py); they
+require the X-Admin-Token header to match ADMIN_TOKEN and are disabled
+when it is unset.
 
 Run:
     uvicorn server:app --host 0.0.0.0 --port 8000 --reload --reload-dir .
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from predict import predict_risk
-from typing import List, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from pydantic import AfterValidator, BaseModel, Field, model_validator
+from predict import predict_risk, load_bundle_cached, INFERENCE_MODE, TIER_MARGIN
+from model_bundle import load_bundle, OHIO_BUNDLE_PATH
+from profiler import ProfilerMiddleware, SamplingProfiler
+from deadline import DeadlineExecutor, InferenceSkipped, request_deadline
+from explain import TreeExplainer, top_contributions
+from scanner import EarlyWarningScanner
+from drift import MODEL_CHANNELS, DriftMonitor
+from accuracy import AccuracyTracker
+from kalman import KalmanForecaster
+from reqlog import RequestLogMiddleware, add_span, annotate, log_event, log_exception, setup_logging, span
+import forecast
+import glycemic
+import kinetics
+import trend
+from typing import Annotated, Any, Dict, List, Literal, NamedTuple, Optional, Tuple
+import hmac
+import json
+import logging
 import os
+import time
 import numpy as np
-import joblib
-import traceback
 
-# ── Load OhioT1DM model at startup ──────────────────────────────────────────
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+try:
+    import orjson
+except ImportError:  # optional: fall back to the standard library encoder
+    orjson = None
+
+setup_logging()
 
+# ── Load model bundles at startup ───────────────────────────────────────────
+# Bundles are memory-mapped and checksum-verified, so a corrupt or
+# mismatched deploy fails here rather than on the first request.
 try:
-    ohio_model = joblib.load(os.path.join(MODEL_DIR, "ohio_glucose_predictor.joblib"))
-    ohio_scaler = joblib.load(os.path.join(MODEL_DIR, "ohio_scaler.joblib"))
+    ohio_bundle = load_bundle(OHIO_BUNDLE_PATH)
+    # The server builds only the 26 base features from app readings
+    families = ohio_bundle.metadata.get("feature_params", {}).get("families")
+    if families:
+        raise ValueError(f"bundle needs feature families {families}, which live inference cannot build")
+    ohio_model = ohio_bundle["gbr"]
+    ohio_scaler = ohio_bundle["scaler"]
+    # TreeSHAP tables (every leaf's share per on/off pattern of its path
+    # features), built once at load (~0.25 s). An explained forecast costs
+    # ~1 ms against ~0.1 ms for a plain prediction; `explain` is single-row
+    # only (/predict-glucose-30, /predict-dashboard), so it stays well inside
+    # the inference budget
+    ohio_explainer = TreeExplainer.for_model(ohio_model)
     OHIO_MODEL_LOADED = True
-    print(" OhioT1DM model loaded successfully")
+    log_event("model_loaded", model="ohio", version=ohio_bundle.version)
 except Exception as e:
+    ohio_bundle = None
     ohio_model = None
     ohio_scaler = None
+    ohio_explainer = None
     OHIO_MODEL_LOADED = False
-    print(f"  OhioT1DM model not loaded: {e}")
+    log_event("model_load_failed", level=logging.WARNING, model="ohio", error=str(e))
+
+try:
+    pima_bundle = load_bundle_cached()
+    log_event("model_loaded", model="pima", version=pima_bundle.version)
+except Exception as e:
+    pima_bundle = None
+    log_event("model_load_failed", level=logging.WARNING, model="pima", error=str(e))
 
 app = FastAPI(
     title="Bluely ML API",
@@ -50,12 +134,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in sampling profiler (PROFILER_ENABLED / PROFILER_SAMPLE_RATE, or the
+# /admin/profiler endpoint). Unsampled requests pay one random() call.
+profiler = SamplingProfiler.from_env()
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose sync endpoint marks its worker thread for the profiler while it runs."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, profiler.attached(endpoint), **kwargs)
+
+
+app.router.route_class = ProfiledRoute
+# Outermost: one structured log line per request, written off the request path
+app.add_middleware(RequestLogMiddleware)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Bounded model-inference pool with per-request deadlines (INFERENCE_BUDGET_MS,
+# X-Latency-Budget-Ms header)
+inference = DeadlineExecutor.from_env()
+# Forecaster used when the OhioT1DM model cannot answer (FORECAST_FALLBACK)
+FORECAST_FALLBACK = os.environ.get("FORECAST_FALLBACK", "statistical")
+if FORECAST_FALLBACK not in ("statistical", "kalman"):
+    raise ValueError(f"FORECAST_FALLBACK must be 'statistical' or 'kalman', not {FORECAST_FALLBACK!r}")
+kalman = KalmanForecaster.from_env()
+# Background early-warning scanner over pushed readings (SCANNER_ENABLED)
+scanner = EarlyWarningScanner.from_env(model=ohio_model, scaler=ohio_scaler)
+# Feature / prediction histograms vs the bundle's training reference
+# (a reference built for another bundle version scores the features only)
+drift = DriftMonitor.from_env(OHIO_BUNDLE_PATH, model_version=ohio_bundle.version) if OHIO_MODEL_LOADED else None
+if drift is not None and drift.stale:
+    log_event("drift_reference_mismatch", level=logging.WARNING,
+              reference=drift.reference.get("bundle_version"), model=ohio_bundle.version,
+              disabled=list(MODEL_CHANNELS))
+# Running forecast accuracy from realized readings (ACCURACY_HALF_LIFE_HOURS)
+accuracy = AccuracyTracker.from_env()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for the forecast endpoints. Output models are serialized
+    by pydantic's compiled serializer and plain data by orjson when it is
+    installed, skipping FastAPI's per-field jsonable_encoder pass.
+
+    Returning a response skips FastAPI's `response_model` check, so endpoints
+    that declare one pass it as `model`: content that is not already an
+    instance of it (plain dicts, other models) is validated into it first,
+    which also drops undeclared fields.
+    """
+
+    def __init__(self, content: Any, model: Optional[type] = None, **kwargs):
+        self.model = model      # render() runs inside JSONResponse.__init__
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        if self.model is not None and type(content) is not self.model:
+            with span("validate"):
+                content = self.model.model_validate(
+                    content.model_dump() if isinstance(content, BaseModel) else content
+                )
+        with span("serialize"):
+            if isinstance(content, BaseModel):
+                return content.model_dump_json().encode("utf-8")
+            if orjson is not None:
+                return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+            return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 
 # ── Request / Response schemas ───────────────────────────────────────────────
 
-class PredictionInput(BaseModel):
+class RiskProfile(BaseModel):
+    """/predict inputs other than glucose (the dashboard uses currentGlucose)."""
     pregnancies: float = Field(default=0, ge=0, le=20)
-    glucose: float = Field(..., ge=0, le=600, description="Plasma glucose concentration")
     blood_pressure: float = Field(default=72, ge=0, le=200)
     skin_thickness: float = Field(default=29, ge=0, le=100)
     insulin: float = Field(default=80, ge=0, le=900)
@@ -64,11 +215,28 @@ class PredictionInput(BaseModel):
     age: float = Field(..., ge=1, le=120)
 
 
+class PredictionInput(RiskProfile):
+    glucose: float = Field(..., ge=0, le=600, description="Plasma glucose concentration")
+    explain: bool = False
+
+
+class FeatureAttribution(BaseModel):
+    feature: str
+    contribution: float
+
+
+class ModelExplanation(BaseModel):
+    """TreeSHAP attributions (explain.py): base + Σ contributions = the model's output."""
+    base: float
+    factors: List[FeatureAttribution]   # largest |contribution| first
+
+
 class PredictionOutput(BaseModel):
     predicted_risk: int
     risk_level: str
     confidence: float
     recommendation: str
+    explanation: Optional[ModelExplanation] = None   # with `explain`: high-risk probability
 
 
 class GlucoseReading(BaseModel):
@@ -86,6 +254,170 @@ class GlucoseReading(BaseModel):
     medicationDose: Optional[float] = None
     medicationDoseUnit: Optional[str] = None
     injectionSite: Optional[str] = None
+    timestamp: Optional[float] = None        # epoch ms; spacing for the Kalman forecaster
+
+
+# Columnar reading input: parallel arrays validated straight into NumPy.
+# Codes index into the lists below.
+READING_TYPES = ["random", "fasting", "before_meal", "after_meal", "bedtime", "other"]
+READING_TYPE_MEAL = (READING_TYPES.index("before_meal"), READING_TYPES.index("after_meal"))
+MEDICATION_TYPES = ["", "insulin_rapid", "insulin_long", "insulin_mixed", "metformin", "other"]
+MEDICATION_TIMINGS = list(forecast.TIMING_HOURS)
+
+FloatArray = Annotated[List[Optional[float]], AfterValidator(lambda v: np.asarray(v, dtype=np.float64))]
+IntArray = Annotated[List[int], AfterValidator(lambda v: np.asarray(v, dtype=np.int64))]
+BoolArray = Annotated[List[bool], AfterValidator(lambda v: np.asarray(v, dtype=bool))]
+
+
+class ReadingSeries(NamedTuple):
+    """What the forecast logic needs from a request's readings, in either input form."""
+    values: np.ndarray                  # oldest → newest
+    hour: int                           # of the newest reading
+    day_of_week: int
+    last_medication_taken: bool
+    last_activity: bool                 # newest reading has activity context
+    meal_context: bool                  # any before/after-meal reading or meal context
+    medication_taken: bool              # any reading with medication taken
+    activity_context: bool              # any reading with non-blank activity context
+    inline_med: Optional[Tuple[Optional[str], int, float, float]]  # (name, MED_* code, dose, hours since)
+    timestamps: Optional[np.ndarray] = None  # epoch ms, when every reading has one
+
+
+def _flags(column: Optional[np.ndarray], n: int) -> np.ndarray:
+    return column if column is not None else np.zeros(n, dtype=bool)
+
+
+class ReadingColumns(BaseModel):
+    """
+    Columnar form of `readings`: one array per field, all the same length
+    as `values` (oldest → newest). Omitted arrays take the GlucoseReading
+    defaults.
+    """
+    values: FloatArray = Field(..., min_length=1)
+    hours: Optional[IntArray] = None
+    daysOfWeek: Optional[IntArray] = None
+    readingTypes: Optional[IntArray] = Field(None, description=f"Codes into {READING_TYPES}")
+    mealContext: Optional[BoolArray] = Field(None, description="Reading has meal context")
+    activityContext: Optional[BoolArray] = Field(None, description="Reading has activity context")
+    medicationTaken: Optional[BoolArray] = None
+    medicationTypes: Optional[IntArray] = Field(None, description=f"Codes into {MEDICATION_TYPES}")
+    medicationDoses: Optional[FloatArray] = None
+    medicationTimings: Optional[IntArray] = Field(
+        None, description=f"Codes into {MEDICATION_TIMINGS}; -1 = unknown",
+    )
+    medicationNames: Optional[List[Optional[str]]] = None
+    timestamps: Optional[FloatArray] = Field(None, description="Epoch ms of each reading")
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        n = len(self.values)
+        if not np.isfinite(self.values).all():
+            raise ValueError("values must be finite numbers")
+        if self.timestamps is not None and not np.isfinite(self.timestamps).all():
+            raise ValueError("timestamps must be finite numbers")
+        for name in ("hours", "daysOfWeek", "readingTypes", "mealContext", "activityContext",
+                     "medicationTaken", "medicationTypes", "medicationDoses", "medicationTimings",
+                     "medicationNames", "timestamps"):
+            column = getattr(self, name)
+            if column is not None and len(column) != n:
+                raise ValueError(f"{name} has {len(column)} entries, expected {n} (one per value)")
+        if self.readingTypes is not None and ((self.readingTypes < 0) | (self.readingTypes >= len(READING_TYPES))).any():
+            raise ValueError("readingTypes contains an unknown code")
+        if self.medicationTypes is not None and ((self.medicationTypes < 0) | (self.medicationTypes >= len(MEDICATION_TYPES))).any():
+            raise ValueError("medicationTypes contains an unknown code")
+        if self.medicationTimings is not None and ((self.medicationTimings < -1) | (self.medicationTimings >= len(MEDICATION_TIMINGS))).any():
+            raise ValueError("medicationTimings contains an unknown code")
+        return self
+
+    def series(self) -> ReadingSeries:
+        n = len(self.values)
+        meal = _flags(self.mealContext, n)
+        if self.readingTypes is not None:
+            meal = meal | np.isin(self.readingTypes, READING_TYPE_MEAL)
+        activity = _flags(self.activityContext, n)
+        taken = _flags(self.medicationTaken, n)
+
+        inline_med = None
+        if self.medicationTypes is not None:
+            with_type = np.flatnonzero(taken & (self.medicationTypes > 0))
+            if len(with_type):
+                i = with_type[-1]
+                code = forecast.MED_TYPE_CODES.get(MEDICATION_TYPES[self.medicationTypes[i]], forecast.MED_NONE)
+                dose = self.medicationDoses[i] if self.medicationDoses is not None else 0
+                timing = self.medicationTimings[i] if self.medicationTimings is not None else -1
+                inline_med = (
+                    self.medicationNames[i] if self.medicationNames is not None else None,
+                    code,
+                    float(dose) if dose == dose and dose else 0,
+                    forecast.TIMING_HOURS[MEDICATION_TIMINGS[timing]] if timing >= 0 else forecast.DEFAULT_TIMING_HOURS,
+                )
+
+        return ReadingSeries(
+            values=self.values,
+            hour=int(self.hours[-1]) if self.hours is not None else 12,
+            day_of_week=int(self.daysOfWeek[-1]) if self.daysOfWeek is not None else 0,
+            last_medication_taken=bool(taken[-1]),
+            last_activity=bool(activity[-1]),
+            meal_context=bool(meal.any()),
+            medication_taken=bool(taken.any()),
+            activity_context=bool(activity.any()),
+            inline_med=inline_med,
+            timestamps=self.timestamps,
+        )
+
+
+def _series_from_readings(readings: List[GlucoseReading]) -> ReadingSeries:
+    # Extract inline medication data from the most recent reading that has it
+    inline_med = None
+    for r in reversed(readings):
+        if r.medicationTaken and r.medicationType:
+            inline_med = (
+                r.medicationName,
+                forecast.MED_TYPE_CODES.get(r.medicationType, forecast.MED_NONE),
+                r.medicationDose or 0,
+                # Approximate hours since medication from its timing relative to the reading
+                forecast.TIMING_HOURS.get(r.medicationTiming or "", forecast.DEFAULT_TIMING_HOURS),
+            )
+            break
+
+    last = readings[-1]
+    return ReadingSeries(
+        values=np.array([r.value for r in readings], dtype=np.float64),
+        hour=last.hour,
+        day_of_week=last.dayOfWeek,
+        last_medication_taken=last.medicationTaken,
+        last_activity=bool(last.activityContext),
+        meal_context=any(
+            r.readingType == "after_meal" or r.readingType == "before_meal"
+            or (r.mealContext and r.mealContext.strip())
+            for r in readings
+        ),
+        medication_taken=any(r.medicationTaken for r in readings),
+        activity_context=any(r.activityContext and r.activityContext.strip() for r in readings),
+        inline_med=inline_med,
+        timestamps=(np.array([r.timestamp for r in readings], dtype=np.float64)
+                    if all(r.timestamp is not None for r in readings) else None),
+    )
+
+
+class ReadingFeatures(NamedTuple):
+    """
+    One feature pass over a request's readings, shared by every model that
+    reads them (trend, 30-minute forecast, dashboard).
+    """
+    values: np.ndarray                  # (1, n) history matrix for the forecast core
+    counts: np.ndarray                  # (1,)
+    stats: dict                         # trend.segment_stats: slope, rate_of_change, acceleration, cv
+
+
+def _reading_features(series: ReadingSeries) -> ReadingFeatures:
+    with span("features"):
+        n = len(series.values)
+        return ReadingFeatures(
+            values=series.values[None, :],
+            counts=np.array([n]),
+            stats=trend.segment_stats(series.values, np.array([n])),
+        )
 
 
 class TrendPredictionInput(BaseModel):
@@ -97,6 +429,16 @@ class TrendPredictionInput(BaseModel):
     activityLevel: Optional[str] = None
 
 
+class TrendColumnarInput(ReadingColumns):
+    """TrendPredictionInput with columnar readings."""
+    values: FloatArray = Field(..., min_length=3, description="Last N glucose readings, ordered oldest→newest")
+    currentGlucose: float = Field(..., ge=20, le=600)
+    diabetesType: Optional[str] = None
+    onMedication: bool = False
+    lastMealHoursAgo: Optional[float] = None
+    activityLevel: Optional[str] = None
+
+
 class TrendPredictionOutput(BaseModel):
     direction: str  # 'rising', 'stable', 'dropping'
     predictedNextGlucose: float
@@ -107,35 +449,92 @@ class TrendPredictionOutput(BaseModel):
     factors: List[str]
 
 
+class BulkTrendInput(BaseModel):
+    """
+    Many users' /predict-trend inputs. `readings` holds one value list per
+    user (oldest → newest, lengths may differ); every other list, when
+    given, has one entry per user and describes that user's newest reading
+    or profile.
+    """
+    userIds: Optional[List[str]] = None
+    readings: List[Annotated[List[float], Field(min_length=3)]] = Field(..., min_length=1)
+    currentGlucose: List[Annotated[float, Field(ge=20, le=600)]]
+    hours: Optional[List[int]] = None
+    medicationTaken: Optional[List[bool]] = None
+    activityContext: Optional[List[bool]] = None
+    onMedication: Optional[List[bool]] = None
+    lastMealHoursAgo: Optional[List[Optional[float]]] = None
+    activityLevel: Optional[List[Optional[str]]] = None
+
+    @model_validator(mode="after")
+    def _check_users(self):
+        n = len(self.readings)
+        for name in ("userIds", "currentGlucose", "hours", "medicationTaken", "activityContext",
+                     "onMedication", "lastMealHoursAgo", "activityLevel"):
+            column = getattr(self, name)
+            if column is not None and len(column) != n:
+                raise ValueError(f"{name} has {len(column)} entries, expected {n} (one per user)")
+        return self
+
+
+class BulkTrendOutput(BaseModel):
+    userIds: Optional[List[str]] = None
+    results: List[TrendPredictionOutput]
+    slope: List[float]          # mg/dL per reading
+    acceleration: List[float]
+    cv: List[float]
+
+
 # ── Endpoints ────────────────────────────────────────────────────────────────
 
 @app.get("/health")
 def health_check():
     """Health check — confirms the model is loaded and ready."""
-    return {"status": "healthy", "model": "loaded", "version": "2.0.0"}
+    return {
+        "status": "healthy",
+        "model": "loaded" if pima_bundle is not None else "missing",
+        "version": "2.0.0",
+        "models": {
+            "pima": pima_bundle.version if pima_bundle is not None else None,
+            "ohio": ohio_bundle.version if ohio_bundle is not None else None,
+        },
+        "riskInference": {
+            "mode": INFERENCE_MODE,
+            "margin": TIER_MARGIN if INFERENCE_MODE == "tiered" else None,
+        },
+        "forecastInference": inference.status(),
+        "earlyWarning": scanner.status() if scanner.enabled else {"enabled": False},
+        "drift": _drift_summary(),
+        "forecastAccuracy": accuracy.summary()["overall"],
+    }
 
 
 @app.post("/predict", response_model=PredictionOutput)
 def predict(input_data: PredictionInput):
     """Run a diabetes risk prediction using the trained Random Forest model."""
     try:
-        result = predict_risk(
-            pregnancies=input_data.pregnancies,
-            glucose=input_data.glucose,
-            blood_pressure=input_data.blood_pressure,
-            skin_thickness=input_data.skin_thickness,
-            insulin=input_data.insulin,
-            bmi=input_data.bmi,
-            diabetes_pedigree=input_data.diabetes_pedigree,
-            age=input_data.age,
-        )
+        annotate(modelVersion=pima_bundle.version if pima_bundle is not None else None, riskMode=INFERENCE_MODE)
+        with span("model"):
+            result = predict_risk(
+                pregnancies=input_data.pregnancies,
+                glucose=input_data.glucose,
+                blood_pressure=input_data.blood_pressure,
+                skin_thickness=input_data.skin_thickness,
+                insulin=input_data.insulin,
+                bmi=input_data.bmi,
+                diabetes_pedigree=input_data.diabetes_pedigree,
+                age=input_data.age,
+                explain=input_data.explain,
+            )
         return PredictionOutput(**result)
     except FileNotFoundError:
+        annotate(fallbackReason="model_not_loaded")
         raise HTTPException(
             status_code=503,
             detail="Model not found. Please run train.py first.",
         )
     except Exception as e:
+        log_exception("request_failed", error=repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -145,96 +544,92 @@ def predict_trend(input_data: TrendPredictionInput):
     Predict glucose trend direction using user's historical patterns.
     Uses statistical analysis of recent readings + contextual factors.
     """
-    try:
-        readings = input_data.readings
-        values = [r.value for r in readings]
-        current = input_data.currentGlucose
+    return FastJSONResponse(_predict_trend(_series_from_readings(input_data.readings), input_data),
+                            model=TrendPredictionOutput)
 
-        # ------ Statistical trend analysis ------
-        n = len(values)
-        if n < 3:
-            raise HTTPException(status_code=400, detail="Need at least 3 readings")
 
-        # Linear regression on recent values
-        x = np.arange(n, dtype=float)
-        y = np.array(values, dtype=float)
-        slope = np.polyfit(x, y, 1)[0]
+@app.post("/predict-trend/columnar", response_model=TrendPredictionOutput)
+def predict_trend_columnar(input_data: TrendColumnarInput):
+    """/predict-trend with the readings sent as parallel arrays."""
+    return FastJSONResponse(_predict_trend(input_data.series(), input_data), model=TrendPredictionOutput)
 
-        # Rate of change (last 3)
-        recent_3 = values[-3:]
-        rate_of_change = (recent_3[-1] - recent_3[0]) / max(len(recent_3) - 1, 1)
 
-        # Velocity (acceleration)
-        if n >= 4:
-            prev_rate = (values[-3] - values[-4])
-            curr_rate = (values[-1] - values[-2])
-            acceleration = curr_rate - prev_rate
-        else:
-            acceleration = 0.0
+@app.post("/predict-trend/bulk", response_model=BulkTrendOutput)
+def predict_trend_bulk(input_data: BulkTrendInput):
+    """
+    /predict-trend for many users in one request, e.g. a nightly job over
+    every active user. Each result is identical to the single-user endpoint.
+    """
+    try:
+        n = len(input_data.readings)
+        values, lengths = trend.ragged(input_data.readings)
+        annotate(users=n, readings=len(values))
+        with span("trend"):
+            result = trend.analyze(
+                values, lengths,
+                current=np.asarray(input_data.currentGlucose, dtype=np.float64),
+                hour=np.asarray(_per_user(n, input_data.hours, 12)),
+                last_medication_taken=np.asarray(_per_user(n, input_data.medicationTaken, False)),
+                last_activity=np.asarray(_per_user(n, input_data.activityContext, False)),
+                on_medication=np.asarray(_per_user(n, input_data.onMedication, False)),
+                last_meal_hours=np.array(_per_user(n, input_data.lastMealHoursAgo, None), dtype=np.float64),
+                high_activity=np.isin(np.array(_per_user(n, input_data.activityLevel, None), dtype=object),
+                                      trend.HIGH_ACTIVITY_LEVELS),
+            )
+        return FastJSONResponse({
+            "userIds": input_data.userIds,
+            "results": _trend_results(result),
+            "slope": result["slope"].tolist(),
+            "acceleration": result["acceleration"].tolist(),
+            "cv": result["cv"].tolist(),
+        }, model=BulkTrendOutput)
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Variability (coefficient of variation)
-        cv = np.std(values) / np.mean(values) if np.mean(values) > 0 else 0
 
+def _per_user(n: int, column: Optional[list], default: Any) -> list:
+    return column if column is not None else [default] * n
+
+
+_TREND_MEAL_FACTORS = {
+    trend.MEAL_RECENT: "Recent meal detected. Glucose often rises in this window",
+    trend.MEAL_POST: "Post-meal period (1-2 hrs). Levels may still be adjusting",
+    trend.MEAL_EXTENDED: "Extended time since last meal. Levels may trend lower",
+}
+_TREND_TIME_FACTORS = {
+    forecast.TOD_DAWN: "Early morning reading. Dawn effect may influence levels",
+    forecast.TOD_NIGHT: "Nighttime reading. Levels often stabilize during rest",
+}
+_TREND_ACTIVITY_FACTORS = {
+    trend.ACTIVITY_HIGH: "High activity logged. May contribute to lower readings",
+    trend.ACTIVITY_RECENT: "Recent activity noted. Levels may be influenced",
+}
+_TREND_DIRECTIONS = {trend.RISING: "rising", trend.STABLE: "stable", trend.DROPPING: "dropping"}
+
+
+def _trend_results(result: dict) -> List[dict]:
+    """TrendPredictionOutput fields for every user of a trend.analyze batch."""
+    out = []
+    for predicted_next, direction, confidence, meal, medication, time_of_day, activity in zip(
+        result["predicted"].tolist(), result["direction"].tolist(), result["confidence"].tolist(),
+        result["meal"].tolist(), result["medication"].tolist(), result["time_of_day"].tolist(),
+        result["activity"].tolist(),
+    ):
         # ------ Contextual factors ------
         factors = []
-        adjustment = 0.0
-
-        last_reading = readings[-1]
-
-        # Meal effect
-        if input_data.lastMealHoursAgo is not None:
-            if input_data.lastMealHoursAgo < 1:
-                adjustment += 15  # glucose tends to rise after eating
-                factors.append("Recent meal detected. Glucose often rises in this window")
-            elif input_data.lastMealHoursAgo < 2:
-                adjustment += 5
-                factors.append("Post-meal period (1-2 hrs). Levels may still be adjusting")
-            elif input_data.lastMealHoursAgo > 4:
-                adjustment -= 5
-                factors.append("Extended time since last meal. Levels may trend lower")
-
-        # Medication effect
-        if last_reading.medicationTaken or input_data.onMedication:
-            adjustment -= 10
+        if meal in _TREND_MEAL_FACTORS:
+            factors.append(_TREND_MEAL_FACTORS[meal])
+        if medication:
             factors.append("Medication logged. May influence glucose direction")
-
-        # Time-of-day effect
-        hour = last_reading.hour
-        if 4 <= hour <= 7:
-            adjustment += 8  # Dawn phenomenon
-            factors.append("Early morning reading. Dawn effect may influence levels")
-        elif 22 <= hour or hour <= 3:
-            adjustment -= 5
-            factors.append("Nighttime reading. Levels often stabilize during rest")
-
-        # Activity effect
-        if input_data.activityLevel in ['high', 'frequent']:
-            adjustment -= 8
-            factors.append("High activity logged. May contribute to lower readings")
-        elif last_reading.activityContext:
-            adjustment -= 5
-            factors.append("Recent activity noted. Levels may be influenced")
-
+        if time_of_day in _TREND_TIME_FACTORS:
+            factors.append(_TREND_TIME_FACTORS[time_of_day])
+        if activity in _TREND_ACTIVITY_FACTORS:
+            factors.append(_TREND_ACTIVITY_FACTORS[activity])
         if not factors:
             factors.append("Based on recent glucose trend patterns")
 
-        # ------ Prediction ------
-        raw_prediction = current + slope * 2 + rate_of_change + adjustment + acceleration * 0.5
-        predicted_next = max(40, min(400, raw_prediction))  # Clamp
-
-        # Direction
-        delta = predicted_next - current
-        if delta > 10:
-            direction = "rising"
-        elif delta < -10:
-            direction = "dropping"
-        else:
-            direction = "stable"
-
-        # Confidence (higher when more data + lower variability)
-        base_confidence = min(0.5 + (n / 20) * 0.3, 0.8)
-        variability_penalty = min(cv * 0.5, 0.3)
-        confidence = round(max(0.3, base_confidence - variability_penalty), 2)
+        direction = _TREND_DIRECTIONS[direction]
 
         # Risk alerts
         risk_alert = None
@@ -259,24 +654,55 @@ def predict_trend(input_data: TrendPredictionInput):
         else:
             recommendation = "A downward trend is detected in recent readings. This may reflect normal variation — continued monitoring helps clarify the pattern."
 
-        return TrendPredictionOutput(
-            direction=direction,
-            predictedNextGlucose=round(predicted_next, 1),
-            confidence=confidence,
-            timeframe="next 1-2 hours",
-            recommendation=recommendation,
-            riskAlert=risk_alert,
-            factors=factors,
-        )
+        out.append({
+            "direction": direction,
+            "predictedNextGlucose": round(predicted_next, 1),
+            "confidence": round(confidence, 2),
+            "timeframe": "next 1-2 hours",
+            "recommendation": recommendation,
+            "riskAlert": risk_alert,
+            "factors": factors,
+        })
+    return out
+
+
+def _predict_trend(
+    series: ReadingSeries, input_data, features: Optional[ReadingFeatures] = None
+) -> TrendPredictionOutput:
+    try:
+        # ------ Statistical trend analysis ------
+        n = len(series.values)
+        annotate(readings=n)
+        if n < 3:
+            raise HTTPException(status_code=400, detail="Need at least 3 readings")
+        features = features or _reading_features(series)
+
+        with span("trend"):
+            result = trend.analyze(
+                series.values, np.array([n]),
+                current=np.array([input_data.currentGlucose]),
+                hour=np.array([series.hour]),
+                last_medication_taken=np.array([series.last_medication_taken]),
+                last_activity=np.array([series.last_activity]),
+                on_medication=np.array([input_data.onMedication]),
+                last_meal_hours=np.array([input_data.lastMealHoursAgo], dtype=np.float64),
+                high_activity=np.array([input_data.activityLevel in trend.HIGH_ACTIVITY_LEVELS]),
+                stats=features.stats,
+            )
+        return TrendPredictionOutput(**_trend_results(result)[0])
 
     except HTTPException:
         raise
     except Exception as e:
+        log_exception("request_failed", error=repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ── OhioT1DM 30-minute glucose forecast ─────────────────────────────────────
 
+ForecastModel = Literal["ohiot1dm", "kalman", "statistical"]
+
+
 class Glucose30Input(BaseModel):
     readings: List[GlucoseReading] = Field(
         ..., min_length=1,
@@ -289,6 +715,21 @@ class Glucose30Input(BaseModel):
     activityLevel: Optional[str] = None
     recentMedications: Optional[List[dict]] = None   # [{medicationType, dosage, doseUnit, hoursSincesTaken}]
     recentMeals: Optional[List[dict]] = None         # [{mealType, carbsEstimate, hoursSinceMeal}]
+    explain: bool = False                            # add the model's feature attributions
+    forecastModel: Optional[ForecastModel] = None    # default: OhioT1DM with the FORECAST_FALLBACK fallback
+
+
+class Glucose30ColumnarInput(ReadingColumns):
+    """Glucose30Input with columnar readings."""
+    currentGlucose: float = Field(..., ge=20, le=600)
+    diabetesType: Optional[str] = None
+    onMedication: bool = False
+    lastMealHoursAgo: Optional[float] = None
+    activityLevel: Optional[str] = None
+    recentMedications: Optional[List[dict]] = None
+    recentMeals: Optional[List[dict]] = None
+    explain: bool = False
+    forecastModel: Optional[ForecastModel] = None
 
 
 class MissingDataAction(BaseModel):
@@ -309,90 +750,112 @@ class Glucose30Output(BaseModel):
     recommendation: str
     riskAlert: Optional[str] = None
     factors: List[str]
-    modelUsed: str          # 'ohiot1dm' | 'statistical'
+    modelUsed: str          # 'ohiot1dm' | 'kalman' | 'statistical'
+    fallbackReason: Optional[str] = None  # why 'statistical' was used, e.g. 'deadline_exceeded'
     suggestions: Optional[List[str]] = None
     missingDataActions: Optional[List[MissingDataAction]] = None  # buttons for missing context
+    explanation: Optional[ModelExplanation] = None  # with `explain` and the model used: mg/dL of its base prediction
+    uncertainty: Optional[float] = None  # kalman: 1 sd (mg/dL) of its base forecast
+    insulinOnBoard: Optional[float] = None  # KINETICS_ENABLED: units still active from the logged doses (kinetics.py)
+    carbsOnBoard: Optional[float] = None    # KINETICS_ENABLED: grams still to be absorbed from the logged meals
 
 
-def _build_ohio_features(readings: List[GlucoseReading], current: float) -> np.ndarray:
+def _build_ohio_features(series: ReadingSeries, features: ReadingFeatures, current: float) -> np.ndarray:
     """
     Build a 26-feature vector compatible with the OhioT1DM model.
     For sparse user data we extrapolate from available readings.
     """
-    values = [r.value for r in readings]
-    n = len(values)
-
-    # Pad to at least 6 values using repetition so lag/diff features work
-    while len(values) < 6:
-        values = [values[0]] + values
-
-    recent = values[-6:]  # use last 6 data points
-
-    # Core lag features (glucose_lag_1 through glucose_lag_6)
-    lags = list(reversed(recent[:6]))  # most-recent first
-
-    # Diff features
-    diffs = [recent[i] - recent[i - 1] for i in range(1, len(recent))]
-    while len(diffs) < 5:
-        diffs = [0.0] + diffs
-
-    # Rolling stats
-    mean_6 = np.mean(recent)
-    std_6 = np.std(recent) if len(set(recent)) > 1 else 0.0
-    min_6 = np.min(recent)
-    max_6 = np.max(recent)
-
-    # Time features from last reading
-    last = readings[-1]
-    hour = last.hour
-    hour_sin = np.sin(2 * np.pi * hour / 24)
-    hour_cos = np.cos(2 * np.pi * hour / 24)
-    dow = last.dayOfWeek
-    dow_sin = np.sin(2 * np.pi * dow / 7)
-    dow_cos = np.cos(2 * np.pi * dow / 7)
-
-    # Rate of change
-    roc = (recent[-1] - recent[0]) / max(len(recent) - 1, 1)
-
-    # Acceleration
-    if len(diffs) >= 2:
-        accel = diffs[-1] - diffs[-2]
-    else:
-        accel = 0.0
-
-    # 26 features in order trained
-    features = (
-        lags[:6]           # 6: glucose_lag_1..6
-        + diffs[:5]        # 5: glucose_diff_1..5
-        + [mean_6, std_6, min_6, max_6]   # 4: rolling stats
-        + [hour_sin, hour_cos, dow_sin, dow_cos]  # 4: time
-        + [roc, accel]     # 2: rate, accel
-        + [current]        # 1: current glucose value (fills any remaining slot)
+    return forecast.ohio_features(
+        features.values, features.counts, np.array([current]),
+        np.array([series.hour]), np.array([series.day_of_week]),
     )
 
-    # Ensure exactly 26 features
-    features = features[:26]
-    while len(features) < 26:
-        features.append(0.0)
 
-    return np.array(features, dtype=float).reshape(1, -1)
+# Attributions below this (mg/dL) are left out of an explanation
+MIN_ATTRIBUTION = 0.05
+EXPLAIN_TOP = 6
 
 
-def _statistical_30min(readings: List[GlucoseReading], current: float) -> float:
-    """Fallback: linear extrapolation for 30 min using available readings."""
-    values = [r.value for r in readings]
-    n = len(values)
-    if n < 2:
-        return current
-    x = np.arange(n, dtype=float)
-    y = np.array(values, dtype=float)
-    slope = np.polyfit(x, y, 1)[0]
-    # Assume ~30 min step
-    return float(current + slope * 0.5)
+def _ohio_30min(
+    series: ReadingSeries, features: ReadingFeatures, current: float, explain: bool = False
+) -> Tuple[float, Optional[ModelExplanation]]:
+    """OhioT1DM model forecast (runs on the inference pool), optionally with its attributions."""
+    with span("ohio_features"):
+        raw_features = _build_ohio_features(series, features, current)
+    with span("model"):
+        scaled = ohio_scaler.transform(raw_features)
+        explanation = None
+        if not explain:
+            predicted = float(ohio_model.predict(scaled)[0])
+        else:
+            # TreeSHAP replaces predict here: the prediction is base + Σ contributions
+            base, contributions = ohio_explainer.explain(scaled)
+            predicted = float(base[0] + contributions[0].sum())
+            explanation = ModelExplanation(
+                base=round(float(base[0]), 2),
+                factors=top_contributions(contributions[0], forecast.OHIO_FEATURE_NAMES, EXPLAIN_TOP, MIN_ATTRIBUTION, 2),
+            )
+    if drift is not None:
+        with span("drift"):
+            drift.observe(raw_features, predicted)
+    return predicted, explanation
+
+
+def _statistical_30min(features: ReadingFeatures, current: float) -> float:
+    """Fallback: linear extrapolation for 30 min from the shared slope."""
+    return float(forecast.extrapolate_30min(np.array([current]), features.stats["slope"])[0])
+
+
+def _kalman_30min(series: ReadingSeries, features: ReadingFeatures) -> Tuple[float, float]:
+    """Kalman filter forecast 30 min past the newest reading, and its sd (mg/dL)."""
+    minutes = None
+    if series.timestamps is not None:
+        minutes = ((series.timestamps - series.timestamps[-1]) / 60_000)[None, :]
+    mean, sd = kalman.forecast(kalman.filter(features.values, minutes, features.counts), 30)
+    return float(mean[0]), float(sd[0])
+
+
+_FALLBACK_LABELS = {"statistical": "Statistical extrapolation", "kalman": "Kalman filter forecast"}
+
+
+# Factor text for each meal / medication phase returned by the forecast core
+_MEAL_FACTORS = {
+    forecast.MEAL_CARBS_RECENT: lambda h, c: f"Recent meal ({int(c)}g carbs, {int(h*60)}min ago) — glucose likely still rising",
+    forecast.MEAL_CARBS_POST: lambda h, c: f"Post-meal window ({int(c)}g carbs, {round(h, 1)}hrs ago)",
+    forecast.MEAL_CARBS_LATE: lambda h, c: f"Late post-meal phase ({round(h, 1)}hrs since {int(c)}g carbs)",
+    forecast.MEAL_RECENT: lambda h, c: "Recent meal logged. Glucose may still be rising",
+    forecast.MEAL_POST: lambda h, c: "Post-meal window (1-2 hrs)",
+}
+
+_MED_LOG_FACTORS = {
+    forecast.MED_PHASE_RAPID_ONSET: lambda d, h: f"Rapid insulin ({d}u, {int(h*60)}min ago) — onset beginning",
+    forecast.MED_PHASE_RAPID_PEAK: lambda d, h: f"Rapid insulin at peak ({d}u, {round(h,1)}hrs ago)",
+    forecast.MED_PHASE_RAPID_WANING: lambda d, h: f"Rapid insulin waning ({d}u, {round(h,1)}hrs ago)",
+    forecast.MED_PHASE_LONG: lambda d, h: f"Long-acting insulin active ({d}u, {round(h,1)}hrs ago)",
+    forecast.MED_PHASE_MIXED_PEAK: lambda d, h: f"Mixed insulin peak ({d}u, {round(h,1)}hrs ago)",
+    forecast.MED_PHASE_MIXED_ACTIVE: lambda d, h: f"Mixed insulin active ({d}u, {round(h,1)}hrs ago)",
+    forecast.MED_PHASE_METFORMIN: lambda d, h: f"Metformin taken {round(h,1)}hrs ago",
+}
+
+_MED_INLINE_FACTORS = {
+    forecast.MED_PHASE_RAPID_ONSET: lambda n, d, h: f"Rapid insulin ({n}, {d}u, just taken) — onset beginning",
+    forecast.MED_PHASE_RAPID_PEAK: lambda n, d, h: f"Rapid insulin ({n}, {d}u, ~{round(h,1)}hrs ago) — peak effect",
+    forecast.MED_PHASE_RAPID_WANING: lambda n, d, h: f"Rapid insulin ({n}, {d}u) — waning effect",
+    forecast.MED_PHASE_LONG: lambda n, d, h: f"Long-acting insulin ({n}, {d}u) — steady effect",
+    forecast.MED_PHASE_MIXED_PEAK: lambda n, d, h: f"Mixed insulin ({n}, {d}u) — peak phase",
+    forecast.MED_PHASE_MIXED_ACTIVE: lambda n, d, h: f"Mixed insulin ({n}, {d}u) — active",
+    forecast.MED_PHASE_METFORMIN: lambda n, d, h: f"Metformin ({n}) taken",
+}
+
+_RISK_ALERTS = {
+    forecast.RISK_LOW: "Glucose may drop below target. Monitor closely and consider a snack if needed",
+    forecast.RISK_VERY_HIGH: "Glucose may remain significantly elevated",
+    forecast.RISK_HIGH: "Glucose may stay above target range",
+}
 
 
 @app.post("/predict-glucose-30", response_model=Glucose30Output)
-def predict_glucose_30(input_data: Glucose30Input):
+def predict_glucose_30(input_data: Glucose30Input, x_latency_budget_ms: Optional[str] = Header(default=None)):
     """
     Predict glucose level 30 minutes from now.
     Uses the OhioT1DM Gradient-Boosting model when available,
@@ -403,88 +866,132 @@ def predict_glucose_30(input_data: Glucose30Input):
     2. Gather ALL context (readings inline meds, MedicationLog, Meal log, time, activity)
     3. Cross-compare factors — never let a single factor dominate
     4. Detect missing data and suggest actions
+
+    The numeric steps run through the vectorized core in forecast.py, the
+    same code backtest.py replays offline.
+
+    The model must answer within the request's latency budget
+    (X-Latency-Budget-Ms, default INFERENCE_BUDGET_MS); otherwise the
+    statistical forecast is returned with fallbackReason set.
     """
+    return FastJSONResponse(_predict_glucose_30(
+        _series_from_readings(input_data.readings), input_data, x_latency_budget_ms
+    ), model=Glucose30Output)
+
+
+@app.post("/predict-glucose-30/columnar", response_model=Glucose30Output)
+def predict_glucose_30_columnar(
+    input_data: Glucose30ColumnarInput, x_latency_budget_ms: Optional[str] = Header(default=None)
+):
+    """/predict-glucose-30 with the readings sent as parallel arrays."""
+    return FastJSONResponse(_predict_glucose_30(input_data.series(), input_data, x_latency_budget_ms),
+                            model=Glucose30Output)
+
+
+def _predict_glucose_30(
+    series: ReadingSeries,
+    input_data,
+    budget_header: Optional[str] = None,
+    features: Optional[ReadingFeatures] = None,
+) -> Glucose30Output:
     try:
-        readings = input_data.readings
+        features = features or _reading_features(series)
         current = input_data.currentGlucose
-        values = [r.value for r in readings]
+        values = series.values
         factors: List[str] = []
         suggestions: List[str] = []
         missing_actions: List[MissingDataAction] = []
 
-        # ── 1. Base prediction from model ──
-        model_used = "statistical"
-        if OHIO_MODEL_LOADED and ohio_model is not None and ohio_scaler is not None:
+        annotate(
+            readings=len(values),
+            meals=len(input_data.recentMeals or []),
+            medications=len(input_data.recentMedications or []),
+        )
+
+        # ── 1. Base prediction from model (within the latency budget) ──
+        requested = input_data.forecastModel or "ohiot1dm"
+        model_used = FORECAST_FALLBACK if requested == "ohiot1dm" else requested
+        fallback_label = _FALLBACK_LABELS[model_used]
+        fallback_reason: Optional[str] = None
+        explanation: Optional[ModelExplanation] = None
+        uncertainty: Optional[float] = None
+        if requested != "ohiot1dm":
+            factors.append(f"{fallback_label} from recent readings")
+        elif OHIO_MODEL_LOADED and ohio_model is not None and ohio_scaler is not None:
+            deadline, budget_ms = request_deadline(budget_header, inference.default_budget_ms)
+            annotate(budgetMs=budget_ms)
             try:
-                raw_features = _build_ohio_features(readings, current)
-                scaled = ohio_scaler.transform(raw_features)
-                predicted = float(ohio_model.predict(scaled)[0])
+                predicted, explanation = inference.run(
+                    profiler.attached(_ohio_30min), series, features, current, input_data.explain, deadline=deadline,
+                )
                 model_used = "ohiot1dm"
+                inference.stats.record_model()
                 factors.append("Prediction from trained OhioT1DM temporal model")
+            except InferenceSkipped as skipped:
+                fallback_reason = skipped.reason
+                log_event("model_fallback", str(skipped), level=logging.WARNING, reason=fallback_reason)
+                factors.append(f"{fallback_label} (model over latency budget)")
             except Exception as model_err:
-                print(f"OhioT1DM prediction failed, falling back: {model_err}")
-                traceback.print_exc()
-                predicted = _statistical_30min(readings, current)
-                factors.append("Statistical extrapolation (model fallback)")
+                log_exception("model_fallback", "OhioT1DM prediction failed, falling back", error=repr(model_err))
+                fallback_reason = f"model_error:{type(model_err).__name__}"
+                factors.append(f"{fallback_label} (model fallback)")
         else:
-            predicted = _statistical_30min(readings, current)
-            factors.append("Statistical extrapolation from recent readings")
+            fallback_reason = "model_not_loaded"
+            factors.append(f"{fallback_label} from recent readings")
+        if fallback_reason is not None:
+            inference.stats.record_fallback(fallback_reason.split(":")[0])
+            annotate(fallbackReason=fallback_reason)
+        if model_used == "kalman":
+            with span("kalman"):
+                predicted, sd = _kalman_30min(series, features)
+            uncertainty = round(sd, 1)
+        elif model_used == "statistical":
+            with span("statistical"):
+                predicted = _statistical_30min(features, current)
+        annotate(modelUsed=model_used, modelVersion=ohio_bundle.version if model_used == "ohiot1dm" else None)
+        context_start = time.perf_counter()
 
         # ── 2. Gather ALL available context ──
-        last_reading = readings[-1]
         n_readings = len(values)
 
         # --- Context flags ---
         has_logged_meal = bool(input_data.recentMeals and len(input_data.recentMeals) > 0)
-        has_meal_in_reading = any(
-            r.readingType == "after_meal" or r.readingType == "before_meal"
-            or (r.mealContext and r.mealContext.strip())
-            for r in readings
-        )
+        has_meal_in_reading = series.meal_context
         has_med_log = bool(input_data.recentMedications and len(input_data.recentMedications) > 0)
-        has_inline_med = any(r.medicationTaken for r in readings)
+        has_inline_med = series.medication_taken
         has_activity = bool(
             input_data.activityLevel in ("high", "frequent", "very_active", "active")
-            or any(r.activityContext and r.activityContext.strip() for r in readings)
+            or series.activity_context
         )
-
-        # Extract inline medication data from the most recent reading that has it
-        inline_med = None
-        for r in reversed(readings):
-            if r.medicationTaken and r.medicationType:
-                inline_med = r
-                break
+        inline_med = series.inline_med
 
         # ── 3. Contextual adjustments (multi-factor, capped per-factor) ──
-        adjustment = 0.0
         factor_count = 0  # Track how many factors contributed
 
         # --- MEAL FACTOR ---
+        # Step rules on the first meal within 3 h, or with KINETICS_ENABLED every
+        # logged meal's carbs along the absorption curve (kinetics.py)
         meal_adjustment = 0.0
+        carbs_on_board = None
         if has_logged_meal and input_data.recentMeals:
-            for meal in input_data.recentMeals:
-                hours = meal.get("hoursSinceMeal", None)
-                carbs = meal.get("carbsEstimate", None)
-                if hours is not None and hours < 3:
-                    if carbs and carbs > 0:
-                        if hours < 0.5:
-                            meal_adjustment = min(carbs * 0.12, 20)
-                            factors.append(f"Recent meal ({int(carbs)}g carbs, {int(hours*60)}min ago) — glucose likely still rising")
-                        elif hours < 1.5:
-                            meal_adjustment = min(carbs * 0.06, 12)
-                            factors.append(f"Post-meal window ({int(carbs)}g carbs, {round(hours, 1)}hrs ago)")
-                        else:
-                            meal_adjustment = 2
-                            factors.append(f"Late post-meal phase ({round(hours, 1)}hrs since {int(carbs)}g carbs)")
-                    else:
-                        if hours < 1:
-                            meal_adjustment = 8
-                            factors.append("Recent meal logged. Glucose may still be rising")
-                        elif hours < 2:
-                            meal_adjustment = 3
-                            factors.append("Post-meal window (1-2 hrs)")
+            meals = [(meal.get("hoursSinceMeal", None), meal.get("carbsEstimate", None))
+                     for meal in input_data.recentMeals]
+            # A meal logged ahead of the device clock was just eaten
+            meals = [(max(hours, 0.0), carbs) for hours, carbs in meals if hours is not None]
+            if meals:
+                meal_hours = np.array([[hours for hours, _ in meals]], dtype=np.float64)
+                meal_carbs = np.array([[np.nan if carbs is None else carbs for _, carbs in meals]], dtype=np.float64)
+                effect, cob, phases = kinetics.meal_adjustment(meal_hours, meal_carbs)
+                for (hours, carbs), phase in zip(meals, phases[0]):
+                    if int(phase) in _MEAL_FACTORS:
+                        factors.append(_MEAL_FACTORS[int(phase)](hours, carbs or 0))
+                meal_adjustment = float(effect[0])
+                if kinetics.ENABLED:
+                    carbs_on_board = round(float(cob[0]), 1)
+                    if carbs_on_board >= 1:
+                        factors.append(f"Carbs on board: ~{int(carbs_on_board)}g still being absorbed")
+                if (phases != forecast.MEAL_NONE).any():
                     factor_count += 1
-                    break
         elif has_meal_in_reading and not has_logged_meal:
             # User said "after meal" in reading but no actual meal logged
             # We KNOW they ate, so apply a generic post-meal rise
@@ -509,100 +1016,47 @@ def predict_glucose_30(input_data: Glucose30Input):
                 factors.append("Extended time since last meal")
                 factor_count += 1
 
-        adjustment += meal_adjustment
-
         # --- MEDICATION/INSULIN FACTOR ---
         # Combine MedicationLog data + inline reading medication data
         med_adjustment = 0.0
         med_factor_applied = False
 
-        # First: use MedicationLog entries (more detailed)
+        # First: use MedicationLog entries (more detailed). Step rules on the
+        # first dose with an effect, or with KINETICS_ENABLED every dose's
+        # insulin along its activity curve (kinetics.py)
+        insulin_on_board = None
         if has_med_log and input_data.recentMedications:
-            for med in input_data.recentMedications:
-                med_type = med.get("medicationType", "")
-                dosage = med.get("dosage", 0)
-                hours = med.get("hoursSincesTaken", None)
-                if hours is None:
-                    continue
-
-                effect = 0.0
-                if med_type == "insulin_rapid":
-                    if hours < 0.25:
-                        effect = min(dosage * 0.2, 6)
-                        factors.append(f"Rapid insulin ({dosage}u, {int(hours*60)}min ago) — onset beginning")
-                    elif hours < 2:
-                        effect = min(dosage * 0.5, 15)
-                        factors.append(f"Rapid insulin at peak ({dosage}u, {round(hours,1)}hrs ago)")
-                    elif hours < 4:
-                        effect = min(dosage * 0.2, 8)
-                        factors.append(f"Rapid insulin waning ({dosage}u, {round(hours,1)}hrs ago)")
-                elif med_type == "insulin_long":
-                    if hours < 24:
-                        effect = min(dosage * 0.1, 6)
-                        factors.append(f"Long-acting insulin active ({dosage}u, {round(hours,1)}hrs ago)")
-                elif med_type == "insulin_mixed":
-                    if hours < 2:
-                        effect = min(dosage * 0.35, 12)
-                        factors.append(f"Mixed insulin peak ({dosage}u, {round(hours,1)}hrs ago)")
-                    elif hours < 6:
-                        effect = min(dosage * 0.15, 6)
-                        factors.append(f"Mixed insulin active ({dosage}u, {round(hours,1)}hrs ago)")
-                elif med_type == "metformin":
-                    if hours < 6:
-                        effect = 3
-                        factors.append(f"Metformin taken {round(hours,1)}hrs ago")
-
-                if effect > 0:
-                    med_adjustment -= effect
+            meds = [(med.get("medicationType", ""), med.get("dosage", 0), med.get("hoursSincesTaken", None))
+                    for med in input_data.recentMedications]
+            meds = [(med_type, dosage or 0, max(hours, 0.0)) for med_type, dosage, hours in meds if hours is not None]
+            if meds:
+                med_codes = np.array([[forecast.MED_TYPE_CODES.get(med_type, forecast.MED_NONE)
+                                       for med_type, _, _ in meds]], dtype=np.int64)
+                med_hours = np.array([[hours for _, _, hours in meds]], dtype=np.float64)
+                dosages = np.array([[dosage for _, dosage, _ in meds]], dtype=np.float64)
+                effect, iob, phases = kinetics.medication_adjustment(med_codes, med_hours, dosages)
+                for (_, dosage, hours), phase in zip(meds, phases[0]):
+                    if int(phase) in _MED_LOG_FACTORS:
+                        factors.append(_MED_LOG_FACTORS[int(phase)](dosage, hours))
+                if kinetics.ENABLED:
+                    insulin_on_board = round(float(iob[0]), 2)
+                    if insulin_on_board >= 0.1:
+                        factors.append(f"Insulin on board: ~{round(insulin_on_board, 1)}u still active")
+                if effect[0] > 0:
+                    med_adjustment = -float(effect[0])
                     med_factor_applied = True
                     factor_count += 1
-                    break  # Use the most impactful recent medication
 
         # Second: if no MedicationLog but inline med data exists on the reading
         if not med_factor_applied and has_inline_med and inline_med:
-            dosage = inline_med.medicationDose or 0
-            med_type = inline_med.medicationType or ""
-            timing = inline_med.medicationTiming or ""
-
-            # Calculate approximate hours since medication based on timing + reading time
-            timing_hours_map = {
-                "just_before": 0.05,
-                "with_reading": 0.0,
-                "30min_before": 0.5,
-                "1hr_before": 1.0,
-                "2hr_before": 2.0,
-                "previous_night": 10.0,
-                "earlier_today": 4.0,
-            }
-            hours_since = timing_hours_map.get(timing, 0.5)
-
-            effect = 0.0
-            if med_type == "insulin_rapid":
-                if hours_since < 0.25:
-                    effect = min(dosage * 0.2, 6)
-                    factors.append(f"Rapid insulin ({inline_med.medicationName}, {dosage}u, just taken) — onset beginning")
-                elif hours_since < 2:
-                    effect = min(dosage * 0.5, 15)
-                    factors.append(f"Rapid insulin ({inline_med.medicationName}, {dosage}u, ~{round(hours_since,1)}hrs ago) — peak effect")
-                elif hours_since < 4:
-                    effect = min(dosage * 0.2, 8)
-                    factors.append(f"Rapid insulin ({inline_med.medicationName}, {dosage}u) — waning effect")
-            elif med_type == "insulin_long":
-                effect = min(dosage * 0.1, 6)
-                factors.append(f"Long-acting insulin ({inline_med.medicationName}, {dosage}u) — steady effect")
-            elif med_type == "insulin_mixed":
-                if hours_since < 2:
-                    effect = min(dosage * 0.35, 12)
-                    factors.append(f"Mixed insulin ({inline_med.medicationName}, {dosage}u) — peak phase")
-                else:
-                    effect = min(dosage * 0.15, 6)
-                    factors.append(f"Mixed insulin ({inline_med.medicationName}, {dosage}u) — active")
-            elif med_type == "metformin":
-                effect = 3
-                factors.append(f"Metformin ({inline_med.medicationName}) taken")
+            med_name, med_code, dosage, hours_since = inline_med
+
+            effect, phase = forecast.medication_effect(med_code, hours_since, dosage, inline=True)
+            if int(phase) in _MED_INLINE_FACTORS:
+                factors.append(_MED_INLINE_FACTORS[int(phase)](med_name, dosage, hours_since))
 
             if effect > 0:
-                med_adjustment -= effect
+                med_adjustment -= float(effect)
                 med_factor_applied = True
                 factor_count += 1
 
@@ -611,69 +1065,47 @@ def predict_glucose_30(input_data: Glucose30Input):
             factors.append("User is on medication (details not logged)")
             factor_count += 1
 
-        adjustment += med_adjustment
+        # --- INTERACTION, TIME-OF-DAY, ACTIVITY, CAPS, ANCHORING, BOUNDS ---
+        # Per-factor cap: each factor can contribute at most ±15 mg/dL
+        # Total cap: ±25 mg/dL or ±12% of current (whichever is smaller)
+        ctx = forecast.apply_context(
+            base=np.array([predicted]),
+            current=np.array([current]),
+            counts=np.array([n_readings]),
+            hour=np.array([series.hour]),
+            meal_adjustment=np.array([meal_adjustment]),
+            med_adjustment=np.array([med_adjustment]),
+            has_activity=np.array([has_activity]),
+        )
 
-        # --- MEAL + INSULIN INTERACTION ---
         # When insulin was taken before a meal, the two factors partially cancel out.
-        # A post-meal rise + active insulin = net effect is more moderate
-        if meal_adjustment > 0 and med_adjustment < 0:
-            # They counteract each other — the model already considers the net,
-            # so reduce the combined magnitude slightly to avoid double-counting
-            interaction_reduction = min(abs(meal_adjustment), abs(med_adjustment)) * 0.3
-            if adjustment > 0:
-                adjustment -= interaction_reduction
-            else:
-                adjustment += interaction_reduction
+        if ctx["interaction"][0]:
             factors.append("Meal + insulin interaction: effects partially offset each other")
 
-        # --- TIME-OF-DAY FACTOR ---
-        if 4 <= last_reading.hour <= 7:
-            adjustment += 4
+        if ctx["time_of_day"][0] == forecast.TOD_DAWN:
             factors.append("Early morning — dawn effect possible")
             factor_count += 1
-        elif 22 <= last_reading.hour or last_reading.hour <= 3:
-            adjustment -= 2
+        elif ctx["time_of_day"][0] == forecast.TOD_NIGHT:
             factors.append("Nighttime — levels tend to stabilize")
             factor_count += 1
 
-        # --- ACTIVITY FACTOR ---
         if has_activity:
-            adjustment -= 4
             factors.append("Physical activity noted — may lower readings")
             factor_count += 1
 
-        # ── 4. CLAMP: prevent unrealistic predictions ──
-        # Per-factor cap: each factor can contribute at most ±15 mg/dL
-        # Total cap: ±25 mg/dL or ±12% of current (whichever is smaller)
-        max_total_adj = min(25, current * 0.12)
-        if abs(adjustment) > max_total_adj:
-            adjustment = max_total_adj if adjustment > 0 else -max_total_adj
-
-        # ── 5. ANCHOR to current glucose (sparse data protection) ──
+        # Sparse data protection: the core anchors few readings to current glucose
         if n_readings == 1:
-            # Single reading: prediction is 70% current, 30% model+adjustment
-            predicted = current * 0.7 + (predicted + adjustment) * 0.3
             factors.append(f"Single reading — prediction heavily anchored to current level ({int(current)} mg/dL)")
         elif n_readings <= 3:
-            predicted = current * 0.5 + (predicted + adjustment) * 0.5
             factors.append(f"Limited data ({n_readings} readings) — prediction anchored to current level")
-        elif n_readings <= 6:
-            predicted = current * 0.25 + (predicted + adjustment) * 0.75
-        else:
-            predicted = predicted + adjustment
 
-        # ── 6. FINAL SAFETY BOUNDS ──
         # Never predict more than 30% away from current within 30 min
-        lower_bound = max(60, current * 0.70)
-        upper_bound = min(400, current * 1.30)
-        if predicted < lower_bound:
-            predicted = lower_bound
-            factors.append(f"Safety floor: prediction clamped (min {int(lower_bound)} mg/dL)")
-        elif predicted > upper_bound:
-            predicted = upper_bound
-            factors.append(f"Safety ceiling: prediction clamped (max {int(upper_bound)} mg/dL)")
+        if ctx["floor_hit"][0]:
+            factors.append(f"Safety floor: prediction clamped (min {int(ctx['lower'][0])} mg/dL)")
+        elif ctx["ceiling_hit"][0]:
+            factors.append(f"Safety ceiling: prediction clamped (max {int(ctx['upper'][0])} mg/dL)")
 
-        predicted = max(55, min(400, predicted))
+        predicted = float(ctx["predicted"][0])
 
         if not factors:
             factors.append("Based on recent glucose trend patterns")
@@ -752,28 +1184,19 @@ def predict_glucose_30(input_data: Glucose30Input):
 
         # Confidence: penalize for fewer readings AND fewer context factors
         n = len(values)
-        base_conf = min(0.40 + (n / 15) * 0.30, 0.80)
-        if model_used == "ohiot1dm":
-            base_conf = min(base_conf + 0.1, 0.90)
-        # Bonus for having more context
-        context_bonus = min(factor_count * 0.03, 0.12)
-        base_conf = min(base_conf + context_bonus, 0.92)
-        cv = np.std(values) / np.mean(values) if np.mean(values) > 0 else 0
+        cv = float(features.stats["cv"][0])
         # Penalize more for missing key data
         missing_penalty = 0.0
         if has_meal_in_reading and not has_logged_meal:
             missing_penalty += 0.05
         if not has_inline_med and not has_med_log and current > 150:
             missing_penalty += 0.05
-        confidence = round(max(0.25, base_conf - min(cv * 0.4, 0.25) - missing_penalty), 2)
+        confidence = round(float(forecast.forecast_confidence(
+            np.array([n]), np.array([cv]), np.array([model_used == "ohiot1dm"]),
+            np.array([factor_count]), np.array([missing_penalty]),
+        )[0]), 2)
 
-        risk_alert = None
-        if predicted < 70:
-            risk_alert = "Glucose may drop below target. Monitor closely and consider a snack if needed"
-        elif predicted > 250:
-            risk_alert = "Glucose may remain significantly elevated"
-        elif predicted > 180:
-            risk_alert = "Glucose may stay above target range"
+        risk_alert = _RISK_ALERTS.get(int(forecast.risk_level(predicted)))
 
         if direction == "rising" and predicted > 180:
             recommendation = "An upward trend is detected. Consider discussing this pattern with your healthcare provider."
@@ -790,6 +1213,7 @@ def predict_glucose_30(input_data: Glucose30Input):
         else:
             recommendation = "Levels appear stable. Continue logging to track patterns."
 
+        add_span("context", context_start)
         return Glucose30Output(
             predictedGlucose=round(predicted, 1),
             direction=direction,
@@ -801,6 +1225,11 @@ def predict_glucose_30(input_data: Glucose30Input):
             riskAlert=risk_alert,
             factors=factors,
             modelUsed=model_used,
+            fallbackReason=fallback_reason,
+            explanation=explanation,
+            uncertainty=uncertainty,
+            insulinOnBoard=insulin_on_board,
+            carbsOnBoard=carbs_on_board,
             suggestions=suggestions if suggestions else None,
             missingDataActions=missing_actions if missing_actions else None,
         )
@@ -808,10 +1237,462 @@ def predict_glucose_30(input_data: Glucose30Input):
     except HTTPException:
         raise
     except Exception as e:
-        traceback.print_exc()
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ── Dashboard: trend + forecast + risk ───────────────────────────────────────
+
+class DashboardInput(Glucose30Input):
+    """Glucose30Input plus the /predict profile, for one dashboard request."""
+    profile: Optional[RiskProfile] = None
+
+
+class DashboardColumnarInput(Glucose30ColumnarInput):
+    """DashboardInput with columnar readings."""
+    profile: Optional[RiskProfile] = None
+
+
+class ReadingStats(BaseModel):
+    slope: float            # mg/dL per reading
+    rateOfChange: float     # over the last 3 readings
+    acceleration: float
+    cv: float
+
+
+class DashboardOutput(BaseModel):
+    trend: Optional[TrendPredictionOutput] = None   # needs 3+ readings
+    forecast: Optional[Glucose30Output] = None
+    risk: Optional[PredictionOutput] = None         # needs `profile` and the Pima model
+    stats: ReadingStats
+    errors: Optional[Dict[str, str]] = None         # part name → why it is null (the other parts still answer)
+
+
+@app.post("/predict-dashboard", response_model=DashboardOutput)
+def predict_dashboard(input_data: DashboardInput, x_latency_budget_ms: Optional[str] = Header(default=None)):
+    """
+    /predict-trend, /predict-glucose-30 and /predict in one round trip. The
+    readings are validated and their statistics computed once, then shared
+    by every model; each part equals what its own endpoint returns. A part
+    that fails is null with its message under `errors`; the request fails
+    only when every requested part does.
+    """
+    return FastJSONResponse(_predict_dashboard(
+        _series_from_readings(input_data.readings), input_data, x_latency_budget_ms
+    ), model=DashboardOutput)
+
+
+@app.post("/predict-dashboard/columnar", response_model=DashboardOutput)
+def predict_dashboard_columnar(
+    input_data: DashboardColumnarInput, x_latency_budget_ms: Optional[str] = Header(default=None)
+):
+    """/predict-dashboard with the readings sent as parallel arrays."""
+    return FastJSONResponse(_predict_dashboard(input_data.series(), input_data, x_latency_budget_ms),
+                            model=DashboardOutput)
+
+
+def _dashboard_part(name: str, errors: Dict[str, str], fn, *args) -> Any:
+    """fn(*args), or None with the failure recorded in `errors[name]` (client errors still propagate)."""
+    try:
+        return fn(*args)
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise
+        errors[name] = str(e.detail)
+    except Exception as e:
+        log_exception("dashboard_part_failed", part=name, error=repr(e))
+        errors[name] = str(e)
+    return None
+
+
+def _dashboard_risk(input_data) -> PredictionOutput:
+    if pima_bundle is None:
+        raise RuntimeError("Risk model not loaded")
+    with span("risk"):
+        return PredictionOutput(**predict_risk(glucose=input_data.currentGlucose,
+                                               explain=input_data.explain,
+                                               **input_data.profile.model_dump()))
+
+
+def _predict_dashboard(series: ReadingSeries, input_data, budget_header: Optional[str]) -> DashboardOutput:
+    try:
+        features = _reading_features(series)
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    errors: Dict[str, str] = {}
+    trend_output = None
+    if len(series.values) >= 3:
+        trend_output = _dashboard_part("trend", errors, _predict_trend, series, input_data, features)
+    forecast_output = _dashboard_part("forecast", errors, _predict_glucose_30,
+                                      series, input_data, budget_header, features)
+    risk = None
+    if input_data.profile is not None:
+        risk = _dashboard_part("risk", errors, _dashboard_risk, input_data)
+
+    if errors and trend_output is None and forecast_output is None and risk is None:
+        raise HTTPException(status_code=500, detail="; ".join(f"{k}: {v}" for k, v in errors.items()))
+    if errors:
+        annotate(failedParts=sorted(errors))
+
+    stats = features.stats
+    return DashboardOutput(
+        trend=trend_output,
+        forecast=forecast_output,
+        risk=risk,
+        errors=errors or None,
+        stats=ReadingStats(
+            slope=float(stats["slope"][0]),
+            rateOfChange=float(stats["rate_of_change"][0]),
+            acceleration=float(stats["acceleration"][0]),
+            cv=float(stats["cv"][0]),
+        ),
+    )
+
+
+# ── Glycemic metrics ─────────────────────────────────────────────────────────
+
+class GlycemicMetricsInput(BaseModel):
+    """
+    Readings of one or more users as flat parallel arrays: `values` (mg/dL)
+    and `timestamps` (epoch milliseconds), grouped by user with `lengths`
+    (one entry per user; omit for a single user). Readings of a user need
+    not be time-ordered. `daily` adds per-day roll-ups, with days split at
+    local midnight (`tzOffsetMinutes` east of UTC).
+    """
+    userIds: Optional[List[str]] = None
+    values: FloatArray = Field(..., min_length=1)
+    timestamps: FloatArray
+    lengths: Optional[IntArray] = None
+    daily: bool = False
+    tzOffsetMinutes: int = Field(default=0, ge=-840, le=840)
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        n = len(self.values)
+        if len(self.timestamps) != n:
+            raise ValueError(f"timestamps has {len(self.timestamps)} entries, expected {n} (one per value)")
+        if not (np.isfinite(self.values).all() and np.isfinite(self.timestamps).all()):
+            raise ValueError("values and timestamps must be finite numbers")
+        if self.lengths is None:
+            self.lengths = np.array([n], dtype=np.int64)
+        if (self.lengths < 1).any() or int(self.lengths.sum()) != n:
+            raise ValueError(f"lengths must be positive and add up to {n}")
+        if self.userIds is not None and len(self.userIds) != len(self.lengths):
+            raise ValueError(f"userIds has {len(self.userIds)} entries, expected {len(self.lengths)} (one per user)")
+        return self
+
+
+class GlycemicRollup(BaseModel):
+    """One user-day of additive sums, as returned by /glycemic-metrics with daily=true."""
+    userId: Optional[str] = None
+    date: Optional[str] = None
+    n: float = Field(..., ge=0)
+    sum: float
+    sumSq: float
+    veryLow: float = 0
+    low: float = 0
+    inRange: float = 0
+    high: float = 0
+    veryHigh: float = 0
+    lbgiSum: float = 0
+    hbgiSum: float = 0
+    hypoEpisodes: float = 0
+    severeHypoEpisodes: float = 0
+    mageSum: float = 0
+    mageCount: float = 0
+
+
+class GlycemicRollupInput(BaseModel):
+    """Stored daily roll-ups to combine, grouped by userId (rows without one form a single group)."""
+    rollups: List[GlycemicRollup] = Field(..., min_length=1)
+
+
+def _camel(name: str) -> str:
+    head, *rest = name.split("_")
+    return head + "".join(part.title() for part in rest)
+
+
+def _metric_rows(metrics: dict) -> List[dict]:
+    """Per-user metric dicts (camelCase keys, 3 decimals, None for NaN)."""
+    columns = {
+        _camel(k): (v.tolist() if v.dtype.kind == "i" else np.where(np.isnan(v), np.nan, np.round(v, 3)).tolist())
+        for k, v in metrics.items()
+    }
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    for row in rows:
+        for key, value in row.items():
+            if value != value:  # NaN
+                row[key] = None
+    return rows
+
+
+@app.post("/glycemic-metrics")
+def glycemic_metrics(input_data: GlycemicMetricsInput):
+    """
+    TIR bands, GMI, mean/SD/CV, MAGE, LBGI/HBGI and hypo-episode counts for
+    one or many users' reading histories (see glycemic.py). With daily=true
+    each user also gets per-day roll-ups that /glycemic-metrics/rollup can
+    combine later without the raw readings.
+    """
+    try:
+        lengths = input_data.lengths
+        minutes = input_data.timestamps / 60_000.0
+        annotate(users=len(lengths), readings=len(input_data.values))
+        with span("metrics"):
+            values, minutes = glycemic.sort_batch(input_data.values, minutes, lengths)
+            metrics = glycemic.metrics_from_sums(glycemic.segment_sums(values, minutes, lengths))
+            result: dict = {"userIds": input_data.userIds, "metrics": _metric_rows(metrics)}
+            if input_data.daily:
+                user, day, sums = glycemic.daily_rollups(values, minutes, lengths, input_data.tzOffsetMinutes)
+                dates = np.datetime_as_string(day.astype("datetime64[D]")).tolist()
+                fields = {_camel(k): sums[k].tolist() for k in glycemic.SUM_FIELDS}
+                days: List[List[dict]] = [[] for _ in range(len(lengths))]
+                for i, (u, date) in enumerate(zip(user.tolist(), dates)):
+                    days[u].append({"date": date, **{k: col[i] for k, col in fields.items()}})
+                result["daily"] = days
+        return FastJSONResponse(result)
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/glycemic-metrics/rollup")
+def glycemic_metrics_rollup(input_data: GlycemicRollupInput):
+    """Metrics over any set of stored daily roll-ups (e.g. the last 30 days), per userId."""
+    try:
+        user_ids = list(dict.fromkeys(r.userId for r in input_data.rollups))
+        index = {uid: i for i, uid in enumerate(user_ids)}
+        group = np.fromiter((index[r.userId] for r in input_data.rollups), dtype=np.int64,
+                            count=len(input_data.rollups))
+        sums = {
+            k: np.fromiter((getattr(r, _camel(k)) for r in input_data.rollups), dtype=np.float64,
+                           count=len(input_data.rollups))
+            for k in glycemic.SUM_FIELDS
+        }
+        annotate(users=len(user_ids), rollups=len(input_data.rollups))
+        with span("metrics"):
+            metrics = glycemic.metrics_from_sums(glycemic.combine_rollups(sums, group, len(user_ids)))
+        return FastJSONResponse({"userIds": user_ids, "metrics": _metric_rows(metrics)})
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ── Early-warning scanner ────────────────────────────────────────────────────
+
+def require_scanner():
+    """Scanner endpoints exist only while the scanner runs (SCANNER_ENABLED)."""
+    if not scanner.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+class ScannerReadingsInput(BaseModel):
+    """
+    New readings of one or more users, grouped like /glycemic-metrics:
+    `userIds` and optional `tzOffsetMinutes` one per user, `lengths` readings
+    per user, then flat `values` (mg/dL) and `timestamps` (epoch ms).
+    """
+    userIds: List[str] = Field(..., min_length=1)
+    lengths: Optional[IntArray] = None
+    values: FloatArray = Field(..., min_length=1)
+    timestamps: FloatArray
+    tzOffsetMinutes: Optional[IntArray] = None
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        n = len(self.values)
+        if len(self.timestamps) != n:
+            raise ValueError(f"timestamps has {len(self.timestamps)} entries, expected {n} (one per value)")
+        if not (np.isfinite(self.values).all() and np.isfinite(self.timestamps).all()):
+            raise ValueError("values and timestamps must be finite numbers")
+        if self.lengths is None:
+            self.lengths = np.array([n], dtype=np.int64)
+        if (self.lengths < 1).any() or int(self.lengths.sum()) != n:
+            raise ValueError(f"lengths must be positive and add up to {n}")
+        if len(self.userIds) != len(self.lengths):
+            raise ValueError(f"userIds has {len(self.userIds)} entries, expected {len(self.lengths)} (one per user)")
+        if self.tzOffsetMinutes is not None and len(self.tzOffsetMinutes) != len(self.lengths):
+            raise ValueError(f"tzOffsetMinutes has {len(self.tzOffsetMinutes)} entries, expected {len(self.lengths)}")
+        return self
+
+
+@app.post("/scanner/readings", dependencies=[Depends(require_scanner)])
+def scanner_readings(input_data: ScannerReadingsInput):
+    """Add readings to the scanner's per-user buffers (older or duplicate readings are ignored)."""
+    try:
+        lengths = input_data.lengths
+        annotate(users=len(lengths), readings=len(input_data.values))
+        with span("ingest"):
+            stored = scanner.store.ingest(
+                np.repeat(np.array(input_data.userIds, dtype=object), lengths),
+                input_data.values,
+                input_data.timestamps.astype(np.int64),
+                None if input_data.tzOffsetMinutes is None else np.repeat(input_data.tzOffsetMinutes, lengths),
+            )
+        return {"stored": stored, "trackedUsers": len(scanner.store)}
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/scanner/alerts", dependencies=[Depends(require_scanner)])
+def scanner_alerts(limit: int = Query(default=500, ge=1, le=10_000)):
+    """Remove and return up to `limit` queued alerts, oldest first."""
+    alerts = scanner.drain(limit)
+    return FastJSONResponse({"alerts": [a.to_dict() for a in alerts], "remaining": scanner.alerts.qsize()})
+
+
+@app.get("/scanner/status", dependencies=[Depends(require_scanner)])
+def scanner_status():
+    """Scanner settings, tracked users and cycle latency metrics."""
+    return scanner.status()
+
+
+# ── Drift monitoring ─────────────────────────────────────────────────────────
+
+def _drift_summary() -> dict:
+    if drift is None:
+        return {"enabled": False}
+    scores = drift.scores()
+    return {"enabled": True, **{k: scores[k] for k in ("level", "maxFeature", "maxFeaturePsi", "observed",
+                                                       "referenceStale")}}
+
+
+@app.get("/drift")
+def drift_scores():
+    """PSI of each OhioT1DM feature, the model's predictions and forecast residuals vs the training reference."""
+    if drift is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return drift.scores()
+
+
+# ── Forecast accuracy ────────────────────────────────────────────────────────
+
+class AccuracyOutcomesInput(BaseModel):
+    """
+    Realized readings for earlier 30-minute forecasts, grouped like
+    /scanner/readings: `userIds` one per user, `lengths` pairs per user,
+    then flat `predicted` / `actual` (mg/dL), optional `timestamps` (epoch ms
+    of the realized reading) and `modelUsed` (the forecast's modelUsed).
+    """
+    userIds: List[str] = Field(..., min_length=1)
+    lengths: Optional[IntArray] = None
+    predicted: FloatArray = Field(..., min_length=1)
+    actual: FloatArray
+    timestamps: Optional[FloatArray] = None
+    modelUsed: Optional[List[str]] = None
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        n = len(self.predicted)
+        for name in ("actual", "timestamps", "modelUsed"):
+            column = getattr(self, name)
+            if column is not None and len(column) != n:
+                raise ValueError(f"{name} has {len(column)} entries, expected {n} (one per forecast)")
+        if not (np.isfinite(self.predicted).all() and np.isfinite(self.actual).all()):
+            raise ValueError("predicted and actual must be finite numbers")
+        if self.timestamps is not None and not np.isfinite(self.timestamps).all():
+            raise ValueError("timestamps must be finite numbers")
+        if self.lengths is None:
+            self.lengths = np.array([n], dtype=np.int64)
+        if (self.lengths < 1).any() or int(self.lengths.sum()) != n:
+            raise ValueError(f"lengths must be positive and add up to {n}")
+        if len(self.userIds) != len(self.lengths):
+            raise ValueError(f"userIds has {len(self.userIds)} entries, expected {len(self.lengths)} (one per user)")
+        return self
+
+
+@app.post("/accuracy/outcomes")
+def accuracy_outcomes(input_data: AccuracyOutcomesInput):
+    """Fold realized readings into the accuracy aggregates (and model residuals into the drift monitor)."""
+    try:
+        lengths = input_data.lengths
+        annotate(users=len(lengths), forecasts=len(input_data.predicted))
+        with span("aggregate"):
+            recorded = accuracy.record(
+                np.repeat(np.array(input_data.userIds, dtype=object), lengths),
+                input_data.predicted,
+                input_data.actual,
+                input_data.timestamps,
+                input_data.modelUsed,
+            )
+        if drift is not None:
+            residuals = input_data.actual - input_data.predicted
+            if input_data.modelUsed is not None:
+                residuals = residuals[np.array(input_data.modelUsed) == "ohiot1dm"]
+            with span("drift"):
+                drift.observe_residuals(residuals)
+        return {"recorded": recorded, "trackedUsers": len(accuracy.users)}
+    except Exception as e:
+        log_exception("request_failed", error=repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/accuracy")
+def accuracy_summary():
+    """Forecast MAE, bias and hit rate overall and per model, all-time and recent."""
+    return accuracy.summary()
+
+
+@app.get("/accuracy/users/{user_id}")
+def accuracy_user(user_id: str):
+    """One user's forecast accuracy."""
+    result = accuracy.user_summary(user_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No outcomes recorded for this user")
+    return {"userId": user_id, **result}
+
+
+# ── Admin: sampling profiler ─────────────────────────────────────────────────
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Admin endpoints exist only when ADMIN_TOKEN is set, and need it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+class ProfilerControl(BaseModel):
+    enabled: Optional[bool] = None
+    sampleRate: Optional[float] = Field(default=None, ge=0, le=1)
+    intervalMs: Optional[float] = Field(default=None, gt=0, le=1000)
+    reset: bool = False
+
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+def profiler_status(top: int = Query(default=20, ge=1, le=500)):
+    """Profiler settings, counters and the `top` hottest frames."""
+    return {**profiler.status(), "top": profiler.top(top)}
+
+
+@app.post("/admin/profiler", dependencies=[Depends(require_admin)])
+def profiler_control(control: ProfilerControl):
+    """Enable/disable the profiler, change its sample rate or interval, or clear it."""
+    profiler.configure(
+        sample_rate=control.sampleRate,
+        interval=control.intervalMs / 1000 if control.intervalMs is not None else None,
+    )
+    if control.reset:
+        profiler.reset()
+    if control.enabled is True:
+        profiler.start()
+    elif control.enabled is False:
+        profiler.stop()
+    return profiler.status()
+
+
+@app.get("/admin/profiler/dump", dependencies=[Depends(require_admin)])
+def profiler_dump():
+    """Collapsed-stack profile (flamegraph.pl / speedscope input) as a download."""
+    filename = time.strftime("bluely-profile-%Y%m%dT%H%M%SZ.folded", time.gmtime())
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -8,8 +8,9 @@ Usage:
     python train.py
 
 Output:
-    models/glucose_model.joblib   — serialized Random Forest model
-    models/logistic_model.joblib  — serialized Logistic Regression model (baseline)
+    models/pima_risk.bundle  — model bundle (see model_bundle.py) holding the
+                               Random Forest, the Logistic Regression baseline
+                               and the feature scaler
 """
 
 import os
@@ -27,7 +28,11 @@ from sklearn.metrics import (
     confusion_matrix,
 )
 from sklearn.preprocessing import StandardScaler
-import joblib
+import sklearn
+
+from model_bundle import write_bundle, PIMA_BUNDLE_PATH
+from pipeline import file_digest
+from predict import PIMA_ZERO_AS_MISSING, clean_pima_frame
 
 # ── 1. Load dataset ──────────────────────────────────────────────────────────
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'diabetes.csv')
@@ -40,14 +45,12 @@ print(f"\nClass distribution:\n{df['Outcome'].value_counts()}\n")
 
 # ── 2. Clean missing values ─────────────────────────────────────────────────
 # In the Pima dataset, 0 values in these columns are physiologically impossible
-# and represent missing data. Replace with NaN then impute with median.
-cols_with_zeros = ['Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI']
-df[cols_with_zeros] = df[cols_with_zeros].replace(0, np.nan)
-
+# and represent missing data. Replace with NaN then impute with median
+# (predict.clean_pima_frame, shared with the tools that score this data).
 print("Missing values after cleaning zeros:")
-print(df[cols_with_zeros].isnull().sum())
+print((df[PIMA_ZERO_AS_MISSING] == 0).sum())
 
-df.fillna(df.median(numeric_only=True), inplace=True)
+clean_pima_frame(df)
 print("\nMissing values after imputation:")
 print(df.isnull().sum().sum(), "total\n")
 
@@ -125,18 +128,35 @@ print(f"{'Recall':<20} {recall_score(y_test, lr_pred):>15.4f} {recall_score(y_te
 print(f"{'F1-Score':<20} {f1_score(y_test, lr_pred):>15.4f} {f1_score(y_test, rf_pred):>15.4f}")
 print(f"{'CV Accuracy':<20} {lr_cv.mean():>15.4f} {rf_cv.mean():>15.4f}")
 
-# ── 8. Save models ──────────────────────────────────────────────────────────
-os.makedirs(os.path.join(os.path.dirname(__file__), 'models'), exist_ok=True)
-
-model_path = os.path.join(os.path.dirname(__file__), 'models', 'glucose_model.joblib')
-scaler_path = os.path.join(os.path.dirname(__file__), 'models', 'scaler.joblib')
-lr_path = os.path.join(os.path.dirname(__file__), 'models', 'logistic_model.joblib')
-
-joblib.dump(rf_model, model_path)
-joblib.dump(scaler, scaler_path)
-joblib.dump(lr_model, lr_path)
+# ── 8. Save model bundle ────────────────────────────────────────────────────
+# One file ties the scaler to the models it was fitted with.
+def _metrics(pred):
+    return {
+        'accuracy': float(accuracy_score(y_test, pred)),
+        'precision': float(precision_score(y_test, pred)),
+        'recall': float(recall_score(y_test, pred)),
+        'f1': float(f1_score(y_test, pred)),
+    }
+
+header = write_bundle(
+    PIMA_BUNDLE_PATH,
+    {'rf': rf_model, 'logistic': lr_model, 'scaler': scaler},
+    feature_names=feature_names,
+    metadata={
+        'model': 'pima_risk',
+        'dataset_sha256': file_digest(DATA_PATH),
+        'n_train': int(X_train.shape[0]),
+        'n_test': int(X_test.shape[0]),
+        'rf_params': rf_model.get_params(),
+        'metrics': {
+            'rf': dict(_metrics(rf_pred), cv_accuracy=float(rf_cv.mean())),
+            'logistic': dict(_metrics(lr_pred), cv_accuracy=float(lr_cv.mean())),
+        },
+        'sklearn_version': sklearn.__version__,
+    },
+)
 
-print(f"\n Random Forest model saved to: {model_path}")
-print(f" Scaler saved to:              {scaler_path}")
-print(f" Logistic Regression saved to:  {lr_path}")
+print(f"\n Model bundle saved to: {PIMA_BUNDLE_PATH}")
+print(f" Version:  {header['metadata']['version']}")
+print(f" Checksum: {header['checksum']}")
 print("\nTraining complete!")
@@ -8,6 +8,17 @@ meal/bolus/exercise/sleep context, and physiological signals.
 Complements the Pima-based risk classifier (train.py) by adding a
 temporal, patient-aware prediction capability.
 
+Training runs as explicit stages — parse → features → scale → fit →
+evaluate — and each stage stores its output in `cache/` under a hash of
+its inputs and parameters (see pipeline.py). Re-running with a changed
+hyperparameter only re-runs the fit and evaluate stages; evaluation reuses
+the cached per-patient test matrices.
+
+With --dataset, features come from a sharded dataset built once by
+dataset.py: the scaler and the test evaluation stream its memory-mapped
+float32 shards, and only the training matrix handed to the GBR is held in
+memory (--max-train-rows samples it down for corpora larger than RAM).
+
 Dataset citation:
     Marling C, Bunescu R. The OhioT1DM Dataset for Blood Glucose Level
     Prediction: Update 2020. CEUR Workshop Proc. 2020;2675:71-74.
@@ -15,168 +26,545 @@ Dataset citation:
 
 Usage:
     python train_ohio.py
+    python train_ohio.py --set n_estimators=300 --set learning_rate=0.05
+    python train_ohio.py --no-cache
+    python train_ohio.py --dataset datasets/ohio   # shards from dataset.py
+    python train_ohio.py --families iob,stress     # optional feature families
+    python train_ohio.py --output /tmp/ohio.bundle # write elsewhere
 
 Output:
-    models/ohio_glucose_predictor.joblib  — trained GBR model
-    models/ohio_scaler.joblib             — feature scaler
+    models/ohio_glucose.bundle  — model bundle (see model_bundle.py) holding
+                                  the GBR, its feature scaler, the feature
+                                  spec and training metrics
+    models/ohio_glucose.families.bundle — the same, for a model trained with
+                                  feature families (never served; --output
+                                  may not point at the served bundle)
+    models/ohio_glucose.drift.json — reference sketch of the serving
+                                  features and predictions on the training
+                                  split, for the server's drift monitor
+                                  (drift.py)
 """
 
+import argparse
 import os
 import sys
+from typing import Any, Dict, List, Optional, Tuple
+
 import numpy as np
-import pandas as pd
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-import joblib
+import sklearn
+
+from model_bundle import write_bundle, OHIO_BUNDLE_PATH, OHIO_FAMILIES_BUNDLE_PATH
+import drift
+from parse_ohio import (
+    load_patient_xml, build_temporal_features, temporal_feature_names, required_sections, DATA_DIR, PATIENT_IDS,
+)
+from dataset import ShardedDataset
+from pipeline import StageCache, file_digest
+
+# Bump when parse_ohio / build_temporal_features change output for the same
+# input, so stale cached artifacts are not reused.
+PARSER_VERSION = 1
+FEATURES_VERSION = 1
+
+FEATURE_PARAMS: Dict[str, Any] = {
+    "prediction_horizon": 6,  # 6 x 5min = 30 minutes ahead
+    "lookback": 12,  # 12 x 5min = 60 minutes history
+}
+
+GBR_PARAMS: Dict[str, Any] = {
+    "n_estimators": 200,
+    "max_depth": 6,
+    "learning_rate": 0.1,
+    "min_samples_split": 10,
+    "min_samples_leaf": 5,
+    "subsample": 0.8,
+    "random_state": 42,
+    "loss": "squared_error",
+}
+
+SPLITS = ("training", "testing")
+
+
+# ── Stages ──────────────────────────────────────────────────────────────────
+
+def patient_path(patient_id: int, split: str) -> str:
+    return os.path.join(DATA_DIR, f"{patient_id}-ws-{split}.xml")
+
+
+def parse_key(cache: StageCache, path: str, sections: List[str]) -> str:
+    """Parse-stage key: the XML file's content hash, the parser version and the parsed sections."""
+    return cache.key("parse", {"version": PARSER_VERSION, "sections": sections}, [file_digest(path)])
+
+
+def parse_stage(cache: StageCache, path: str, key: str, sections: List[str]) -> Dict:
+    """Parse the given sections of one patient XML file into DataFrames."""
+    return cache.run("parse", key, lambda: load_patient_xml(path, sections=sections))
+
+
+def feature_key(cache: StageCache, parsed_key: str, feature_params: Dict[str, Any]) -> str:
+    return cache.key("features", dict(feature_params, version=FEATURES_VERSION), [parsed_key])
+
+
+def feature_stage(
+    cache: StageCache, key: str, data: Optional[Dict], feature_params: Dict[str, Any]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build (X, y) for one parsed patient file. `data` may be None when the
+    features are already cached — parsing is then skipped entirely.
+    """
+
+    def compute():
+        X, y = build_temporal_features(
+            glucose_df=data["glucose"],
+            meal_df=data["meal"],
+            bolus_df=data["bolus"],
+            exercise_df=data["exercise"],
+            sleep_df=data["sleep"],
+            heart_rate_df=data["heart_rate"],
+            steps_df=data["steps"],
+            context=data,
+            **feature_params,
+        )
+        return np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    return cache.run("features", key, compute)
+
+
+def scale_stage(
+    cache: StageCache, train_keys: List[str], X_train: np.ndarray
+) -> Tuple[str, StandardScaler]:
+    """Fit the feature scaler on the stacked training matrices."""
+    key = cache.key("scale", {}, train_keys)
+    return key, cache.run("scale", key, lambda: StandardScaler().fit(X_train))
+
+
+def fit_stage(
+    cache: StageCache,
+    scale_key: str,
+    train_keys: List[str],
+    X_train_scaled: np.ndarray,
+    y_train: np.ndarray,
+    gbr_params: Dict[str, Any],
+) -> Tuple[str, GradientBoostingRegressor]:
+    """Fit the Gradient Boosting Regressor on scaled training features."""
+    key = cache.key("fit", gbr_params, [scale_key] + train_keys)
+
+    def compute():
+        model = GradientBoostingRegressor(**gbr_params)
+        model.fit(X_train_scaled, y_train)
+        return model
+
+    return key, cache.run("fit", key, compute)
+
+
+def evaluate_stage(
+    cache: StageCache,
+    fit_key: str,
+    train_keys: List[str],
+    test_keys: List[str],
+    model: GradientBoostingRegressor,
+    scaler: StandardScaler,
+    X_train_scaled: np.ndarray,
+    y_train: np.ndarray,
+    test_sets: Dict[int, Tuple[np.ndarray, np.ndarray]],
+) -> Dict[str, Any]:
+    """
+    Evaluate on the stacked test set and per patient. Per-patient metrics are
+    slices of the single test prediction, so no test matrix is rebuilt.
+    """
+    key = cache.key("evaluate", {}, [fit_key] + train_keys + test_keys)
+
+    def compute():
+        y_pred_train = model.predict(X_train_scaled)
+        pids = list(test_sets)
+        X_test = np.vstack([test_sets[p][0] for p in pids])
+        y_test = np.concatenate([test_sets[p][1] for p in pids])
+        y_pred_test = model.predict(scaler.transform(X_test))
+
+        per_patient = {}
+        offset = 0
+        for pid in pids:
+            n = len(test_sets[pid][1])
+            per_patient[pid] = {
+                "mae": float(mean_absolute_error(y_test[offset:offset + n], y_pred_test[offset:offset + n])),
+                "samples": n,
+            }
+            offset += n
+
+        errors = np.abs(y_pred_test - y_test)
+        return {
+            "train": {
+                "mae": float(mean_absolute_error(y_train, y_pred_train)),
+                "rmse": float(np.sqrt(mean_squared_error(y_train, y_pred_train))),
+                "r2": float(r2_score(y_train, y_pred_train)),
+            },
+            "test": {
+                "mae": float(errors.mean()),
+                "rmse": float(np.sqrt(mean_squared_error(y_test, y_pred_test))),
+                "r2": float(r2_score(y_test, y_pred_test)),
+                "within_20": float(np.mean(errors <= 20) * 100),
+                "within_40": float(np.mean(errors <= 40) * 100),
+            },
+            "per_patient": per_patient,
+        }
+
+    return cache.run("evaluate", key, compute)
+
+
+def build_feature_sets(
+    cache: StageCache, feature_params: Dict[str, Any], verbose: bool = True
+) -> Dict[str, Dict[int, Tuple[str, np.ndarray, np.ndarray]]]:
+    """
+    Run the parse and feature stages for every available patient file.
+
+    Returns:
+        {split: {patient_id: (feature_key, X, y)}}
+    """
+    sets: Dict[str, Dict[int, Tuple[str, np.ndarray, np.ndarray]]] = {s: {} for s in SPLITS}
+    sections = required_sections(feature_params.get("families"))
+    for pid in PATIENT_IDS:
+        for split in SPLITS:
+            path = patient_path(pid, split)
+            if not os.path.exists(path):
+                if verbose:
+                    print(f"  Patient {pid} {split}: SKIPPED (missing {os.path.basename(path)})")
+                continue
+
+            # Resolve the feature key from the file hash first so a cached
+            # feature matrix never forces the XML to be parsed again.
+            p_key = parse_key(cache, path, sections)
+            f_key = feature_key(cache, p_key, feature_params)
+            data = None if cache.has("features", f_key) else parse_stage(cache, path, p_key, sections)
+
+            X, y = feature_stage(cache, f_key, data, feature_params)
+            if len(X) > 0:
+                sets[split][pid] = (f_key, X, y)
+                if verbose:
+                    print(f"  Patient {pid} {split[:5]}: {X.shape[0]} samples")
+    return sets
+
+
+def stream_scaler(dataset: ShardedDataset, split: str = "training") -> StandardScaler:
+    """Fit the feature scaler with partial_fit over memory-mapped shard slices."""
+    scaler = StandardScaler()
+    for _, X, _ in dataset.iter_batches(split):
+        scaler.partial_fit(X)
+    return scaler
+
+
+def stream_evaluate(
+    dataset: ShardedDataset,
+    model: GradientBoostingRegressor,
+    scaler: StandardScaler,
+    split: str = "testing",
+) -> Tuple[Dict[str, float], Dict[Any, Dict[str, Any]]]:
+    """
+    Test metrics accumulated slice by slice (running sums), so the test set
+    is never held in memory. Same keys as evaluate_stage's "test" block.
+    """
+    n = abs_sum = sq_sum = y_sum = y_sq_sum = within_20 = within_40 = 0.0
+    per_patient: Dict[Any, Dict[str, Any]] = {}
+    for patient, X, y in dataset.iter_batches(split):
+        y = np.asarray(y, dtype=np.float64)
+        errors = np.abs(model.predict(scaler.transform(X)) - y)
+        n += len(y)
+        abs_sum += errors.sum()
+        sq_sum += (errors ** 2).sum()
+        y_sum += y.sum()
+        y_sq_sum += (y ** 2).sum()
+        within_20 += (errors <= 20).sum()
+        within_40 += (errors <= 40).sum()
+        entry = per_patient.setdefault(patient["id"], {"abs": 0.0, "samples": 0})
+        entry["abs"] += float(errors.sum())
+        entry["samples"] += len(y)
+
+    total_ss = y_sq_sum - y_sum ** 2 / n
+    test = {
+        "mae": float(abs_sum / n),
+        "rmse": float(np.sqrt(sq_sum / n)),
+        "r2": float(1 - sq_sum / total_ss) if total_ss > 0 else 0.0,
+        "within_20": float(within_20 / n * 100),
+        "within_40": float(within_40 / n * 100),
+    }
+    return test, {pid: {"mae": e["abs"] / e["samples"], "samples": e["samples"]} for pid, e in per_patient.items()}
+
+
+def print_metrics(metrics: Dict[str, Any]) -> None:
+    print("\n=== Training Set ===")
+    print(f"  MAE:  {metrics['train']['mae']:.2f} mg/dL")
+    print(f"  RMSE: {metrics['train']['rmse']:.2f} mg/dL")
+    print(f"  R²:   {metrics['train']['r2']:.4f}")
+
+    print("\n=== Test Set ===")
+    print(f"  MAE:  {metrics['test']['mae']:.2f} mg/dL")
+    print(f"  RMSE: {metrics['test']['rmse']:.2f} mg/dL")
+    print(f"  R²:   {metrics['test']['r2']:.4f}")
+
+    # Clarke Error Grid zones (simplified)
+    print(f"\n  Within ±20 mg/dL: {metrics['test']['within_20']:.1f}%")
+    print(f"  Within ±40 mg/dL: {metrics['test']['within_40']:.1f}%")
 
-from parse_ohio import load_all_patients, build_temporal_features, PATIENT_IDS
+    # Per-patient evaluation
+    print("\n=== Per-Patient Test MAE ===")
+    for pid, m in metrics["per_patient"].items():
+        print(f"  Patient {pid}: MAE = {m['mae']:.2f} mg/dL ({m['samples']} samples)")
+
+
+def save_model(
+    bundle_path: str,
+    model: GradientBoostingRegressor,
+    scaler: StandardScaler,
+    feature_params: Dict[str, Any],
+    metrics: Dict[str, Any],
+    **metadata: Any,
+) -> Dict[str, Any]:
+    """Write the GBR + scaler bundle. Returns the bundle header."""
+    return write_bundle(
+        bundle_path,
+        {"gbr": model, "scaler": scaler},
+        feature_names=temporal_feature_names(feature_params["lookback"], feature_params.get("families")),
+        metadata={
+            "model": "ohio_glucose",
+            "feature_params": feature_params,
+            **metadata,
+            "metrics": {"train": metrics["train"], "test": metrics["test"]},
+            "sklearn_version": sklearn.__version__,
+        },
+    )
+
+
+def resolve_bundle_path(bundle_path: Optional[str], feature_params: Dict[str, Any]) -> str:
+    """
+    Where to write the bundle: the served path by default, or
+    OHIO_FAMILIES_BUNDLE_PATH for feature families. Writing a families
+    bundle over the served one is refused, since the server would reject it
+    and fall back to the statistical forecast.
+    """
+    families = feature_params.get("families")
+    if bundle_path is None:
+        return OHIO_FAMILIES_BUNDLE_PATH if families else OHIO_BUNDLE_PATH
+    if families and os.path.abspath(bundle_path) == os.path.abspath(OHIO_BUNDLE_PATH):
+        print(f"ERROR: A bundle with feature families {families} cannot replace the served "
+              f"{OHIO_BUNDLE_PATH}; choose another --output")
+        sys.exit(1)
+    return bundle_path
+
+
+def save_drift_reference(bundle_path: str, model, scaler, header: Dict[str, Any]) -> None:
+    """
+    Replay the training split through the serving pipeline and save the
+    drift reference next to the bundle. Bundles with feature families are
+    never served, so they get none.
+    """
+    if header["metadata"]["feature_params"].get("families"):
+        return
+    path = drift.write_reference(bundle_path, model, scaler, header["metadata"]["version"])
+    if path is None:
+        print("  ⚠ No training readings to build a drift reference from")
+        return
+    print(f"\n✓ Drift reference saved: {path}")
+
+
+def print_summary(bundle_path: str, header: Dict[str, Any], metrics: Dict[str, Any]) -> None:
+    print(f"\n✓ Model bundle saved: {bundle_path}")
+    print(f"  Version:  {header['metadata']['version']}")
+    print(f"  Checksum: {header['checksum']}")
+    print(f"\n{'=' * 60}")
+    print(f"Training complete! Test MAE: {metrics['test']['mae']:.2f} mg/dL, R²: {metrics['test']['r2']:.4f}")
+    print(f"{'=' * 60}")
 
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
-os.makedirs(MODEL_DIR, exist_ok=True)
 
+# ── Orchestration ───────────────────────────────────────────────────────────
+
+def train(
+    gbr_params: Optional[Dict[str, Any]] = None,
+    feature_params: Optional[Dict[str, Any]] = None,
+    cache: Optional[StageCache] = None,
+    bundle_path: Optional[str] = None,
+):
+    gbr_params = dict(GBR_PARAMS, **(gbr_params or {}))
+    feature_params = dict(FEATURE_PARAMS, **(feature_params or {}))
+    bundle_path = resolve_bundle_path(bundle_path, feature_params)
+    cache = cache or StageCache()
 
-def train():
     print("=" * 60)
     print("OhioT1DM Temporal Glucose Prediction — Training")
     print("=" * 60)
 
-    # ── 1. Load all patients ───────────────────────────────────────────────
-    print("\n[1/5] Loading patient data ...")
-    all_data = load_all_patients()
+    # ── 1-2. Parse + build features ────────────────────────────────────────
+    print("\n[1/5] Loading patient data + [2/5] building temporal features ...")
+    sets = build_feature_sets(cache, feature_params)
 
-    if not all_data:
+    if not sets["training"] or not sets["testing"]:
         print("ERROR: No patient data found. Ensure XML files are in data/ohiot1dm/")
         sys.exit(1)
 
-    # ── 2. Build features ─────────────────────────────────────────────────
-    print("\n[2/5] Building temporal features ...")
-    train_X_all, train_y_all = [], []
-    test_X_all, test_y_all = [], []
-
-    for pid in PATIENT_IDS:
-        if pid not in all_data:
-            continue
-
-        train_data, test_data = all_data[pid]
-
-        # Training features
-        X_tr, y_tr = build_temporal_features(
-            glucose_df=train_data["glucose"],
-            meal_df=train_data["meal"],
-            bolus_df=train_data["bolus"],
-            exercise_df=train_data["exercise"],
-            sleep_df=train_data["sleep"],
-            heart_rate_df=train_data["heart_rate"],
-            steps_df=train_data["steps"],
-        )
-        if len(X_tr) > 0:
-            train_X_all.append(X_tr)
-            train_y_all.append(y_tr)
-            print(f"  Patient {pid} train: {X_tr.shape[0]} samples")
-
-        # Testing features
-        X_te, y_te = build_temporal_features(
-            glucose_df=test_data["glucose"],
-            meal_df=test_data["meal"],
-            bolus_df=test_data["bolus"],
-            exercise_df=test_data["exercise"],
-            sleep_df=test_data["sleep"],
-            heart_rate_df=test_data["heart_rate"],
-            steps_df=test_data["steps"],
-        )
-        if len(X_te) > 0:
-            test_X_all.append(X_te)
-            test_y_all.append(y_te)
-            print(f"  Patient {pid} test:  {X_te.shape[0]} samples")
-
-    X_train = np.vstack(train_X_all)
-    y_train = np.concatenate(train_y_all)
-    X_test = np.vstack(test_X_all)
-    y_test = np.concatenate(test_y_all)
+    train_pids = sorted(sets["training"])
+    test_pids = sorted(sets["testing"])
+    train_keys = [sets["training"][p][0] for p in train_pids]
+    test_keys = [sets["testing"][p][0] for p in test_pids]
+    X_train = np.vstack([sets["training"][p][1] for p in train_pids])
+    y_train = np.concatenate([sets["training"][p][2] for p in train_pids])
+    test_sets = {p: sets["testing"][p][1:] for p in test_pids}
 
     print(f"\n  Total training samples: {X_train.shape[0]}")
-    print(f"  Total test samples:     {X_test.shape[0]}")
+    print(f"  Total test samples:     {sum(len(t[1]) for t in test_sets.values())}")
     print(f"  Feature dimension:      {X_train.shape[1]}")
 
     # ── 3. Scale features ──────────────────────────────────────────────────
     print("\n[3/5] Scaling features ...")
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    scale_key, scaler = scale_stage(cache, train_keys, X_train)
+    X_train_scaled = scaler.transform(X_train)
 
     # ── 4. Train model ─────────────────────────────────────────────────────
     print("\n[4/5] Training Gradient Boosting Regressor ...")
-    model = GradientBoostingRegressor(
-        n_estimators=200,
-        max_depth=6,
-        learning_rate=0.1,
-        min_samples_split=10,
-        min_samples_leaf=5,
-        subsample=0.8,
-        random_state=42,
-        loss="squared_error",
-    )
-    model.fit(X_train_scaled, y_train)
+    fit_key, model = fit_stage(cache, scale_key, train_keys, X_train_scaled, y_train, gbr_params)
 
     # ── 5. Evaluate ────────────────────────────────────────────────────────
     print("\n[5/5] Evaluating ...")
+    metrics = evaluate_stage(
+        cache, fit_key, train_keys, test_keys, model, scaler, X_train_scaled, y_train, test_sets
+    )
+
+    print_metrics(metrics)
+
+    if cache.enabled:
+        print(f"\n  Cache: {len(cache.hits)} stage(s) reused, {len(cache.misses)} recomputed")
+
+    # ── Save ───────────────────────────────────────────────────────────────
+    header = save_model(
+        bundle_path, model, scaler, feature_params, metrics,
+        gbr_params=gbr_params, fit_key=fit_key, train_patients=train_pids, n_train=int(X_train.shape[0]),
+    )
+    save_drift_reference(bundle_path, model, scaler, header)
+
+    print_summary(bundle_path, header, metrics)
+    return model, scaler, metrics
+
+
+def train_from_dataset(
+    dataset_dir: str,
+    gbr_params: Optional[Dict[str, Any]] = None,
+    bundle_path: Optional[str] = None,
+    max_train_rows: Optional[int] = None,
+):
+    """
+    Train from a sharded dataset built by dataset.py. The scaler and the
+    test evaluation stream the memory-mapped shards; the GBR fit itself
+    needs its training matrix in memory (float32, optionally sampled down
+    to `max_train_rows`).
+    """
+    gbr_params = dict(GBR_PARAMS, **(gbr_params or {}))
+
+    print("=" * 60)
+    print("OhioT1DM Temporal Glucose Prediction — Training (sharded dataset)")
+    print("=" * 60)
+
+    print(f"\n[1/4] Opening dataset {dataset_dir} ...")
+    dataset = ShardedDataset(dataset_dir)
+    feature_params = dataset.feature_params
+    bundle_path = resolve_bundle_path(bundle_path, feature_params)
+    n_train, n_test = dataset.rows("training"), dataset.rows("testing")
+    if not n_train or not n_test:
+        print("ERROR: The dataset needs both training and testing rows")
+        sys.exit(1)
+    print(f"  {len(dataset.manifest['shards'])} shard(s), id {dataset.dataset_id}")
+    print(f"  Total training samples: {n_train}")
+    print(f"  Total test samples:     {n_test}")
+    print(f"  Feature dimension:      {dataset.n_features}")
+
+    print("\n[2/4] Scaling features (streamed) ...")
+    scaler = stream_scaler(dataset)
+
+    print("\n[3/4] Training Gradient Boosting Regressor ...")
+    X_train, y_train = dataset.load("training", max_rows=max_train_rows, seed=gbr_params.get("random_state") or 42)
+    if len(y_train) < n_train:
+        print(f"  Sampled {len(y_train):,} of {n_train:,} training rows")
+    X_train_scaled = scaler.transform(X_train)
+    del X_train
+    model = GradientBoostingRegressor(**gbr_params)
+    model.fit(X_train_scaled, y_train)
+
+    print("\n[4/4] Evaluating (streamed) ...")
     y_pred_train = model.predict(X_train_scaled)
-    y_pred_test = model.predict(X_test_scaled)
+    test, per_patient = stream_evaluate(dataset, model, scaler)
+    metrics = {
+        "train": {
+            "mae": float(mean_absolute_error(y_train, y_pred_train)),
+            "rmse": float(np.sqrt(mean_squared_error(y_train, y_pred_train))),
+            "r2": float(r2_score(y_train, y_pred_train)),
+        },
+        "test": test,
+        "per_patient": per_patient,
+    }
+    print_metrics(metrics)
 
-    print("\n=== Training Set ===")
-    print(f"  MAE:  {mean_absolute_error(y_train, y_pred_train):.2f} mg/dL")
-    print(f"  RMSE: {np.sqrt(mean_squared_error(y_train, y_pred_train)):.2f} mg/dL")
-    print(f"  R²:   {r2_score(y_train, y_pred_train):.4f}")
+    header = save_model(
+        bundle_path, model, scaler, feature_params, metrics,
+        gbr_params=gbr_params,
+        dataset_id=dataset.dataset_id,
+        train_patients=[p["id"] for p in dataset.patients("training")],
+        n_train=int(len(y_train)),
+    )
+    save_drift_reference(bundle_path, model, scaler, header)
+    print_summary(bundle_path, header, metrics)
+    return model, scaler, metrics
 
-    print("\n=== Test Set ===")
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-    r2 = r2_score(y_test, y_pred_test)
-    print(f"  MAE:  {mae:.2f} mg/dL")
-    print(f"  RMSE: {rmse:.2f} mg/dL")
-    print(f"  R²:   {r2:.4f}")
 
-    # Clarke Error Grid zones (simplified)
-    within_20 = np.mean(np.abs(y_pred_test - y_test) <= 20) * 100
-    within_40 = np.mean(np.abs(y_pred_test - y_test) <= 40) * 100
-    print(f"\n  Within ±20 mg/dL: {within_20:.1f}%")
-    print(f"  Within ±40 mg/dL: {within_40:.1f}%")
+def parse_overrides(pairs: List[str]) -> Dict[str, Any]:
+    """Parse `key=value` CLI overrides, coercing numbers where possible."""
+    overrides: Dict[str, Any] = {}
+    for pair in pairs:
+        if "=" not in pair:
+            raise ValueError(f"Expected key=value, got '{pair}'")
+        name, raw = pair.split("=", 1)
+        value: Any = raw
+        for cast in (int, float):
+            try:
+                value = cast(raw)
+                break
+            except ValueError:
+                continue
+        if raw in ("None", "none"):
+            value = None
+        overrides[name.strip()] = value
+    return overrides
 
-    # Per-patient evaluation
-    print("\n=== Per-Patient Test MAE ===")
-    offset = 0
-    for pid in PATIENT_IDS:
-        if pid not in all_data:
-            continue
-        test_data = all_data[pid][1]
-        X_p, y_p = build_temporal_features(
-            glucose_df=test_data["glucose"],
-            meal_df=test_data["meal"],
-            bolus_df=test_data["bolus"],
-            exercise_df=test_data["exercise"],
-            sleep_df=test_data["sleep"],
-            heart_rate_df=test_data["heart_rate"],
-            steps_df=test_data["steps"],
-        )
-        if len(X_p) > 0:
-            X_p_scaled = scaler.transform(X_p)
-            y_p_pred = model.predict(X_p_scaled)
-            p_mae = mean_absolute_error(y_p, y_p_pred)
-            print(f"  Patient {pid}: MAE = {p_mae:.2f} mg/dL ({len(X_p)} samples)")
 
-    # ── Save ───────────────────────────────────────────────────────────────
-    model_path = os.path.join(MODEL_DIR, "ohio_glucose_predictor.joblib")
-    scaler_path = os.path.join(MODEL_DIR, "ohio_scaler.joblib")
-    joblib.dump(model, model_path)
-    joblib.dump(scaler, scaler_path)
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Train the OhioT1DM 30-minute glucose predictor.")
+    parser.add_argument("--set", dest="overrides", action="append", default=[],
+                        metavar="KEY=VALUE", help="override a GBR hyperparameter (repeatable)")
+    parser.add_argument("--lookback", type=int, default=FEATURE_PARAMS["lookback"])
+    parser.add_argument("--horizon", type=int, default=FEATURE_PARAMS["prediction_horizon"])
+    parser.add_argument("--cache-dir", default=None, help="stage cache directory (default: ml/cache)")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage and store nothing")
+    parser.add_argument("--dataset", default=None, metavar="DIR",
+                        help="train from a sharded dataset built by dataset.py instead of the XML files")
+    parser.add_argument("--max-train-rows", type=int, default=None,
+                        help="with --dataset, fit on a uniform sample of at most this many rows")
+    parser.add_argument("--families", type=lambda v: [f for f in v.split(",") if f], default=[],
+                        metavar="NAME,...", help="optional feature families (see feature_families.py)")
+    parser.add_argument("--output", default=None, metavar="PATH",
+                        help="bundle to write (default: the served models/ohio_glucose.bundle, "
+                             "or models/ohio_glucose.families.bundle with feature families)")
+    args = parser.parse_args(argv)
 
-    print(f"\n✓ Model saved: {model_path}")
-    print(f"✓ Scaler saved: {scaler_path}")
-    print(f"\n{'=' * 60}")
-    print(f"Training complete! Test MAE: {mae:.2f} mg/dL, R²: {r2:.4f}")
-    print(f"{'=' * 60}")
+    if args.dataset:
+        train_from_dataset(args.dataset, parse_overrides(args.overrides), args.output,
+                           max_train_rows=args.max_train_rows)
+        return
+
+    feature_params: Dict[str, Any] = {"lookback": args.lookback, "prediction_horizon": args.horizon}
+    if args.families:
+        feature_params["families"] = args.families
+    cache = StageCache(enabled=not args.no_cache, **({"root": args.cache_dir} if args.cache_dir else {}))
+    train(gbr_params=parse_overrides(args.overrides), feature_params=feature_params, cache=cache,
+          bundle_path=args.output)
 
 
 if __name__ == "__main__":
-    train()
+    main()
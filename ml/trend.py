@@ -0,0 +1,228 @@
+"""
+Bluely Glucose Trend Analysis
+==============================
+Vectorized trend statistics and rules behind POST /predict-trend and
+POST /predict-trend/bulk.
+
+Many users' reading histories are processed at once as one flat array of
+values plus a `lengths` array (readings per user, oldest → newest).
+Per-user sums are segmented reductions (np.bincount over a segment id),
+which add each user's values in order, so a user's result does not depend
+on who else is in the batch: the single-user endpoint runs the same code
+with a batch of one and returns exactly what the bulk endpoint returns.
+
+Usage:
+    python trend.py readings.csv
+    python trend.py readings.csv --output trends.csv
+
+    readings.csv: user,timestamp,value (any order)
+
+Output:
+    trends.csv — per-user slope, acceleration, CV, direction, predicted
+    next glucose and confidence
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import forecast
+
+MIN_READINGS = 3
+DIRECTION_BAND = 10          # mg/dL change that counts as rising / dropping
+HIGH_ACTIVITY_LEVELS = ("high", "frequent")
+
+# Meal rule codes
+MEAL_NONE, MEAL_RECENT, MEAL_POST, MEAL_EXTENDED = 0, 1, 2, 3
+# Activity rule codes
+ACTIVITY_NONE, ACTIVITY_HIGH, ACTIVITY_RECENT = 0, 1, 2
+# Direction codes
+DROPPING, STABLE, RISING = -1, 0, 1
+
+
+def segment_ids(lengths: np.ndarray) -> np.ndarray:
+    """Segment id of every element of the flat value array."""
+    return np.repeat(np.arange(len(lengths)), lengths)
+
+
+def segment_stats(values: np.ndarray, lengths: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per-user slope (least squares against reading index), rate of change
+    over the last 3 readings, acceleration and coefficient of variation.
+    /predict-trend needs MIN_READINGS readings per user; shorter histories
+    (as /predict-glucose-30 allows) get slope 0 below 2 readings and rate
+    of change 0 below 3.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    n_users = len(lengths)
+    seg = segment_ids(lengths)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    x = np.arange(len(values)) - starts[seg]
+    n = lengths.astype(np.float64)
+
+    def seg_sum(w: np.ndarray) -> np.ndarray:
+        return np.bincount(seg, weights=w, minlength=n_users)
+
+    # Linear regression on recent values (closed form of np.polyfit(x, y, 1)[0])
+    sx, sy = seg_sum(x), seg_sum(values)
+    sxx, sxy = seg_sum(x * x), seg_sum(x * values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    slope = np.where(lengths >= 2, slope, 0.0)
+
+    last = values[ends - 1]
+    # Rate of change (last 3)
+    has3 = lengths >= 3
+    third_last = values[np.where(has3, ends - 3, ends - 1)]
+    rate_of_change = np.where(has3, (last - third_last) / 2, 0.0)
+    # Velocity (acceleration), needs 4 readings
+    has4 = lengths >= 4
+    prev_rate = third_last - values[np.where(has4, ends - 4, ends - 1)]
+    curr_rate = last - values[np.where(has4, ends - 2, ends - 1)]
+    acceleration = np.where(has4, curr_rate - prev_rate, 0.0)
+
+    # Variability (coefficient of variation)
+    mean = sy / n
+    std = np.sqrt(seg_sum((values - mean[seg]) ** 2) / n)
+    cv = np.where(mean > 0, std / np.where(mean > 0, mean, 1.0), 0.0)
+
+    return {
+        "n": lengths,
+        "slope": slope,
+        "rate_of_change": rate_of_change,
+        "acceleration": acceleration,
+        "cv": cv,
+    }
+
+
+def analyze(
+    values: np.ndarray,
+    lengths: np.ndarray,
+    current: np.ndarray,
+    hour: np.ndarray,
+    last_medication_taken: np.ndarray,
+    last_activity: np.ndarray,
+    on_medication: np.ndarray,
+    last_meal_hours: np.ndarray,
+    high_activity: np.ndarray,
+    stats: Optional[Dict[str, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Trend statistics plus the contextual rules of /predict-trend for a
+    batch of users. `last_meal_hours` is NaN when unknown. `stats` reuses a
+    segment_stats result already computed for the same readings. Returns
+    the predicted next glucose, direction, confidence and the rule codes the
+    server turns into factor strings.
+    """
+    if stats is None:
+        stats = segment_stats(values, lengths)
+    current = np.asarray(current, dtype=np.float64)
+    hour = np.asarray(hour)
+    meal_h = np.asarray(last_meal_hours, dtype=np.float64)
+    medication = np.asarray(last_medication_taken, dtype=bool) | np.asarray(on_medication, dtype=bool)
+    high_activity = np.asarray(high_activity, dtype=bool)
+
+    # ------ Contextual factors ------
+    with np.errstate(invalid="ignore"):
+        meal = np.select([meal_h < 1, meal_h < 2, meal_h > 4], [MEAL_RECENT, MEAL_POST, MEAL_EXTENDED],
+                         default=MEAL_NONE)
+    dawn = (hour >= 4) & (hour <= 7)
+    night = ~dawn & ((hour >= 22) | (hour <= 3))
+    time_of_day = np.select([dawn, night], [forecast.TOD_DAWN, forecast.TOD_NIGHT], default=forecast.TOD_NONE)
+    activity = np.select([high_activity, np.asarray(last_activity, dtype=bool)],
+                         [ACTIVITY_HIGH, ACTIVITY_RECENT], default=ACTIVITY_NONE)
+
+    adjustment = (
+        np.select([meal == MEAL_RECENT, meal == MEAL_POST, meal == MEAL_EXTENDED], [15.0, 5.0, -5.0], default=0.0)
+        + np.where(medication, -10.0, 0.0)
+        + np.select([dawn, night], [8.0, -5.0], default=0.0)
+        + np.select([activity == ACTIVITY_HIGH, activity == ACTIVITY_RECENT], [-8.0, -5.0], default=0.0)
+    )
+
+    # ------ Prediction ------
+    raw = current + stats["slope"] * 2 + stats["rate_of_change"] + adjustment + stats["acceleration"] * 0.5
+    predicted = np.clip(raw, 40, 400)
+
+    delta = predicted - current
+    direction = np.select([delta > DIRECTION_BAND, delta < -DIRECTION_BAND], [RISING, DROPPING], default=STABLE)
+
+    # Confidence (higher when more data + lower variability)
+    base_confidence = np.minimum(0.5 + (stats["n"] / 20) * 0.3, 0.8)
+    variability_penalty = np.minimum(stats["cv"] * 0.5, 0.3)
+    confidence = np.maximum(0.3, base_confidence - variability_penalty)
+
+    return {
+        **stats,
+        "adjustment": adjustment,
+        "predicted": predicted,
+        "direction": direction,
+        "confidence": confidence,
+        "meal": meal,
+        "medication": medication,
+        "time_of_day": time_of_day,
+        "activity": activity,
+    }
+
+
+def ragged(histories: List[List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Flat values and lengths from a list of per-user reading lists."""
+    lengths = np.fromiter((len(h) for h in histories), dtype=np.int64, count=len(histories))
+    values = np.fromiter((v for h in histories for v in h), dtype=np.float64, count=int(lengths.sum()))
+    return values, lengths
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Trend analysis for every user in a readings CSV.")
+    parser.add_argument("readings", help="CSV with user,timestamp,value columns")
+    parser.add_argument("--output", default="trends.csv")
+    parser.add_argument("--window", type=int, default=20, help="most recent readings per user")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.readings, parse_dates=["timestamp"]).dropna(subset=["value"])
+    df = df.sort_values(["user", "timestamp"], kind="stable")
+    df = df.groupby("user", sort=False).tail(args.window)
+    lengths_all = df.groupby("user", sort=False).size()
+    keep = lengths_all[lengths_all >= MIN_READINGS].index
+    df = df[df["user"].isin(keep)]
+    lengths = df.groupby("user", sort=False).size()
+    last = df.groupby("user", sort=False).tail(1)
+    print(f"  {len(lengths)} user(s) with ≥{MIN_READINGS} readings "
+          f"({len(lengths_all) - len(lengths)} skipped)")
+
+    t0 = time.perf_counter()
+    n = len(lengths)
+    result = analyze(
+        df["value"].to_numpy(dtype=np.float64), lengths.to_numpy(),
+        current=last["value"].to_numpy(dtype=np.float64),
+        hour=last["timestamp"].dt.hour.to_numpy(),
+        last_medication_taken=np.zeros(n, dtype=bool),
+        last_activity=np.zeros(n, dtype=bool),
+        on_medication=np.zeros(n, dtype=bool),
+        last_meal_hours=np.full(n, np.nan),
+        high_activity=np.zeros(n, dtype=bool),
+    )
+    elapsed = time.perf_counter() - t0
+
+    out = pd.DataFrame({
+        "user": lengths.index,
+        "readings": lengths.to_numpy(),
+        "current": last["value"].to_numpy(),
+        "slope": result["slope"],
+        "acceleration": result["acceleration"],
+        "cv": result["cv"],
+        "direction": pd.Series(result["direction"]).map({RISING: "rising", STABLE: "stable", DROPPING: "dropping"}),
+        "predicted_next": np.round(result["predicted"], 1),
+        "confidence": np.round(result["confidence"], 2),
+    })
+    out.to_csv(args.output, index=False)
+    print(f"  Analysed in {elapsed * 1000:.1f} ms ({n / max(elapsed, 1e-9):,.0f} users/s)")
+    print(f"✓ Trends saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
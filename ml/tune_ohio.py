@@ -0,0 +1,305 @@
+"""
+OhioT1DM Hyperparameter Search
+================================
+Tunes the Gradient Boosting Regressor used by train_ohio.py with
+rolling-origin (time-series) cross-validation over the cached per-patient
+feature matrices.
+
+For each fold the origin moves forward in time: every patient contributes
+the rows before the origin to training, and the next block after a gap
+(lookback + horizon, so no window overlaps the validation target) to
+validation. Nothing from the future is ever used to predict the past.
+
+Candidates are evaluated across a process pool with successive halving:
+every candidate is scored on the most recent fold first, only the best
+1/eta advance to the next rung, which adds more folds, until the survivors
+have been scored on all folds.
+
+The leaderboard reports accuracy alongside predict latency (single-row and
+batched), so a configuration can be picked against the serving budget.
+Latency is measured after the search, in the parent process, one candidate
+at a time on its newest-fold model — not inside workers competing with
+other fits — so it depends on the model rather than on --workers or load.
+
+Usage:
+    python tune_ohio.py
+    python tune_ohio.py --candidates 30 --folds 4 --eta 3 --workers 4
+    python tune_ohio.py --latency-budget-ms 2 --output leaderboard.json
+
+Output:
+    tune_leaderboard.json — ranked candidates with CV metrics and latency
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.preprocessing import StandardScaler
+
+from pipeline import StageCache
+from train_ohio import FEATURE_PARAMS, GBR_PARAMS, build_feature_sets
+
+SEARCH_SPACE: Dict[str, List[Any]] = {
+    "n_estimators": [100, 200, 300],
+    "max_depth": [3, 4, 6],
+    "learning_rate": [0.05, 0.1, 0.2],
+    "subsample": [0.8, 1.0],
+    "min_samples_leaf": [5, 20],
+}
+
+# Per-worker data, filled by _init_worker so matrices are loaded once per
+# process (memory-mapped from the stage cache) rather than pickled per task.
+_WORKER_DATA: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def sample_candidates(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Draw `n` distinct configurations from SEARCH_SPACE (plus the current defaults)."""
+    names = sorted(SEARCH_SPACE)
+    grid = [dict(zip(names, combo)) for combo in itertools.product(*(SEARCH_SPACE[k] for k in names))]
+    rng = np.random.default_rng(seed)
+    picked = [grid[i] for i in rng.permutation(len(grid))[:n]]
+
+    # Always include the current production configuration as a reference.
+    baseline = {k: GBR_PARAMS[k] for k in names}
+    if baseline not in picked:
+        picked = picked[: max(n - 1, 0)] + [baseline]
+    return [dict(GBR_PARAMS, **p) for p in picked]
+
+
+def rolling_origins(
+    lengths: Dict[int, int], n_folds: int, gap: int, min_train_frac: float = 0.5
+) -> List[Dict[int, Tuple[int, int, int]]]:
+    """
+    Per-patient (train_end, val_start, val_end) row indices for each fold.
+
+    The first `min_train_frac` of each patient's series is always training
+    data; the remainder is cut into `n_folds` consecutive validation blocks.
+    Fold order is oldest → newest.
+    """
+    folds: List[Dict[int, Tuple[int, int, int]]] = [{} for _ in range(n_folds)]
+    for pid, n in lengths.items():
+        start = int(n * min_train_frac)
+        block = (n - start) // n_folds
+        if block <= gap:
+            continue
+        for f in range(n_folds):
+            origin = start + f * block
+            folds[f][pid] = (origin, origin + gap, min(origin + block, n))
+    return [fold for fold in folds if fold]
+
+
+def _init_worker(cache_root: str, keys: Dict[int, str]):
+    cache = StageCache(root=cache_root)
+    for pid, key in keys.items():
+        _WORKER_DATA[pid] = cache.load("features", key)
+
+
+def measure_latency(model, scaler: StandardScaler, X: np.ndarray, repeats: int = 200) -> Dict[str, float]:
+    """Median single-row latency (ms) and batched per-row latency (µs), including scaling."""
+    row = X[:1]
+    single = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        model.predict(scaler.transform(row))
+        single.append(time.perf_counter() - t0)
+
+    batch = X[: min(len(X), 1000)]
+    t0 = time.perf_counter()
+    model.predict(scaler.transform(batch))
+    batch_elapsed = time.perf_counter() - t0
+
+    return {
+        "single_ms": float(np.median(single) * 1000),
+        "single_p95_ms": float(np.percentile(single, 95) * 1000),
+        "batch_us_per_row": float(batch_elapsed / len(batch) * 1e6),
+    }
+
+
+def evaluate_fold(task: Tuple[int, Dict[str, Any], int, Dict[int, Tuple[int, int, int]], bool]) -> Dict[str, Any]:
+    """
+    Fit one candidate on one fold and score it on every patient's
+    validation block; with `keep_model`, return the fitted (model, scaler)
+    too, for timing after the search.
+    """
+    cand_id, params, fold_idx, fold, keep_model = task
+    X_tr = np.vstack([_WORKER_DATA[p][0][:end] for p, (end, _, _) in fold.items()])
+    y_tr = np.concatenate([_WORKER_DATA[p][1][:end] for p, (end, _, _) in fold.items()])
+
+    scaler = StandardScaler().fit(X_tr)
+    model = GradientBoostingRegressor(**params)
+    t0 = time.perf_counter()
+    model.fit(scaler.transform(X_tr), y_tr)
+    fit_seconds = time.perf_counter() - t0
+
+    errors = []
+    per_patient = {}
+    for pid, (_, v0, v1) in fold.items():
+        X_v, y_v = _WORKER_DATA[pid][0][v0:v1], _WORKER_DATA[pid][1][v0:v1]
+        err = model.predict(scaler.transform(X_v)) - y_v
+        per_patient[pid] = float(np.abs(err).mean())
+        errors.append(err)
+    errors = np.concatenate(errors)
+
+    return {
+        "candidate": cand_id,
+        "fold": fold_idx,
+        "mae": float(np.abs(errors).mean()),
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "within_20": float(np.mean(np.abs(errors) <= 20) * 100),
+        # Patients are weighted equally so one long series can't dominate.
+        "patient_mae": float(np.mean(list(per_patient.values()))),
+        "fit_seconds": fit_seconds,
+        **({"model": (model, scaler)} if keep_model else {}),
+    }
+
+
+def successive_halving(
+    candidates: List[Dict[str, Any]],
+    folds: List[Dict[int, Tuple[int, int, int]]],
+    pool: ProcessPoolExecutor,
+    eta: int = 3,
+    metric: str = "patient_mae",
+) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Tuple[GradientBoostingRegressor, StandardScaler]]]:
+    """
+    Run successive halving with folds as the resource.
+
+    Rung r scores the survivors on the newest eta**r folds (folds already
+    scored in earlier rungs are reused), then keeps the best 1/eta.
+    Returns the per-candidate summary and every candidate's newest-fold
+    (model, scaler).
+    """
+    results: Dict[int, List[Dict[str, Any]]] = {i: [] for i in range(len(candidates))}
+    models: Dict[int, Tuple[GradientBoostingRegressor, StandardScaler]] = {}
+    alive = list(range(len(candidates)))
+    n_folds = len(folds)
+    rung = 0
+    budget = 1
+
+    while True:
+        budget = min(budget, n_folds)
+        wanted = list(range(n_folds - budget, n_folds))
+        tasks = [
+            (c, candidates[c], f, folds[f], f == n_folds - 1)
+            for c in alive
+            for f in wanted
+            if f not in {r["fold"] for r in results[c]}
+        ]
+        for res in pool.map(evaluate_fold, tasks):
+            if "model" in res:
+                models[res["candidate"]] = res.pop("model")
+            results[res["candidate"]].append(res)
+
+        scores = {c: np.mean([r[metric] for r in results[c]]) for c in alive}
+        print(f"  Rung {rung}: {len(alive)} candidate(s) x {budget} fold(s) — best {metric} "
+              f"{min(scores.values()):.2f} mg/dL")
+        if budget >= n_folds or len(alive) <= 1:
+            break
+        keep = max(1, len(alive) // eta)
+        alive = sorted(alive, key=lambda c: scores[c])[:keep]
+        budget *= eta
+        rung += 1
+
+    summary = {}
+    for c, runs in results.items():
+        if not runs:
+            continue
+        summary[c] = {
+            "params": {k: candidates[c][k] for k in SEARCH_SPACE},
+            "folds_evaluated": len(runs),
+            "survived": c in alive,
+            **{k: float(np.mean([r[k] for r in runs]))
+               for k in ("mae", "rmse", "within_20", "patient_mae", "fit_seconds")},
+        }
+    return summary, models
+
+
+def time_candidates(
+    summary: Dict[int, Dict[str, Any]],
+    models: Dict[int, Tuple[GradientBoostingRegressor, StandardScaler]],
+    X: np.ndarray,
+) -> None:
+    """Add each candidate's predict latency, timed sequentially in this process."""
+    for c, (model, scaler) in models.items():
+        summary[c].update(measure_latency(model, scaler, X))
+
+
+def leaderboard(summary: Dict[int, Dict[str, Any]], latency_budget_ms: Optional[float]) -> List[Dict[str, Any]]:
+    """Rank by folds evaluated (finalists first), then patient-averaged MAE."""
+    rows = sorted(summary.values(), key=lambda s: (-s["folds_evaluated"], s["patient_mae"]))
+    for rank, row in enumerate(rows, 1):
+        row["rank"] = rank
+        row["meets_latency_budget"] = (
+            None if latency_budget_ms is None else row["single_p95_ms"] <= latency_budget_ms
+        )
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Tune the OhioT1DM GBR with rolling-origin CV.")
+    parser.add_argument("--candidates", type=int, default=27, help="number of configurations to try")
+    parser.add_argument("--folds", type=int, default=3, help="rolling-origin folds")
+    parser.add_argument("--eta", type=int, default=3, help="successive-halving reduction factor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--latency-budget-ms", type=float, default=None,
+                        help="flag candidates whose p95 single-row predict exceeds this")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "tune_leaderboard.json"))
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("OhioT1DM Hyperparameter Search — Rolling-Origin CV")
+    print("=" * 60)
+
+    cache = StageCache()
+    print("\n[1/4] Loading cached feature matrices ...")
+    sets = build_feature_sets(cache, FEATURE_PARAMS, verbose=False)["training"]
+    if not sets:
+        raise SystemExit("ERROR: No patient data found. Ensure XML files are in data/ohiot1dm/")
+    lengths = {pid: len(y) for pid, (_, _, y) in sets.items()}
+    gap = FEATURE_PARAMS["lookback"] + FEATURE_PARAMS["prediction_horizon"]
+    folds = rolling_origins(lengths, args.folds, gap)
+    if not folds:
+        raise SystemExit("ERROR: Series too short for the requested number of folds")
+    print(f"  {len(sets)} patient(s), {sum(lengths.values())} samples, {len(folds)} fold(s)")
+
+    candidates = sample_candidates(args.candidates, seed=args.seed)
+    print(f"\n[2/4] Successive halving over {len(candidates)} candidate(s) "
+          f"on {args.workers} worker(s) ...")
+    keys = {pid: key for pid, (key, _, _) in sets.items()}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(cache.root, keys)) as pool:
+        summary, models = successive_halving(candidates, folds, pool, eta=args.eta)
+
+    # Workers are gone: nothing else competes for the CPU while timing
+    print(f"\n[3/4] Timing {len(models)} candidate(s) one at a time ...")
+    X_val = np.vstack([sets[pid][1][v0:v1] for pid, (_, v0, v1) in folds[-1].items()])
+    time_candidates(summary, models, X_val)
+
+    rows = leaderboard(summary, args.latency_budget_ms)
+    print("\n[4/4] Leaderboard")
+    print(f"  {'#':>3} {'folds':>5} {'MAE':>7} {'±20%':>6} {'1-row ms':>9} {'µs/row':>7}  params")
+    for row in rows[:10]:
+        flag = "" if row["meets_latency_budget"] in (None, True) else "  (over budget)"
+        print(f"  {row['rank']:>3} {row['folds_evaluated']:>5} {row['patient_mae']:>7.2f} "
+              f"{row['within_20']:>6.1f} {row['single_ms']:>9.3f} {row['batch_us_per_row']:>7.1f}  "
+              f"{row['params']}{flag}")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "feature_params": FEATURE_PARAMS,
+            "folds": args.folds,
+            "eta": args.eta,
+            "latency_budget_ms": args.latency_budget_ms,
+            "leaderboard": rows,
+        }, f, indent=2)
+    print(f"\n✓ Leaderboard saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+OhioT1DM Glucose Model — Incremental Update
+============================================
+Refreshes models/ohio_glucose.bundle from newly exported app readings
+without refitting the whole corpus.
+
+Only the windows after the bundle's `data_through` timestamp (or --since)
+are featurised — each user's history is cut to those readings plus the
+lookback context and the events the features look back at — so the cost of
+an update grows with the volume of new data, not with total history.
+
+The update is a residual booster: a small GradientBoostingRegressor fitted
+(with a zero init) to the residuals of the current model on the new
+windows, using the bundle's frozen feature scaler. Its trees are appended
+to the bundle's GBR (model_bundle.append_gbr_stages), so the served model
+predicts base(x) + residual(x) with no change to the server. The newest
+--holdout fraction of windows is held back first; if the update does not
+lower MAE there, the bundle is left untouched (unless --force).
+
+Readings CSV: timestamp,value[,user]. Optional meals (timestamp,carbs[,user])
+and medications (timestamp,medication_type,dosage[,user]) exports add meal
+and rapid-insulin context, as in `dataset.py build --source csv`. Files
+ending in .jsonl / .jsonl.gz are read as Mongo collection exports with
+app_export.py (GlucoseReading, Meal, MedicationLog, Activity).
+
+Usage:
+    python update_ohio.py --readings readings.csv
+    python update_ohio.py --readings readings.csv --meals meals.csv --medications meds.csv
+    python update_ohio.py --readings readings.csv --since 2026-10-01 --stages 30 --dry-run
+    python update_ohio.py --readings readings.jsonl --meals meals.jsonl --activities activities.jsonl
+
+Output:
+    models/ohio_glucose.bundle (or --output) with the appended trees, an
+    `updates` history entry and the new `data_through` in its metadata,
+    plus its rebuilt drift reference (<bundle>.drift.json, drift.py)
+"""
+
+import argparse
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+import drift
+from app_export import jsonl_sources
+from dataset import export_sources
+from model_bundle import OHIO_BUNDLE_PATH, append_gbr_stages, component_from_sklearn, load_bundle, write_bundle
+from parse_ohio import build_temporal_features
+
+BOOSTER_PARAMS: Dict[str, Any] = {
+    "n_estimators": 50,
+    "max_depth": 3,
+    "learning_rate": 0.05,
+    "min_samples_leaf": 20,
+    "subsample": 0.8,
+    "random_state": 42,
+}
+
+MIN_SAMPLES = 200
+EVENT_CONTEXT = pd.Timedelta(hours=2)   # longest fixed look-back of any event feature
+
+
+def _trim_events(events: pd.DataFrame, first: pd.Timestamp) -> pd.DataFrame:
+    """Events a window starting at `first` can see: the last one before it, the last 2h, and later."""
+    if len(events) == 0:
+        return events
+    events = events.sort_values("timestamp")
+    times = events["timestamp"].to_numpy()
+    before = np.searchsorted(times, np.datetime64(first), side="left")
+    cut = min(max(before - 1, 0), np.searchsorted(times, np.datetime64(first - EVENT_CONTEXT), side="left"))
+    return events.iloc[cut:]
+
+
+def new_windows(
+    data: Dict[str, pd.DataFrame], since: Optional[pd.Timestamp], feature_params: Dict[str, Any]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Features, targets and sample times for the windows of one user whose
+    current reading is after `since` (all windows when None).
+    """
+    lookback, horizon = feature_params["lookback"], feature_params["prediction_horizon"]
+    glucose = data["glucose"].sort_values("timestamp").reset_index(drop=True)
+    if since is not None:
+        first_new = int(np.searchsorted(glucose["timestamp"].to_numpy(), np.datetime64(since), side="right"))
+        glucose = glucose.iloc[max(first_new - lookback, 0):].reset_index(drop=True)
+    if len(glucose) < lookback + horizon + 1:
+        return np.empty((0, 0)), np.empty(0), np.empty(0, dtype="datetime64[ns]")
+
+    first = glucose["timestamp"].iloc[0]
+    X, y = build_temporal_features(
+        glucose_df=glucose,
+        meal_df=_trim_events(data["meal"], first),
+        bolus_df=_trim_events(data["bolus"], first),
+        exercise_df=_trim_events(data["exercise"], first),
+        sleep_df=_trim_events(data["sleep"], first),
+        heart_rate_df=_trim_events(data["heart_rate"], first),
+        steps_df=_trim_events(data["steps"], first),
+        context=data,  # feature families are vectorized over the full sections
+        **feature_params,
+    )
+    times = glucose["timestamp"].to_numpy()[lookback:lookback + len(y)]
+    return np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64), times
+
+
+def collect_windows(
+    sources, since: Optional[pd.Timestamp], feature_params: Dict[str, Any]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """Stack the new windows of every user, ordered by sample time."""
+    Xs, ys, ts, users = [], [], [], []
+    for user, _, _, _, data in sources:
+        X, y, t = new_windows(data, since, feature_params)
+        print(f"  User {user}: {len(y)} new windows")
+        if len(y):
+            Xs.append(X)
+            ys.append(y)
+            ts.append(t)
+            users.append(str(user))
+    if not ys:
+        return np.empty((0, 0)), np.empty(0), np.empty(0, dtype="datetime64[ns]"), users
+    X, y, t = np.vstack(Xs), np.concatenate(ys), np.concatenate(ts)
+    order = np.argsort(t, kind="stable")
+    return X[order], y[order], t[order], users
+
+
+def update_sources(
+    readings_path: str,
+    meals_path: Optional[str] = None,
+    medications_path: Optional[str] = None,
+    activities_path: Optional[str] = None,
+):
+    """JSONL collection exports or CSV exports, by the readings file extension."""
+    if readings_path.endswith((".jsonl", ".jsonl.gz")):
+        return jsonl_sources(readings_path, meals_path, medications_path, activities_path)
+    return export_sources(readings_path, meals_path, medications_path)
+
+
+def fit_residual_booster(X: np.ndarray, residual: np.ndarray, params: Dict[str, Any]) -> GradientBoostingRegressor:
+    booster = GradientBoostingRegressor(init="zero", loss="squared_error", **params)
+    return booster.fit(X, residual)
+
+
+def update(
+    readings_path: str,
+    meals_path: Optional[str] = None,
+    medications_path: Optional[str] = None,
+    activities_path: Optional[str] = None,
+    bundle_path: str = OHIO_BUNDLE_PATH,
+    output_path: Optional[str] = None,
+    since: Optional[str] = None,
+    booster_params: Optional[Dict[str, Any]] = None,
+    holdout: float = 0.2,
+    min_samples: int = MIN_SAMPLES,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Run one incremental update. Returns the update record (also stored in the bundle)."""
+    booster_params = dict(BOOSTER_PARAMS, **(booster_params or {}))
+    output_path = output_path or bundle_path
+
+    print("=" * 60)
+    print("OhioT1DM Glucose Model — Incremental Update")
+    print("=" * 60)
+
+    print(f"\n[1/4] Loading {bundle_path} ...")
+    bundle = load_bundle(bundle_path, mmap_mode=False)
+    metadata = bundle.metadata
+    feature_params = metadata.get("feature_params", {"prediction_horizon": 6, "lookback": 12})
+    cutoff = pd.Timestamp(since) if since else (pd.Timestamp(metadata["data_through"]) if metadata.get("data_through") else None)
+    print(f"  Version {bundle.version}, {bundle['gbr'].n_trees} trees")
+    print(f"  New windows after: {cutoff.isoformat() if cutoff is not None else '(all readings)'}")
+
+    print("\n[2/4] Building features for new windows ...")
+    t0 = time.perf_counter()
+    X, y, times, users = collect_windows(
+        update_sources(readings_path, meals_path, medications_path, activities_path), cutoff, feature_params
+    )
+    build_seconds = time.perf_counter() - t0
+    print(f"  {len(y)} windows from {len(users)} user(s) in {build_seconds:.2f}s")
+    if len(y) < min_samples:
+        print(f"\n  Only {len(y)} new windows (< {min_samples}); nothing to update.")
+        return {"status": "skipped", "samples": int(len(y))}
+
+    print("\n[3/4] Fitting residual booster ...")
+    t0 = time.perf_counter()
+    scaler, base = bundle["scaler"], bundle["gbr"]
+    X_scaled = scaler.transform(X)
+    residual = y - base.predict(X_scaled)
+
+    n_fit = int(len(y) * (1 - holdout))
+    held = slice(n_fit, None)
+    mae_before = mae_after = None
+    if n_fit < len(y):
+        trial = fit_residual_booster(X_scaled[:n_fit], residual[:n_fit], booster_params)
+        mae_before = float(np.mean(np.abs(residual[held])))
+        mae_after = float(np.mean(np.abs(residual[held] - trial.predict(X_scaled[held]))))
+        print(f"  Holdout ({len(y) - n_fit} newest windows): MAE {mae_before:.2f} → {mae_after:.2f} mg/dL")
+
+    record = {
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "base_version": bundle.version,
+        "since": cutoff.isoformat() if cutoff is not None else None,
+        "data_through": pd.Timestamp(times[-1]).isoformat(),
+        "samples": int(len(y)),
+        "users": len(users),
+        "trees_added": int(booster_params["n_estimators"]),
+        "booster_params": booster_params,
+        "holdout_mae_before": mae_before,
+        "holdout_mae_after": mae_after,
+    }
+    if mae_after is not None and mae_after >= mae_before and not force:
+        print("\n  ⚠ Update does not improve the holdout; bundle left unchanged (use --force to apply).")
+        return dict(record, status="rejected")
+
+    # Refit on every new window now the update is accepted
+    booster = fit_residual_booster(X_scaled, residual, booster_params)
+    fit_seconds = time.perf_counter() - t0
+    print(f"  Fitted {booster_params['n_estimators']} trees on {len(y)} windows in {fit_seconds:.2f}s")
+    if dry_run:
+        print("\n  Dry run: bundle not written.")
+        return dict(record, status="dry_run")
+
+    print("\n[4/4] Appending trees to the bundle ...")
+    gbr = append_gbr_stages(bundle.component("gbr"), component_from_sklearn(booster))
+    new_metadata = {k: v for k, v in metadata.items() if k not in ("version", "created_at")}
+    new_metadata["updates"] = list(metadata.get("updates", [])) + [record]
+    new_metadata["data_through"] = record["data_through"]
+    header = write_bundle(
+        output_path,
+        {"gbr": gbr, "scaler": bundle.component("scaler")},
+        feature_names=bundle.feature_names,
+        metadata=new_metadata,
+    )
+
+    print(f"\n✓ Model bundle saved: {output_path}")
+    print(f"  Version:  {header['metadata']['version']} ({len(gbr[2]['roots'])} trees)")
+    print(f"  Checksum: {header['checksum']}")
+    print(f"  Data through: {record['data_through']}")
+
+    # The new trees change the predictions and residuals the reference describes
+    updated = load_bundle(output_path)
+    reference = drift.write_reference(output_path, updated["gbr"], updated["scaler"], updated.version)
+    if reference is None:
+        print("  ⚠ No OhioT1DM training readings to rebuild the drift reference from")
+    else:
+        print(f"  Drift reference: {reference}")
+    return dict(record, status="applied", version=header["metadata"]["version"])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Incrementally update the OhioT1DM glucose model from new readings.")
+    parser.add_argument("--readings", required=True, help="readings CSV (timestamp,value[,user]) or GlucoseReading JSONL")
+    parser.add_argument("--meals", default=None, help="meals CSV: timestamp,carbs[,user]")
+    parser.add_argument("--medications", default=None, help="medications CSV: timestamp,medication_type,dosage[,user]")
+    parser.add_argument("--activities", default=None, help="Activity JSONL export (JSONL readings only)")
+    parser.add_argument("--bundle", default=OHIO_BUNDLE_PATH)
+    parser.add_argument("--output", default=None, help="output bundle (default: overwrite --bundle)")
+    parser.add_argument("--since", default=None, help="only windows after this time (default: bundle data_through)")
+    parser.add_argument("--stages", type=int, default=BOOSTER_PARAMS["n_estimators"], help="trees to append")
+    parser.add_argument("--learning-rate", type=float, default=BOOSTER_PARAMS["learning_rate"])
+    parser.add_argument("--max-depth", type=int, default=BOOSTER_PARAMS["max_depth"])
+    parser.add_argument("--holdout", type=float, default=0.2, help="newest fraction of windows used to validate")
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument("--force", action="store_true", help="apply even if the holdout MAE does not improve")
+    parser.add_argument("--dry-run", action="store_true", help="fit and validate but do not write the bundle")
+    args = parser.parse_args(argv)
+
+    update(
+        args.readings, args.meals, args.medications, args.activities,
+        bundle_path=args.bundle,
+        output_path=args.output,
+        since=args.since,
+        booster_params={"n_estimators": args.stages, "learning_rate": args.learning_rate, "max_depth": args.max_depth},
+        holdout=args.holdout,
+        min_samples=args.min_samples,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()